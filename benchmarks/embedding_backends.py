@@ -0,0 +1,81 @@
+# benchmarks/embedding_backends.py
+#
+# Compares the PyTorch HuggingFace embedder used by the ingest jobs with the int8 ONNX
+# Runtime backend: documents per second for each, and the cosine similarity between
+# the vectors they produce for the same text. Run it inside the ingest image, e.g.
+#
+#   python benchmarks/embedding_backends.py --model BAAI/bge-base-en-v1.5 --texts chunks.txt
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lambda" / "ingest_job"))
+
+from ingest_utils import OnnxEmbedder  # noqa: E402
+
+WORDS = (
+    "the vector index stores embeddings of every chunk so that similar passages can be "
+    "retrieved quickly while documents are partitioned chunked and embedded in batch jobs"
+).split()
+
+def load_texts(args):
+    if args.texts:
+        texts = [line.strip() for line in Path(args.texts).read_text().splitlines() if line.strip()]
+        return texts[:args.count]
+    # Synthetic chunks of roughly the ingest jobs' chunk sizes
+    generator = random.Random(0)
+    return [" ".join(generator.choices(WORDS, k=generator.randint(20, 150))) for _ in range(args.count)]
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    return dot / (math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b)))
+
+def run(name, build_embedder, texts):
+    started_at = time.perf_counter()
+    embedder = build_embedder()
+    load_seconds = time.perf_counter() - started_at
+
+    # Warm up so one-off initialisation is not counted as throughput
+    embedder.embed_documents(elements=[{"text": text} for text in texts[:8]])
+    started_at = time.perf_counter()
+    elements = embedder.embed_documents(elements=[{"text": text} for text in texts])
+    seconds = time.perf_counter() - started_at
+    print(f"{name:>8}: loaded in {load_seconds:.1f}s, {len(texts) / seconds:.1f} docs/sec")
+    return [element["embeddings"] for element in elements], len(texts) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PyTorch and ONNX embedding backends.")
+    parser.add_argument("--model", default="BAAI/bge-base-en-v1.5")
+    parser.add_argument("--texts", help="file with one text per line; synthetic chunks are used otherwise")
+    parser.add_argument("--count", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--model-dir", default=os.path.join("/tmp", "onnx-models"))
+    args = parser.parse_args()
+
+    from unstructured_ingest.v2.processes.embedder import EmbedderConfig
+
+    texts = load_texts(args)
+    print(f"{len(texts)} text(s), model {args.model}, {os.cpu_count()} CPU(s)")
+
+    pytorch_vectors, pytorch_rate = run("pytorch", lambda: EmbedderConfig(
+        embedding_provider="huggingface",
+        embedding_model_name=args.model,
+    ).get_embedder(), texts)
+    onnx_vectors, onnx_rate = run("onnx", lambda: OnnxEmbedder(
+        args.model, args.model_dir, batch_size=args.batch_size
+    ), texts)
+
+    similarities = sorted(cosine(a, b) for a, b in zip(pytorch_vectors, onnx_vectors))
+    print(f" speedup: {onnx_rate / pytorch_rate:.2f}x")
+    print(
+        f"  cosine: mean {sum(similarities) / len(similarities):.4f}, "
+        f"p1 {similarities[len(similarities) // 100]:.4f}, min {similarities[0]:.4f}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/pinecone_upsert_serialization.py
+#
+# Measures the client-side cost per vector of upserting through the Pinecone client's
+# Index.upsert, which builds an OpenAPI Vector model per vector, against the ingest
+# job's HttpUploader, which posts the vector dicts as JSON. Requests go to a stub of
+# the upsert endpoint in a separate process, and only the CPU time of this process is
+# counted, so the numbers exclude the network and the stub. Run it where the pinecone
+# client is installed (e.g. the ingest image), e.g.
+#
+#   python benchmarks/pinecone_upsert_serialization.py --dimension 768 --batch-size 1000 --batches 20
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lambda" / "ingest_job"))
+
+from pinecone.data import Index  # noqa: E402
+from pinecone_utils import HttpUploader  # noqa: E402
+
+class UpsertHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        payload = json.dumps({"upsertedCount": len(body["vectors"])}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def serve(port_queue):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpsertHandler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_server():
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(port_queue,), daemon=True)
+    server.start()
+    return server, port_queue.get()
+
+def make_batch(args, offset):
+    return [
+        {
+            "id": f"doc-{offset + i}#chunk-{i}",
+            "values": [random.random() for _ in range(args.dimension)],
+            "metadata": {"text": f"chunk {offset + i}", "source": "s3://bucket/doc.pdf", "page": i % 50},
+        }
+        for i in range(args.batch_size)
+    ]
+
+def measure(label, batches, upsert, vectors_per_batch):
+    upsert(batches[0])  # warm up the connection pool
+    start = time.process_time()
+    for batch in batches:
+        upsert(batch)
+    elapsed = time.process_time() - start
+    per_vector_us = elapsed / (len(batches) * vectors_per_batch) * 1e6
+    print(f"{label:<28} {per_vector_us:8.1f} us/vector  ({elapsed:.2f}s CPU for {len(batches)} batches)")
+    return per_vector_us
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--batches", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    server, port = start_server()
+    host = f"http://127.0.0.1:{port}"
+    index = Index(api_key="benchmark", host=host)
+    uploader = HttpUploader(index, host, "benchmark", max_in_flight=1)
+    batches = [make_batch(args, n * args.batch_size) for n in range(args.batches)]
+
+    print(f"{args.batches} batches of {args.batch_size} vectors, dimension {args.dimension}")
+    # Both send one request at a time in batches of the same size
+    baseline = measure(
+        "Index.upsert (Vector models)", batches, lambda b: index.upsert(vectors=b, batch_size=100, show_progress=False), args.batch_size
+    )
+    raw = measure("HttpUploader (dicts)", batches, lambda b: uploader.upsert(b, None), args.batch_size)
+    print(f"HttpUploader is {baseline / raw:.1f}x cheaper per vector on the client")
+
+    server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import inquirer from "inquirer";
+import { envType } from "./envType";
+
+// Vector formats each destination can store
+const dtypeChoices: { [destination: string]: string[] } = {
+  Pinecone: ["float32"],
+  PostgreSQL: ["float32", "float16"],
+  MongoDB: ["float32", "int8"],
+};
+
+// Models whose embeddings can be truncated to their leading dimensions
+const matryoshkaModels = ["text-embedding-3-small", "text-embedding-3-large"];
+
+export async function askCompressionQuestions(
+  envObject: envType,
+  destinationConnector: string
+) {
+  const dtypes = dtypeChoices[destinationConnector] || ["float32"];
+
+  const compression = await inquirer.prompt([
+    {
+      type: "list",
+      name: "vectorDimensions",
+      message:
+        "Truncate vectors to fewer dimensions? (the index or column must use the same dimension)",
+      choices: ["Full", "1024", "512", "256"],
+      when: () =>
+        matryoshkaModels.includes(envObject.embedding_model_name || ""),
+    },
+    {
+      type: "list",
+      name: "vectorDtype",
+      message: "Choose the stored vector format:",
+      choices: ["Default", ...dtypes],
+      when: () => dtypes.length > 1,
+    },
+  ]);
+
+  Object.assign(envObject, {
+    vector_dimensions:
+      !compression.vectorDimensions || compression.vectorDimensions === "Full"
+        ? ""
+        : compression.vectorDimensions,
+    vector_dtype:
+      !compression.vectorDtype || compression.vectorDtype === "Default"
+        ? ""
+        : compression.vectorDtype,
+  });
+
+  return compression;
+}
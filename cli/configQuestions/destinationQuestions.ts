@@ -95,9 +95,20 @@ export async function askDestinationQuestions(envObject: envType) {
           input.trim() !== "" || "Index name cannot be empty.",
       },
     ]);
+    const { pineconeTransport } = await inquirer.prompt([
+      {
+        type: "list",
+        name: "pineconeTransport",
+        message:
+          "Upload to Pinecone over HTTP, or over gRPC with several batches in flight?",
+        choices: ["http", "grpc"],
+        default: "http",
+      },
+    ]);
     Object.assign(envObject, {
       pinecone_api_key: pineconeAPIKey,
       pinecone_index_name: pineconeIndexName,
+      pinecone_transport: pineconeTransport,
     });
   }
 
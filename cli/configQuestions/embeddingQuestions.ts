@@ -24,9 +24,18 @@ export async function askEmbeddingQuestions(envObject: envType) {
         ],
       },
     ]);
+    const { embeddingBackend } = await inquirer.prompt([
+      {
+        type: "list",
+        name: "embeddingBackend",
+        message: "Select the inference backend for the Huggingface model:",
+        choices: ["PyTorch", "ONNX (int8 quantized)"],
+      },
+    ]);
     Object.assign(envObject, {
       embedding_provider: embedding.embeddingProvider.toLowerCase(),
       embedding_model_name: embeddingModelName,
+      embedding_backend: embeddingBackend === "PyTorch" ? "pytorch" : "onnx",
     });
   }
 
@@ -86,5 +95,56 @@ export async function askEmbeddingQuestions(envObject: envType) {
     });
   }
 
+  if (embedding.embeddingProvider === "Bedrock") {
+    const { embeddingModelName } = await inquirer.prompt([
+      {
+        type: "list",
+        name: "embeddingModelName",
+        message: "Select Bedrock embedding model:",
+        choices: [
+          "amazon.titan-embed-text-v2:0",
+          "amazon.titan-embed-text-v1",
+          "cohere.embed-english-v3",
+        ],
+      },
+    ]);
+    Object.assign(envObject, {
+      embedding_provider: embedding.embeddingProvider.toLowerCase(),
+      embedding_model_name: embeddingModelName,
+    });
+  }
+
+  // Remote providers are called concurrently within the account's rate limits
+  if (embedding.embeddingProvider !== "Huggingface") {
+    const rateLimits = await inquirer.prompt([
+      {
+        type: "input",
+        name: "requestsPerMinute",
+        message: "Enter your embedding quota in requests per minute:",
+        default: "500",
+        validate: (input) => /^\d+$/.test(input) || "Enter a whole number.",
+      },
+      {
+        type: "input",
+        name: "tokensPerMinute",
+        message: "Enter your embedding quota in tokens per minute:",
+        default: "1000000",
+        validate: (input) => /^\d+$/.test(input) || "Enter a whole number.",
+      },
+      {
+        type: "list",
+        name: "maxInFlight",
+        message: "Choose the maximum number of concurrent embedding requests per job:",
+        choices: ["4", "8", "16", "32"],
+        default: "8",
+      },
+    ]);
+    Object.assign(envObject, {
+      embedding_requests_per_minute: rateLimits.requestsPerMinute,
+      embedding_tokens_per_minute: rateLimits.tokensPerMinute,
+      embedding_max_in_flight: rateLimits.maxInFlight,
+    });
+  }
+
   return embedding;
 }
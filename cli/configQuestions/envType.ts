@@ -6,10 +6,20 @@ export interface envType {
   s3_notification_prefix?: string;
   pinecone_api_key?: string;
   pinecone_index_name?: string;
+  pinecone_transport?: "http" | "grpc";
   embedding_model_name?: string;
   embedding_provider_api_key?: string;
+  embedding_requests_per_minute?: string;
+  embedding_tokens_per_minute?: string;
+  embedding_max_in_flight?: string;
+  embedding_backend?: "pytorch" | "onnx";
+  vector_dimensions?: string;
+  vector_dtype?: "" | "float32" | "float16" | "int8";
   chunking_strategy?: "basic" | "by_title" | "by_page" | "by_similarity";
   chunking_max_characters?: string;
+  ingest_num_processes?: string;
+  ingest_max_connections?: string;
+  ingest_reprocess?: string;
   mongodb_uri?: string;
   mongodb_database?: string;
   mongodb_collection?: string;
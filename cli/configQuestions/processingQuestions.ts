@@ -0,0 +1,36 @@
+import inquirer from "inquirer";
+import { envType } from "./envType";
+
+export async function askProcessingQuestions(envObject: envType) {
+  const processingSettings = await inquirer.prompt([
+    {
+      type: "list",
+      name: "numProcesses",
+      message: "Choose the number of worker processes per ingest job:",
+      choices: ["Auto", "1", "2", "4"],
+    },
+    {
+      type: "list",
+      name: "maxConnections",
+      message: "Choose the maximum number of destination connections per job:",
+      choices: ["Auto", "4", "8", "16"],
+    },
+    {
+      type: "confirm",
+      name: "reprocess",
+      message: "Reprocess documents whose chunks are already stored?",
+      default: false,
+    },
+  ]);
+
+  // "Auto" leaves the setting empty so it is derived from each job's vCPU and memory
+  const auto = (value: string) => (value === "Auto" ? "" : value);
+
+  Object.assign(envObject, {
+    ingest_num_processes: auto(processingSettings.numProcesses),
+    ingest_max_connections: auto(processingSettings.maxConnections),
+    ingest_reprocess: String(processingSettings.reprocess),
+  });
+
+  return processingSettings;
+}
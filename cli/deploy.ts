@@ -11,6 +11,8 @@ import { askSourceQuestions } from "./configQuestions/sourceQuestions";
 import { askDestinationQuestions } from "./configQuestions/destinationQuestions";
 import { askEmbeddingQuestions } from "./configQuestions/embeddingQuestions";
 import { askChunkQuestions } from "./configQuestions/chunkQuestions";
+import { askCompressionQuestions } from "./configQuestions/compressionQuestions";
+import { askProcessingQuestions } from "./configQuestions/processingQuestions";
 import { askAWSQuestions } from "./configQuestions/awsQuestions";
 
 // Read and display the logo
@@ -42,13 +44,20 @@ program
     const source = await askSourceQuestions(envObject);
     const destination = await askDestinationQuestions(envObject);
     const embedding = await askEmbeddingQuestions(envObject);
+    const compression = await askCompressionQuestions(
+      envObject,
+      destination.destinationConnector
+    );
     const chunkSettings = await askChunkQuestions(envObject);
+    const processingSettings = await askProcessingQuestions(envObject);
 
     const fullConfig = {
       ...source,
       ...destination,
       ...embedding,
+      ...compression,
       ...chunkSettings,
+      ...processingSettings,
     };
 
     console.log("Deploying with the following options:");
@@ -13,9 +13,6 @@ logger.setLevel(logging.INFO)
 dynamodb = boto3.client('dynamodb')
 batch_client = boto3.client('batch')
 
-with open('dropbox_pinecone_ingest.py', 'r') as script_file:
-    app_script = script_file.read()
-
 def get_token_data():
     table_name = os.environ['DYNAMODB_TABLE_NAME']
     response = dynamodb.get_item(
@@ -104,8 +101,18 @@ def add_files(access_token):
                 {'name': 'PINECONE_API_KEY', 'value': pinecone_api_key},
                 {'name': 'EMBEDDING_MODEL_NAME', 'value': embedding_model_name},
                 {'name': 'PINECONE_INDEX_NAME', 'value': pinecone_index_name},
+                {'name': 'PINECONE_TRANSPORT', 'value': os.environ.get('PINECONE_TRANSPORT', '')},
+                {'name': 'PINECONE_RAW_UPSERT', 'value': os.environ.get('PINECONE_RAW_UPSERT', 'true')},
+                {'name': 'PINECONE_API_VERSION', 'value': os.environ.get('PINECONE_API_VERSION', '')},
                 {'name': 'LOCAL_FILE_DOWNLOAD_DIR', 'value': local_file_download_dir},
-                {'name': 'APP_SCRIPT', 'value': app_script},
+                {'name': 'EMBEDDING_CACHE_URL', 'value': os.environ.get('EMBEDDING_CACHE_URL', '')},
+                {'name': 'EMBEDDING_BACKEND', 'value': os.environ.get('EMBEDDING_BACKEND', '')},
+                {'name': 'NUM_PROCESSES', 'value': os.environ.get('INGEST_NUM_PROCESSES', '')},
+                {'name': 'MAX_CONNECTIONS', 'value': os.environ.get('INGEST_MAX_CONNECTIONS', '')},
+                {'name': 'WORK_DIR', 'value': os.environ.get('INGEST_WORK_DIR', '')},
+                {'name': 'REPROCESS', 'value': os.environ.get('INGEST_REPROCESS', 'false')},
+                {'name': 'CHECKPOINT_STAGES', 'value': os.environ.get('INGEST_CHECKPOINT_STAGES', 'false')},
+                {'name': 'METRICS_URL', 'value': os.environ.get('INGEST_METRICS_URL', '')},
             ],
         },
     )
@@ -0,0 +1,21 @@
+# Run an ingest script from the job code bundle
+#
+# The job image runs whatever APP_SCRIPT holds. The job definitions set it to this
+# file, which stays a few hundred bytes however large the ingest code grows, and the
+# ingest code itself ships as a zipped CDK asset in S3 (INGEST_CODE_URL). The bundle
+# is extracted to a temporary directory, which is put on sys.path so the scripts can
+# import their shared modules, and INGEST_SCRIPT is run from it as __main__.
+
+import os
+import runpy
+import sys
+import tempfile
+import zipfile
+import fsspec
+
+code_dir = tempfile.mkdtemp(prefix="ingest_job_")
+with fsspec.open(os.environ["INGEST_CODE_URL"], "rb") as code_file:
+    zipfile.ZipFile(code_file).extractall(code_dir)
+
+sys.path.insert(0, code_dir)
+runpy.run_path(os.path.join(code_dir, os.environ["INGEST_SCRIPT"]), run_name="__main__")
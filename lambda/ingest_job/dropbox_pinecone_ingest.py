@@ -0,0 +1,164 @@
+from dotenv import load_dotenv
+import os
+from pathlib import Path
+from unstructured.chunking.dispatch import chunk
+from unstructured.staging.base import elements_from_dicts, elements_to_dicts
+from unstructured_ingest.v2.pipeline.pipeline import Pipeline
+from unstructured_ingest.v2.processes.partitioner import PartitionerConfig
+from unstructured_ingest.v2.processes.connectors.fsspec.dropbox import (DropboxIndexer, DropboxDownloader, DropboxIndexerConfig, DropboxDownloaderConfig, DropboxAccessConfig, DropboxConnectionConfig)
+from unstructured_ingest.v2.processes.connectors.pinecone import (PineconeConnectionConfig, PineconeAccessConfig, PineconeUploaderConfig, PineconeUploadStager, PineconeUploadStagerConfig)
+from unstructured_ingest.v2.processes.chunker import ChunkerConfig
+from unstructured_ingest.v2.processes.embedder import EmbedderConfig
+from ingest_utils import (
+    CachedEmbedder, EmbeddingCache, IngestMetrics, StageTimer, get_bucketed_embedder, get_metrics_url,
+    get_onnx_embedder, get_partitioner, get_processor_config,
+)
+from pinecone_utils import get_pinecone_uploader
+
+load_dotenv()
+
+def download_file(downloader, file_data):
+    # Returns the local paths of a file. Downloaders return one response per file, or a
+    # list for files they expand, which share the download's time.
+    with StageTimer() as timer:
+        responses = downloader.run(file_data=file_data)
+    responses = responses if isinstance(responses, list) else [responses]
+    for response in responses:
+        ingest_metrics.record(
+            response["path"], "download", Bytes=os.path.getsize(response["path"]),
+            **{name: value / len(responses) for name, value in timer.values.items()},
+        )
+    return [response["path"] for response in responses]
+
+def ingest_file(path, partitioner, chunker_config, embedder, uploader, stager):
+    # The file flows through the stages as in-memory dicts; nothing but the downloaded
+    # file touches the disk, and it is removed once partitioned
+    try:
+        with StageTimer() as timer:
+            elements = partitioner.run(filename=path)
+    finally:
+        Path(path).unlink(missing_ok=True)
+    ingest_metrics.record(path, "partition", Elements=len(elements), **timer.values)
+
+    with StageTimer() as timer:
+        chunks = elements_to_dicts(chunk(
+            elements_from_dicts(elements),
+            chunking_strategy=chunker_config.chunking_strategy,
+            **chunker_config.to_chunking_kwargs()
+        ))
+    ingest_metrics.record(path, "chunk", Chunks=len(chunks), **timer.values)
+
+    tokens = embedding_cache.embedded_tokens
+    with StageTimer() as timer:
+        embedded_chunks = embedder.embed_documents(elements=chunks) if chunks else chunks
+    ingest_metrics.record(
+        path, "embed", Chunks=len(chunks), Tokens=embedding_cache.embedded_tokens - tokens, **timer.values
+    )
+
+    with StageTimer() as timer:
+        vectors = [stager.conform_dict(element_dict=chunk_dict) for chunk_dict in embedded_chunks]
+        upserted_count, batch_latencies = uploader.upsert(vectors, None)
+    ingest_metrics.record(path, "upload", Vectors=upserted_count, BatchLatency=batch_latencies, **timer.values)
+    print(f"{Path(path).name}: {upserted_count} vector(s) uploaded, {upserted_count / timer.values['WallTime']:.0f} vectors/sec.")
+
+def run_streaming(indexer, downloader, partitioner, chunker_config, embedder, uploader):
+    # Ingests the indexed files one after another and returns those that failed. A file
+    # that fails is logged and the others go on, and the metrics summary is written
+    # however the run ends.
+    stager = PineconeUploadStager(upload_stager_config=PineconeUploadStagerConfig())
+    failed_files = []
+    try:
+        for file_data in indexer.run():
+            try:
+                paths = download_file(downloader, file_data)
+            except Exception as e:
+                print(f"Error downloading {file_data.identifier}: {e}")
+                failed_files.append(file_data.identifier)
+                continue
+            for path in paths:
+                try:
+                    ingest_file(path, partitioner, chunker_config, embedder, uploader, stager)
+                except Exception as e:
+                    print(f"Error ingesting {path}: {e}")
+                    failed_files.append(path)
+                ingest_metrics.emit(path)
+    finally:
+        ingest_metrics.write_summary(failed_files)
+    return failed_files
+
+class CachedEmbedderConfig(EmbedderConfig):
+    # The pipeline builds an embedder for every file; they all share the job's cache
+    # and its model, which is loaded once
+    def get_embedder(self):
+        global local_embedder
+        if local_embedder is None:
+            local_embedder = get_bucketed_embedder(super().get_embedder())
+        return CachedEmbedder(local_embedder, embedding_cache)
+
+if __name__ == "__main__":
+    embedding_cache = EmbeddingCache(
+        "huggingface",
+        os.getenv("EMBEDDING_MODEL_NAME"),
+        store_url=os.getenv("EMBEDDING_CACHE_URL"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    )
+    local_embedder = get_onnx_embedder(os.getenv("EMBEDDING_MODEL_NAME"))
+
+    indexer_config = DropboxIndexerConfig(remote_url=os.getenv("DROPBOX_REMOTE_URL"))
+    downloader_config = DropboxDownloaderConfig(download_dir=os.getenv("LOCAL_FILE_DOWNLOAD_DIR"))
+    source_connection_config = DropboxConnectionConfig(
+        access_config=DropboxAccessConfig(
+            token=os.getenv("DROPBOX_ACCESS_TOKEN")
+        )
+    )
+    partitioner_config = PartitionerConfig(
+        partition_by_api=False,
+    )
+    chunker_config = ChunkerConfig(
+        chunking_strategy="basic",
+        chunk_max_characters=1000,
+        chunk_overlap=20
+    )
+    embedder_config = CachedEmbedderConfig(
+        embedding_provider="huggingface",
+        embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME"),
+    )
+
+    failed_files = []
+    if os.getenv("CHECKPOINT_STAGES", "false").lower() == "true":
+        # The unstructured_ingest pipeline writes every stage's output to the work
+        # directory, so a rerun with the same work directory resumes from it
+        Pipeline.from_configs(
+            context=get_processor_config(),
+            indexer_config=indexer_config,
+            downloader_config=downloader_config,
+            source_connection_config=source_connection_config,
+            partitioner_config=partitioner_config,
+            chunker_config=chunker_config,
+            embedder_config=embedder_config,
+            destination_connection_config=PineconeConnectionConfig(
+                access_config=PineconeAccessConfig(
+                    api_key=os.getenv("PINECONE_API_KEY")
+                ),
+                index_name=os.getenv("PINECONE_INDEX_NAME")
+            ),
+            stager_config=PineconeUploadStagerConfig(),
+            uploader_config=PineconeUploaderConfig()
+        ).run()
+    else:
+        # Only the streaming path is instrumented; the pipeline times its own steps
+        ingest_metrics = IngestMetrics("pinecone", get_metrics_url())
+        with get_pinecone_uploader(get_processor_config().max_connections or 1) as uploader:
+            failed_files = run_streaming(
+                DropboxIndexer(connection_config=source_connection_config, index_config=indexer_config),
+                DropboxDownloader(connection_config=source_connection_config, download_config=downloader_config),
+                get_partitioner(),
+                chunker_config,
+                embedder_config.get_embedder(),
+                uploader,
+            )
+    embedding_cache.report()
+
+    # Fail the job so Batch reports it, but only after every file had its turn
+    if failed_files:
+        raise SystemExit(f"Failed to ingest {len(failed_files)} file(s): {failed_files}")
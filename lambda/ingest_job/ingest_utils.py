@@ -0,0 +1,1336 @@
+# lambda/ingest_job/ingest_utils.py
+#
+# The pipeline shared by the ingest scripts: reading manifests, downloading,
+# partitioning, chunking, embedding, checkpointing and metrics. Each script adds its
+# destination's writes. unstructured is imported where it is used, so the helpers
+# that do not partition or chunk also work without it.
+
+import argparse
+import asyncio
+import csv
+import functools
+import hashlib
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import fsspec
+
+# Objects at least this large are downloaded as concurrent byte-range GETs
+RANGED_DOWNLOAD_MIN_BYTES = 64 * 1024 * 1024
+RANGED_DOWNLOAD_PART_BYTES = 16 * 1024 * 1024
+
+# Ingest metrics are printed in CloudWatch Embedded Metric Format under this namespace
+METRICS_NAMESPACE = "vECS/Ingest"
+
+METRIC_UNITS = {
+    "WallTime": "Seconds",
+    "CpuTime": "Seconds",
+    "Bytes": "Bytes",
+    "Elements": "Count",
+    "Chunks": "Count",
+    "Tokens": "Count",
+    "Vectors": "Count",
+    "BatchLatency": "Seconds",
+}
+
+class StageTimer:
+    # Measures the wall time of a stage and the CPU time of the process running it,
+    # which includes whatever the process's other threads did meanwhile
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.values = {
+            "WallTime": time.perf_counter() - self.wall_start,
+            "CpuTime": time.process_time() - self.cpu_start,
+        }
+        return False
+
+class IngestMetrics:
+    # Wall time, CPU time and counts per document and stage. A document's stages are
+    # printed as EMF records once it is written, and the whole job's metrics go to a
+    # JSON summary at the end.
+
+    def __init__(self, destination, summary_url):
+        self.destination = destination
+        self.summary_url = summary_url
+        self.documents = {}
+        self.wall_start = time.perf_counter()
+        # Downloads are recorded from background threads
+        self.lock = threading.Lock()
+
+    def record(self, document, stage, **values):
+        # Values recorded again for the same stage add up, and lists are concatenated
+        with self.lock:
+            stage_values = self.documents.setdefault(document, {}).setdefault(stage, {})
+            for name, value in values.items():
+                stage_values[name] = stage_values.get(name, [] if isinstance(value, list) else 0) + value
+
+    def emit(self, document):
+        with self.lock:
+            stages = {stage: dict(values) for stage, values in self.documents.get(document, {}).items()}
+        for stage, values in stages.items():
+            print(json.dumps({
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Destination", "Stage"]],
+                        "Metrics": [{"Name": name, "Unit": METRIC_UNITS[name]} for name in values],
+                    }],
+                },
+                "Destination": self.destination,
+                "Stage": stage,
+                "Document": document,
+                "JobId": os.getenv("AWS_BATCH_JOB_ID", ""),
+                # EMF takes at most 100 values per metric
+                **{name: value[:100] if isinstance(value, list) else value for name, value in values.items()},
+            }))
+
+    def summary(self, failed_documents):
+        stages = {}
+        for document_stages in self.documents.values():
+            for stage, values in document_stages.items():
+                stage_totals = stages.setdefault(stage, {})
+                for name, value in values.items():
+                    stage_totals[name] = stage_totals.get(name, [] if isinstance(value, list) else 0) + value
+        for stage_totals in stages.values():
+            for name, value in list(stage_totals.items()):
+                if isinstance(value, list):
+                    stage_totals[name] = {"count": len(value), "mean": sum(value) / len(value) if value else 0, "max": max(value, default=0)}
+                elif name not in ("WallTime", "CpuTime") and stage_totals.get("WallTime"):
+                    stage_totals[f"{name}PerSecond"] = value / stage_totals["WallTime"]
+        return {
+            "job_id": os.getenv("AWS_BATCH_JOB_ID", ""),
+            "destination": self.destination,
+            "wall_time": time.perf_counter() - self.wall_start,
+            "documents": len(self.documents),
+            "failed": failed_documents,
+            "stages": stages,
+            "per_document": self.documents,
+        }
+
+    def write_summary(self, failed_documents):
+        # Metrics that cannot be written must not fail the ingest
+        try:
+            with fsspec.open(self.summary_url, "w") as summary_file:
+                json.dump(self.summary(failed_documents), summary_file, indent=2)
+            print(f"Ingest metrics written to {self.summary_url}")
+        except Exception as e:
+            print(f"Error writing the ingest metrics: {e}")
+
+def get_metrics_url():
+    # The add Lambda points METRICS_URL at an S3 prefix, with one summary per Batch job;
+    # local runs write to the working directory
+    if not os.getenv("METRICS_URL"):
+        return "ingest_metrics.json"
+    job_id = os.getenv("AWS_BATCH_JOB_ID", "").replace(":", "-") or f"ingest-{int(time.time())}"
+    return f"{os.getenv('METRICS_URL').rstrip('/')}/{job_id}.json"
+
+class JobCheckpoint:
+    # Durable progress markers of a Batch job, so an attempt Batch retries after a spot
+    # reclaim or an out-of-memory kill resumes where the previous one stopped. Batch
+    # keeps the job ID across attempts, so the markers live under it. Without
+    # CHECKPOINT_URL or outside Batch nothing is saved and window_size is None.
+
+    def __init__(self, checkpoint_url=None, job_id=None, window_size=1000):
+        self.fs = None
+        self.window_size = None
+        if checkpoint_url and job_id:
+            self.fs, store_path = fsspec.core.url_to_fs(checkpoint_url)
+            self.path = f"{store_path.rstrip('/')}/{job_id.replace(':', '-')}"
+            self.window_size = window_size
+            # Local stores such as an EFS mount need the directory; S3 has none to create
+            if "file" in self.fs.protocol:
+                self.fs.makedirs(self.path, exist_ok=True)
+            # The markers earlier attempts saved are listed once, so the ones missing cost
+            # no requests
+            try:
+                self.saved = set(self.fs.find(self.path))
+            except Exception as e:
+                print(f"Error listing the job checkpoint: {e}")
+                self.saved = set()
+
+    def key(self, s3_url, stage):
+        return f"{self.path}/{hashlib.sha256(s3_url.encode()).hexdigest()}.{stage}.json"
+
+    def load(self, s3_url, stage):
+        # A marker that cannot be read only costs the work it would have saved
+        if not self.fs or self.key(s3_url, stage) not in self.saved:
+            return None
+        try:
+            return json.loads(self.fs.cat_file(self.key(s3_url, stage)))
+        except Exception as e:
+            print(f"Error reading the {stage} checkpoint of {s3_url}: {e}")
+            return None
+
+    def save(self, s3_url, stage, value):
+        if not self.fs:
+            return
+        try:
+            self.fs.pipe_file(self.key(s3_url, stage), json.dumps(value).encode())
+            self.saved.add(self.key(s3_url, stage))
+        except Exception as e:
+            print(f"Error writing the {stage} checkpoint of {s3_url}: {e}")
+
+    def clear(self):
+        # The markers of a job that finished are of no further use
+        if not self.fs:
+            return
+        try:
+            self.fs.rm(self.path, recursive=True)
+        except Exception as e:
+            print(f"Error removing the job checkpoint: {e}")
+
+def read_manifest(manifest_url):
+    # A manifest is a JSON list of S3 URLs, or a text object with one S3 URL or one
+    # "bucket,key" row (the S3 Batch Operations CSV format) per line
+    with fsspec.open(manifest_url, "r") as manifest_file:
+        content = manifest_file.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+
+    s3_urls = []
+    for row in csv.reader(content.splitlines()):
+        if not row:
+            continue
+        if row[0].startswith("s3://"):
+            s3_urls.append(row[0])
+        else:
+            s3_urls.append(f"s3://{row[0]}/{urllib.parse.unquote_plus(row[1])}")
+    return s3_urls
+
+def get_s3_urls(args):
+    # Documents and manifests named on the command line take precedence over the
+    # environment the add Lambda sets for Batch jobs
+    if args.s3_urls or args.manifest:
+        s3_urls = list(args.s3_urls)
+        for manifest_url in args.manifest:
+            s3_urls.extend(read_manifest(manifest_url))
+        return list(dict.fromkeys(s3_urls))
+
+    # Jobs read the manifest the add Lambda wrote for them; backfill array jobs only
+    # read their slice of it
+    if os.getenv("MANIFEST_URL"):
+        manifest_urls = read_manifest(os.getenv("MANIFEST_URL"))
+        slice_size = int(os.getenv("MANIFEST_SLICE_SIZE", len(manifest_urls)))
+        array_index = int(os.getenv("AWS_BATCH_JOB_ARRAY_INDEX", "0"))
+        return manifest_urls[array_index * slice_size:(array_index + 1) * slice_size]
+
+    # The parts of a split document name the document directly
+    return [os.getenv("AWS_S3_URL")]
+
+def parse_args(destination):
+    parser = argparse.ArgumentParser(description=f"Ingest S3 documents into {destination}.")
+    parser.add_argument("s3_urls", nargs="*", help="S3 URLs of documents to ingest")
+    parser.add_argument(
+        "--manifest",
+        action="append",
+        default=[],
+        help="URL of a manifest listing documents to ingest (may be repeated)"
+    )
+    return parser.parse_args()
+
+def download_ranges(fs, s3_url, local_path, size, concurrency):
+    # Fetches the object as byte ranges, up to concurrency at a time, and writes each at
+    # its offset in the local file, so one large object uses several connections
+    part_bytes = int(os.getenv("RANGED_DOWNLOAD_PART_BYTES") or RANGED_DOWNLOAD_PART_BYTES)
+    with open(local_path, "wb") as local_file:
+        local_file.truncate(size)
+
+        def fetch_range(start):
+            os.pwrite(local_file.fileno(), fs.cat_file(s3_url, start=start, end=min(start + part_bytes, size)), start)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as range_executor:
+            list(range_executor.map(fetch_range, range(0, size, part_bytes)))
+
+def get_object_path(s3_url):
+    # bucket/key of an object. Objects with the same name under different prefixes or
+    # buckets are different documents, so their chunks and namespaces are keyed on this.
+    return s3_url[len("s3://"):]
+
+def get_data_source(s3_url, info):
+    # The source fields the unstructured S3 connector puts on every element, from the
+    # object's HEAD response
+    last_modified = info.get("LastModified")
+    timestamp = str(last_modified.timestamp()) if last_modified else None
+    return {
+        "url": s3_url,
+        "version": (info.get("ETag") or "").strip('"') or None,
+        "record_locator": {"protocol": "s3", "remote_file_path": s3_url},
+        "date_created": timestamp,
+        "date_modified": timestamp,
+        "date_processed": str(time.time()),
+        "permissions_data": None,
+    }
+
+def hex_chunk_id(digest):
+    return digest[:32]
+
+def assign_chunk_ids(chunks, document, chunk_id=hex_chunk_id):
+    # A chunk's ID is a hash of the embedding model and vector format, the document, the
+    # chunk text and its position among chunks with identical text. Editing one paragraph
+    # therefore only changes the IDs of the chunks it touched, and changing the model,
+    # VECTOR_DIMENSIONS or VECTOR_DTYPE changes them all, so every vector is rewritten.
+    # chunk_id shapes the hex digest into the destination's ID type.
+    text_occurrences = Counter()
+    for chunk_dict in chunks:
+        text_hash = hashlib.sha256(chunk_dict["text"].encode()).hexdigest()
+        text_occurrences[text_hash] += 1
+        chunk_key = ":".join([
+            os.getenv("EMBEDDING_PROVIDER"),
+            os.getenv("EMBEDDING_MODEL_NAME"),
+            os.getenv("VECTOR_DIMENSIONS") or "",
+            os.getenv("VECTOR_DTYPE") or "",
+            document,
+            text_hash,
+            str(text_occurrences[text_hash]),
+        ])
+        chunk_dict["element_id"] = chunk_id(hashlib.sha256(chunk_key.encode()).hexdigest())
+    return chunks
+
+class EmbeddingCache:
+    # Content-addressed embedding vectors keyed by provider, model and chunk text. A
+    # bounded in-process LRU sits in front of an optional shared store (an S3 prefix or
+    # an EFS directory), so a vector computed by one Batch job is reused by later ones.
+
+    def __init__(self, embedding_provider, embedding_model_name, store_url=None, max_entries=10000):
+        self.key_prefix = f"{embedding_provider}:{embedding_model_name}:"
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.fs = None
+        self.hits = 0
+        self.misses = 0
+        # Estimated tokens of the texts that missed the cache and were embedded
+        self.embedded_tokens = 0
+        if store_url:
+            self.fs, self.store_path = fsspec.core.url_to_fs(store_url)
+            # Local stores such as an EFS mount need the directory; S3 has none to create
+            if "file" in self.fs.protocol:
+                self.fs.makedirs(self.store_path, exist_ok=True)
+
+    def key(self, text):
+        return hashlib.sha256((self.key_prefix + text).encode()).hexdigest()
+
+    def remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        vectors = {}
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                vectors[key] = self.memory[key]
+
+        missing_keys = [key for key in keys if key not in vectors]
+        if self.fs and missing_keys:
+            # A store that cannot be read only costs extra embeddings
+            try:
+                stored = self.fs.cat([f"{self.store_path}/{key}" for key in missing_keys], on_error="omit")
+            except Exception as e:
+                print(f"Error reading the embedding cache: {e}")
+                stored = {}
+            for key in missing_keys:
+                data = stored.get(f"{self.store_path}/{key}")
+                if data:
+                    vectors[key] = array("d", data).tolist()
+                    self.remember(key, vectors[key])
+        return vectors
+
+    def put_many(self, vectors):
+        for key, vector in vectors.items():
+            self.remember(key, vector)
+        if self.fs and vectors:
+            try:
+                self.fs.pipe({f"{self.store_path}/{key}": array("d", vector).tobytes() for key, vector in vectors.items()})
+            except Exception as e:
+                print(f"Error writing the embedding cache: {e}")
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        print(f"Embedding cache: {self.hits} hit(s), {self.misses} miss(es), {hit_rate:.1%} hit rate.")
+
+class CachedEmbedder:
+    # Wraps an unstructured_ingest embedder so only texts missing from the cache reach
+    # the model, and a text repeated across chunks is embedded once
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def embed_documents(self, elements):
+        keys = [self.cache.key(element["text"]) for element in elements]
+        vectors = self.cache.get_many(list(set(keys)))
+
+        missing_elements = {}
+        for key, element in zip(keys, elements):
+            if key not in vectors:
+                missing_elements.setdefault(key, element)
+        hits = sum(key in vectors for key in keys)
+        self.cache.hits += hits
+        self.cache.misses += len(keys) - hits
+
+        if missing_elements:
+            self.cache.embedded_tokens += sum(estimate_tokens(element["text"]) for element in missing_elements.values())
+            embedded_elements = self.embedder.embed_documents(
+                elements=[dict(element) for element in missing_elements.values()]
+            )
+            new_vectors = {
+                key: embedded_element["embeddings"]
+                for key, embedded_element in zip(missing_elements, embedded_elements)
+            }
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        for key, element in zip(keys, elements):
+            element["embeddings"] = vectors[key]
+        print(f"Embedding cache: {hits} of {len(elements)} chunk(s) cached.")
+        return elements
+
+# HTTP embedding APIs of the remote providers; Bedrock is called through boto3
+EMBEDDING_API_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "voyageai": "https://api.voyageai.com/v1",
+}
+REMOTE_EMBEDDING_PROVIDERS = {"openai", "voyageai", "bedrock"}
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; only used for rate limiting
+    return len(text) // 4 + 1
+
+class RetryableEmbeddingError(Exception):
+    def __init__(self, message, rate_limited=False, retry_after=None):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    # Admits a request once both the requests-per-minute and the tokens-per-minute
+    # buckets hold enough for it. Each bucket holds ten seconds of its budget. A request
+    # larger than that waits for a full bucket and leaves it in debt. A 429 pauses every
+    # request for the provider's Retry-After and cuts the request rate by a quarter;
+    # each success then recovers 1% of the configured rate.
+
+    BURST_SECONDS = 10
+
+    def __init__(self, requests_per_minute, tokens_per_minute, clock=time.monotonic):
+        self.max_request_rate = requests_per_minute / 60
+        self.request_rate = self.max_request_rate
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = max(1, self.max_request_rate * self.BURST_SECONDS)
+        self.token_capacity = max(1, self.token_rate * self.BURST_SECONDS)
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.clock = clock
+        self.updated_at = clock()
+        self.blocked_until = 0
+        self.lock = None
+
+    def refill(self):
+        now = self.clock()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    def wait_time(self, tokens):
+        self.refill()
+        return max(
+            self.blocked_until - self.clock(),
+            (1 - self.requests) / self.request_rate,
+            (min(tokens, self.token_capacity) - self.tokens) / self.token_rate,
+            0,
+        )
+
+    async def acquire(self, tokens):
+        # The lock is created here because it must belong to the running event loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            wait = self.wait_time(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.wait_time(tokens)
+            self.requests -= 1
+            self.tokens -= tokens
+
+    def on_rate_limited(self, retry_after):
+        self.blocked_until = max(self.blocked_until, self.clock() + retry_after)
+        self.request_rate = max(self.max_request_rate / 100, self.request_rate * 0.75)
+
+    def on_success(self):
+        self.request_rate = min(self.max_request_rate, self.request_rate + self.max_request_rate / 100)
+
+class RemoteEmbedder:
+    # Embeds chunks through a remote provider with up to max_in_flight requests at a
+    # time, throttled by a TokenBucketLimiter, so throughput follows the account's
+    # quota instead of one round trip per batch. 429s, Bedrock throttling, 5xx
+    # responses and connection errors are retried with exponential backoff.
+
+    def __init__(self, provider, model_name, api_key=None, base_url=None, batch_size=64,
+                 max_in_flight=8, requests_per_minute=500, tokens_per_minute=1000000, max_retries=8):
+        self.provider = provider
+        self.model_name = model_name
+        self.api_key = api_key
+        self.base_url = (base_url or EMBEDDING_API_BASE_URLS.get(provider, "")).rstrip("/")
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.limiter = TokenBucketLimiter(requests_per_minute, tokens_per_minute)
+        self.bedrock = None
+        if provider == "bedrock":
+            import boto3
+            self.bedrock = boto3.client("bedrock-runtime")
+            # Titan models embed a single text per request
+            if not model_name.startswith("cohere."):
+                self.batch_size = 1
+
+    def embed_documents(self, elements):
+        started_at = time.monotonic()
+        self.request_count = 0
+        self.rate_limited_count = 0
+        vectors = asyncio.run(self.embed_texts([element["text"] for element in elements]))
+        for element, vector in zip(elements, vectors):
+            element["embeddings"] = vector
+        print(
+            f"Embedded {len(elements)} chunk(s) in {time.monotonic() - started_at:.1f}s with "
+            f"{self.request_count} request(s), {self.rate_limited_count} rate limited."
+        )
+        return elements
+
+    async def embed_texts(self, texts):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_in_flight))
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(self.embed_batch(batch, semaphore) for batch in batches))
+        return [vector for vectors in results for vector in vectors]
+
+    async def embed_batch(self, texts, semaphore):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.limiter.acquire(tokens)
+                self.request_count += 1
+                try:
+                    vectors = await asyncio.get_running_loop().run_in_executor(None, self.request, texts)
+                except RetryableEmbeddingError as e:
+                    if attempt == self.max_retries:
+                        raise RuntimeError(f"{self.provider} embedding failed after {attempt + 1} attempt(s): {e}")
+                    delay = e.retry_after or min(60, 2 ** attempt) * random.uniform(0.5, 1)
+                    if e.rate_limited:
+                        self.rate_limited_count += 1
+                        self.limiter.on_rate_limited(delay)
+                    else:
+                        await asyncio.sleep(delay)
+                    continue
+                self.limiter.on_success()
+                return vectors
+
+    def request(self, texts):
+        if self.bedrock:
+            return self.request_bedrock(texts)
+
+        body = {"model": self.model_name, "input": texts}
+        if self.provider == "voyageai":
+            body["input_type"] = "document"
+        request = urllib.request.Request(
+            f"{self.base_url}/embeddings",
+            data=json.dumps(body).encode(),
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                data = json.load(response)["data"]
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                retry_after = e.headers.get("Retry-After")
+                raise RetryableEmbeddingError(
+                    f"HTTP {e.code}",
+                    rate_limited=e.code == 429,
+                    retry_after=float(retry_after) if retry_after and retry_after.replace(".", "", 1).isdigit() else None,
+                )
+            raise RuntimeError(f"{self.provider} embedding request failed with HTTP {e.code}: {e.read().decode(errors='replace')}")
+        except (urllib.error.URLError, TimeoutError) as e:
+            raise RetryableEmbeddingError(str(e))
+        return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+    def request_bedrock(self, texts):
+        from botocore.exceptions import ClientError
+
+        if self.model_name.startswith("cohere."):
+            body = {"texts": texts, "input_type": "search_document"}
+        else:
+            body = {"inputText": texts[0]}
+        try:
+            response = self.bedrock.invoke_model(modelId=self.model_name, body=json.dumps(body))
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code in ("ThrottlingException", "TooManyRequestsException"):
+                raise RetryableEmbeddingError(error_code, rate_limited=True)
+            if error_code in ("ServiceUnavailableException", "ModelNotReadyException", "InternalServerException"):
+                raise RetryableEmbeddingError(error_code)
+            raise
+        result = json.loads(response["body"].read())
+        return result["embeddings"] if "embeddings" in result else [result["embedding"]]
+
+def plan_batches(lengths, max_batch_tokens, max_batch_size):
+    # Groups the indices of similarly long texts into batches whose padded size (the
+    # batch's length times its longest member) stays within max_batch_tokens. Texts are
+    # taken shortest first, so each one added is the longest of its batch so far.
+    batches = []
+    batch = []
+    for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * lengths[index] > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def padding_efficiency(lengths, batches):
+    # Share of the tokens fed to the model that are real rather than padding
+    padded_tokens = sum(len(batch) * max(lengths[index] for index in batch) for batch in batches)
+    return sum(lengths) / padded_tokens if padded_tokens else 1.0
+
+def report_padding_efficiency(lengths, batches, batch_size):
+    # Compared with batches of batch_size texts sorted by length, which is how
+    # sentence-transformers' encode() batches them
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    sorted_batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    print(
+        f"Padding efficiency: {padding_efficiency(lengths, batches):.0%} in {len(batches)} batch(es), "
+        f"{padding_efficiency(lengths, sorted_batches):.0%} in {len(sorted_batches)} length-sorted batch(es) of {batch_size}."
+    )
+
+class BucketedEmbedder:
+    # Embeds with the SentenceTransformer behind an unstructured_ingest HuggingFace
+    # embedder in batches of similar token length built by plan_batches, so a batch is
+    # only padded to the length of texts like its own and its size follows the token
+    # budget. The model is loaded once, where the unstructured embedder loads it for
+    # every call, and the vectors come back in input order.
+
+    def __init__(self, embedder, max_batch_tokens=8192, max_batch_size=32):
+        self.config = embedder.config
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.client = None
+
+    def embed_texts(self, texts):
+        if self.client is None:
+            self.client = self.config.get_client()
+        lengths = [
+            len(input_ids)
+            for input_ids in self.client.tokenizer(texts, truncation=True, max_length=self.client.max_seq_length)["input_ids"]
+        ]
+        batches = plan_batches(lengths, self.max_batch_tokens, self.max_batch_size)
+        vectors = [None] * len(texts)
+        for batch in batches:
+            batch_vectors = self.client.encode(
+                [texts[index] for index in batch], batch_size=len(batch), **(self.config.encode_kwargs or {})
+            )
+            for index, vector in zip(batch, batch_vectors.tolist()):
+                vectors[index] = vector
+        report_padding_efficiency(lengths, batches, self.max_batch_size)
+        return vectors
+
+    def embed_documents(self, elements):
+        for element, vector in zip(elements, self.embed_texts([element["text"] for element in elements])):
+            element["embeddings"] = vector
+        return elements
+
+def get_bucketed_embedder(embedder):
+    return BucketedEmbedder(
+        embedder,
+        max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS") or 8192),
+        max_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE") or 32),
+    )
+
+# Written last when an export is cached, so its presence means the export is complete
+ONNX_EXPORT_MARKER = "export.json"
+
+def get_onnx_cache_path(cache_url, model_name):
+    # The quantization is specific to the CPU architecture, so each has its own export
+    fs, cache_path = fsspec.core.url_to_fs(cache_url)
+    return fs, f"{cache_path.rstrip('/')}/{model_name.replace('/', '--')}-{platform.machine().lower()}"
+
+def fetch_onnx_model(cache_url, model_name, quantized_dir):
+    # Downloads an export an earlier job cached. The marker is written after the files,
+    # so an export still being uploaded is not used. A cache that cannot be read only
+    # costs an export.
+    try:
+        fs, cache_path = get_onnx_cache_path(cache_url, model_name)
+        if not fs.exists(f"{cache_path}/{ONNX_EXPORT_MARKER}"):
+            return False
+        quantized_dir.mkdir(parents=True, exist_ok=True)
+        fs.get(f"{cache_path}/", f"{quantized_dir}/", recursive=True)
+        print(f"Fetched the int8 ONNX export of {model_name} from {cache_url}")
+        return (quantized_dir / "model_quantized.onnx").exists()
+    except Exception as e:
+        print(f"Error fetching the ONNX export of {model_name}: {e}")
+        return False
+
+def store_onnx_model(cache_url, model_name, quantized_dir):
+    try:
+        fs, cache_path = get_onnx_cache_path(cache_url, model_name)
+        fs.put(f"{quantized_dir}/", f"{cache_path}/", recursive=True)
+        fs.pipe_file(f"{cache_path}/{ONNX_EXPORT_MARKER}", json.dumps({"model": model_name}).encode())
+    except Exception as e:
+        print(f"Error caching the ONNX export of {model_name}: {e}")
+
+class OnnxEmbedder:
+    # Runs a bge model exported to ONNX and quantized to int8 with ONNX Runtime on the
+    # CPU. The export is kept under model_dir and, with a cache_url, stored in S3 by
+    # the first job that makes it, so later jobs download it instead of exporting the
+    # model again. Embeddings are the normalized CLS token, as with the
+    # sentence-transformers bge models.
+
+    def __init__(self, model_name, model_dir, batch_size=32, max_batch_tokens=8192, cache_url=None):
+        import numpy
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        self.numpy = numpy
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        quantized_dir = Path(model_dir) / model_name.replace("/", "--")
+        if not (quantized_dir / "model_quantized.onnx").exists() and not (
+            cache_url and fetch_onnx_model(cache_url, model_name, quantized_dir)
+        ):
+            print(f"Exporting {model_name} to int8 ONNX in {quantized_dir}")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            # Fargate ARM64 runs on Graviton; x86 hosts (e.g. for benchmarking) use VNNI
+            if platform.machine().lower() in ("aarch64", "arm64"):
+                quantization_config = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+            else:
+                quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(model).quantize(save_dir=quantized_dir, quantization_config=quantization_config)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(quantized_dir)
+            if cache_url:
+                store_onnx_model(cache_url, model_name, quantized_dir)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            quantized_dir, file_name="model_quantized.onnx", session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(quantized_dir)
+
+    def embed_texts(self, texts):
+        # Texts are batched by their tokenized length and the vectors returned in input order
+        lengths = [len(input_ids) for input_ids in self.tokenizer(texts, truncation=True, max_length=512)["input_ids"]]
+        batches = plan_batches(lengths, self.max_batch_tokens, self.batch_size)
+        vectors = [None] * len(texts)
+        for batch in batches:
+            inputs = self.tokenizer(
+                [texts[index] for index in batch], padding=True, truncation=True, max_length=512, return_tensors="np"
+            )
+            cls_vectors = self.model(**inputs).last_hidden_state[:, 0]
+            cls_vectors = cls_vectors / self.numpy.linalg.norm(cls_vectors, axis=1, keepdims=True)
+            for index, vector in zip(batch, cls_vectors.tolist()):
+                vectors[index] = vector
+        report_padding_efficiency(lengths, batches, self.batch_size)
+        return vectors
+
+    def embed_documents(self, elements):
+        for element, vector in zip(elements, self.embed_texts([element["text"] for element in elements])):
+            element["embeddings"] = vector
+        return elements
+
+def get_onnx_embedder(model_name):
+    # EMBEDDING_BACKEND=onnx switches the HuggingFace bge models to OnnxEmbedder. Images
+    # without optimum[onnxruntime] keep the PyTorch embedder.
+    if os.getenv("EMBEDDING_BACKEND", "pytorch").lower() != "onnx":
+        return None
+    try:
+        return OnnxEmbedder(
+            model_name,
+            os.getenv("ONNX_MODEL_DIR") or os.path.join(tempfile.gettempdir(), "onnx-models"),
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE") or 32),
+            max_batch_tokens=int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS") or 8192),
+            cache_url=os.getenv("ONNX_MODEL_CACHE_URL"),
+        )
+    except ImportError as e:
+        print(f"ONNX embedding backend unavailable ({e}); using the PyTorch embedder.")
+        return None
+
+def get_embedder():
+    # Remote providers go through the concurrent, rate-limited RemoteEmbedder and the
+    # HuggingFace models through OnnxEmbedder when enabled, otherwise through the
+    # length-bucketed PyTorch embedder; anything else keeps the unstructured_ingest embedder
+    embedding_provider = os.getenv("EMBEDDING_PROVIDER")
+    if embedding_provider in REMOTE_EMBEDDING_PROVIDERS:
+        return RemoteEmbedder(
+            embedding_provider,
+            os.getenv("EMBEDDING_MODEL_NAME"),
+            api_key=os.getenv("EMBEDDING_PROVIDER_API_KEY"),
+            base_url=os.getenv("EMBEDDING_API_BASE_URL"),
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE") or 64),
+            max_in_flight=int(os.getenv("EMBEDDING_MAX_IN_FLIGHT") or 8),
+            requests_per_minute=int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE") or 500),
+            tokens_per_minute=int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE") or 1000000),
+        )
+
+    from unstructured_ingest.v2.processes.embedder import EmbedderConfig
+
+    if embedding_provider == "huggingface":
+        return get_onnx_embedder(os.getenv("EMBEDDING_MODEL_NAME")) or get_bucketed_embedder(EmbedderConfig(
+            embedding_provider=embedding_provider,
+            embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME"),
+        ).get_embedder())
+    return EmbedderConfig(
+        embedding_provider=embedding_provider,
+        embedding_model_name=os.getenv("EMBEDDING_MODEL_NAME"),
+        embedding_api_key=os.getenv("EMBEDDING_PROVIDER_API_KEY"),
+    ).get_embedder()
+
+# Models trained with Matryoshka representation learning, whose leading dimensions are
+# a usable embedding on their own
+MATRYOSHKA_MODELS = {"text-embedding-3-small", "text-embedding-3-large"}
+VECTOR_DTYPE_BYTES = {"float32": 4, "float16": 2, "int8": 1}
+
+class VectorCompressor:
+    # Shrinks the embedder's vectors before upload. Vectors are truncated to dimensions
+    # and re-normalized, and int8 vectors are scaled per vector so their largest
+    # component is 127, which keeps cosine similarity. float16 is left to the
+    # destination, which stores it in its half-precision type.
+
+    def __init__(self, embedder, model_name, dimensions=None, dtype="float32"):
+        if dimensions and model_name not in MATRYOSHKA_MODELS:
+            print(f"Warning: {model_name} is not known to be Matryoshka-trained; truncating it may hurt retrieval.")
+        self.embedder = embedder
+        self.dimensions = dimensions
+        self.dtype = dtype
+
+    def compress(self, vector):
+        if self.dimensions and len(vector) > self.dimensions:
+            vector = vector[:self.dimensions]
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            vector = [value / norm for value in vector]
+        if self.dtype == "int8":
+            scale = 127 / (max(abs(value) for value in vector) or 1.0)
+            vector = [round(value * scale) for value in vector]
+        return vector
+
+    def embed_documents(self, elements):
+        elements = self.embedder.embed_documents(elements=elements)
+        if not elements:
+            return elements
+        full_dimensions = len(elements[0]["embeddings"])
+        for element in elements:
+            element["embeddings"] = self.compress(element["embeddings"])
+        compact_dimensions = len(elements[0]["embeddings"])
+        print(
+            f"Vectors compressed from {full_dimensions} x float32 to {compact_dimensions} x {self.dtype}, "
+            f"{full_dimensions * 4 / (compact_dimensions * VECTOR_DTYPE_BYTES[self.dtype]):.1f}x smaller."
+        )
+        return elements
+
+def get_vector_compressor(embedder, vector_dtypes):
+    # VECTOR_DIMENSIONS and VECTOR_DTYPE turn compression on; vector_dtypes are the
+    # dtypes the destination can store
+    dimensions = int(os.getenv("VECTOR_DIMENSIONS") or 0) or None
+    dtype = os.getenv("VECTOR_DTYPE") or "float32"
+    if dtype not in vector_dtypes:
+        raise ValueError(f"VECTOR_DTYPE {dtype} is not supported by this destination; use one of {', '.join(vector_dtypes)}")
+    if not dimensions and dtype == "float32":
+        return embedder
+    return VectorCompressor(embedder, os.getenv("EMBEDDING_MODEL_NAME"), dimensions, dtype)
+
+# Partition functions for types that never need a layout model, keyed by extension
+TEXT_PARTITIONERS = {
+    ".txt": ("unstructured.partition.text", "partition_text"),
+    ".text": ("unstructured.partition.text", "partition_text"),
+    ".md": ("unstructured.partition.md", "partition_md"),
+    ".markdown": ("unstructured.partition.md", "partition_md"),
+    ".html": ("unstructured.partition.html", "partition_html"),
+    ".htm": ("unstructured.partition.html", "partition_html"),
+    ".eml": ("unstructured.partition.email", "partition_email"),
+    ".msg": ("unstructured.partition.msg", "partition_msg"),
+}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".heic"}
+
+class FastPathPartitioner:
+    # Partitions every file with the cheapest strategy that works for it. Text types go
+    # straight to their partition function and PDFs are read from their text layer;
+    # only PDF pages that yield fewer than min_chars_per_page characters are partitioned
+    # again at hi_res. Images have no text layer and always go to hi_res.
+
+    def __init__(self, min_chars_per_page=50, **partitioner_kwargs):
+        from unstructured_ingest.v2.processes.partitioner import Partitioner, PartitionerConfig
+
+        self.min_chars_per_page = min_chars_per_page
+        self.fast = Partitioner(config=PartitionerConfig(strategy="fast", **partitioner_kwargs))
+        self.hi_res = Partitioner(config=PartitionerConfig(strategy="hi_res", **partitioner_kwargs))
+
+    def run(self, filename):
+        from unstructured.staging.base import elements_to_dicts
+
+        extension = Path(filename).suffix.lower()
+        if extension in TEXT_PARTITIONERS:
+            module_name, function_name = TEXT_PARTITIONERS[extension]
+            partition = getattr(importlib.import_module(module_name), function_name)
+            return self.fast.postprocess(elements_to_dicts(partition(filename=str(filename))))
+        if extension in IMAGE_EXTENSIONS:
+            return self.hi_res.run(filename=filename)
+        if extension == ".pdf":
+            return self.partition_pdf(filename)
+        return self.fast.run(filename=filename)
+
+    def partition_pdf(self, filename):
+        from pypdf import PdfReader
+
+        elements = self.fast.run(filename=filename)
+        chars_per_page = Counter()
+        for element in elements:
+            chars_per_page[element["metadata"].get("page_number", 1)] += len(element.get("text", ""))
+        page_count = len(PdfReader(filename).pages)
+        low_yield_pages = [
+            page_number for page_number in range(1, page_count + 1)
+            if chars_per_page[page_number] < self.min_chars_per_page
+        ]
+        print(f"{Path(filename).name}: {len(low_yield_pages)} of {page_count} page(s) need hi_res.")
+        if not low_yield_pages:
+            return elements
+
+        skipped = set(low_yield_pages)
+        elements = [element for element in elements if element["metadata"].get("page_number", 1) not in skipped]
+        elements += self.partition_pages(filename, low_yield_pages)
+        # The sort is stable, so elements keep their reading order within each page
+        return sorted(elements, key=lambda element: element["metadata"].get("page_number", 1))
+
+    def partition_pages(self, filename, page_numbers):
+        # Copies the pages into a PDF of the same name, so the elements keep the original
+        # filename, and maps their page numbers back to the original document
+        from pypdf import PdfReader, PdfWriter
+
+        reader = PdfReader(filename)
+        writer = PdfWriter()
+        for page_number in page_numbers:
+            writer.add_page(reader.pages[page_number - 1])
+        pages_path = Path(tempfile.mkdtemp(dir=Path(filename).parent)) / Path(filename).name
+        with open(pages_path, "wb") as pages_file:
+            writer.write(pages_file)
+
+        elements = self.hi_res.run(filename=pages_path)
+        for element in elements:
+            element["metadata"]["page_number"] = page_numbers[element["metadata"].get("page_number", 1) - 1]
+        return elements
+
+def get_partitioner():
+    # PARTITION_STRATEGY forces one unstructured strategy for every file; by default the
+    # strategy is picked per file type and, for PDFs, per page
+    from unstructured_ingest.v2.processes.partitioner import Partitioner, PartitionerConfig
+
+    strategy = os.getenv("PARTITION_STRATEGY", "fast_fallback")
+    if strategy == "fast_fallback":
+        return FastPathPartitioner(int(os.getenv("FAST_PATH_MIN_CHARS", "50")), partition_by_api=False)
+    return Partitioner(config=PartitionerConfig(partition_by_api=False, strategy=strategy))
+
+def get_processor_config():
+    # Processing settings come from the add Lambda (or the Dropbox webhook); unset ones
+    # keep the unstructured_ingest defaults. Only the Dropbox job's Pipeline uses work_dir.
+    from unstructured_ingest.v2.interfaces import ProcessorConfig
+
+    settings = {"reprocess": os.getenv("REPROCESS", "false").lower() == "true"}
+    if os.getenv("NUM_PROCESSES"):
+        settings["num_processes"] = int(os.getenv("NUM_PROCESSES"))
+    if os.getenv("MAX_CONNECTIONS"):
+        settings["max_connections"] = int(os.getenv("MAX_CONNECTIONS"))
+    if os.getenv("WORK_DIR"):
+        settings["work_dir"] = os.getenv("WORK_DIR")
+    return ProcessorConfig(**settings)
+
+def limit_worker_threads(threads):
+    # Runs in each partitioning process, so the OCR and BLAS thread pools of the
+    # processes share the container's cores instead of each claiming all of them
+    for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "OMP_THREAD_LIMIT"):
+        os.environ[variable] = str(threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+def run_inline(function, *args):
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+class InlineExecutor:
+    # Stands in for the process pool when the job runs a single process
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer:
+            initializer(*initargs)
+
+    def submit(self, function, *args):
+        return run_inline(function, *args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+# The partitioner of the process, built by init_partition_worker in each worker
+# process, or in the main process when the job runs inline
+partitioner = None
+
+def init_partition_worker(threads=None):
+    global partitioner
+    if threads:
+        limit_worker_threads(threads)
+    partitioner = get_partitioner()
+
+def partition_file(path):
+    # Runs in a worker process, so its stage metrics travel back with the elements
+    with StageTimer() as timer:
+        elements = partitioner.run(filename=path)
+    return elements, timer.values
+
+def split_pdf(local_path, num_processes):
+    # Splits a PDF of more than PDF_SPLIT_PAGES pages into page ranges, each saved under
+    # the document's name so elements keep its filename. Ranges are sized for at least
+    # two per process so that slow (hi_res) ranges even out. Returns (first page, path)
+    # pairs; a document that is not split is a single pair.
+    if num_processes <= 1 or local_path.suffix.lower() != ".pdf":
+        return [(1, local_path)]
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(local_path)
+    page_count = len(reader.pages)
+    if page_count <= int(os.getenv("PDF_SPLIT_PAGES") or 50):
+        return [(1, local_path)]
+
+    range_size = max(int(os.getenv("PDF_MIN_RANGE_PAGES") or 10), math.ceil(page_count / (2 * num_processes)))
+    page_ranges = []
+    for first_page in range(0, page_count, range_size):
+        writer = PdfWriter()
+        for page_index in range(first_page, min(first_page + range_size, page_count)):
+            writer.add_page(reader.pages[page_index])
+        range_path = Path(tempfile.mkdtemp(dir=local_path.parent)) / local_path.name
+        with open(range_path, "wb") as range_file:
+            writer.write(range_file)
+        page_ranges.append((first_page + 1, range_path))
+    print(f"{local_path.name}: {page_count} pages split into {len(page_ranges)} range(s).")
+    return page_ranges
+
+def merge_page_ranges(filename, page_ranges, range_elements):
+    # Concatenates the ranges in page order, shifting their page numbers back to the
+    # document's. Element IDs are only unique within a range, so each element gets one
+    # derived from the document, its position and its text, and parent IDs follow.
+    if len(page_ranges) == 1 and page_ranges[0][0] == 1:
+        return range_elements[0]
+
+    elements = []
+    for (first_page, _), elements_in_range in zip(page_ranges, range_elements):
+        element_ids = {}
+        for element in elements_in_range:
+            metadata = element["metadata"]
+            metadata["page_number"] = metadata.get("page_number", 1) + first_page - 1
+            element_id = hashlib.sha256(
+                f"{filename}:{metadata['page_number']}:{len(elements)}:{element.get('text', '')}".encode()
+            ).hexdigest()[:32]
+            element_ids[element["element_id"]] = element_id
+            element["element_id"] = element_id
+            elements.append(element)
+        for element in elements_in_range:
+            if element["metadata"].get("parent_id") in element_ids:
+                element["metadata"]["parent_id"] = element_ids[element["metadata"]["parent_id"]]
+    return elements
+
+def get_document_part():
+    # (part index, part count) when this job ingests one page range of a PDF the add
+    # Lambda split across an array job, otherwise None
+    if not os.getenv("DOCUMENT_PARTS"):
+        return None
+    return int(os.getenv("AWS_BATCH_JOB_ARRAY_INDEX", "0")), int(os.getenv("DOCUMENT_PARTS"))
+
+def extract_document_part(local_path, part_index, part_count):
+    # Replaces the downloaded PDF with this part's pages, saved under the same name, and
+    # returns the new path with the number of the part's first page
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(local_path)
+    page_count = len(reader.pages)
+    first_page = page_count * part_index // part_count
+    last_page = page_count * (part_index + 1) // part_count
+    writer = PdfWriter()
+    for page_index in range(first_page, last_page):
+        writer.add_page(reader.pages[page_index])
+    part_path = Path(tempfile.mkdtemp(dir=local_path.parent)) / local_path.name
+    with open(part_path, "wb") as part_file:
+        writer.write(part_file)
+    local_path.unlink()
+    print(f"{local_path.name}: part {part_index + 1} of {part_count}, pages {first_page + 1}-{last_page} of {page_count}.")
+    return part_path, first_page + 1
+
+def write_part_ids(parts_url, part_index, chunks):
+    with fsspec.open(f"{parts_url}/{part_index}.json", "w") as part_file:
+        json.dump([chunk_dict["element_id"] for chunk_dict in chunks], part_file)
+
+def read_part_ids(parts_url, part_count):
+    part_ids = set()
+    for part_index in range(part_count):
+        with fsspec.open(f"{parts_url}/{part_index}.json", "r") as part_file:
+            part_ids.update(json.load(part_file))
+    return part_ids
+
+def then(future, function):
+    # Returns a future of function(result of future), called as soon as future completes
+    chained = Future()
+
+    def on_done(done):
+        try:
+            chained.set_result(function(done.result()))
+        except Exception as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+class IngestJob:
+    # The state the documents of one Batch job share on their way through the pipeline:
+    # its metrics, its checkpoint, the embedding cache and the chunking settings. Each
+    # script builds one and passes run() the function that writes a document's chunks
+    # to its destination.
+
+    def __init__(self, destination, chunker_config, embedding_cache, document_part=None, chunk_id=hex_chunk_id):
+        self.chunker_config = chunker_config
+        self.embedding_cache = embedding_cache
+        self.document_part = document_part
+        self.chunk_id = chunk_id
+        self.metrics = IngestMetrics(destination, get_metrics_url())
+        # The data_source metadata of each document downloaded and not yet chunked
+        self.data_sources = {}
+        self.checkpoint = JobCheckpoint(
+            os.getenv("CHECKPOINT_URL"),
+            os.getenv("AWS_BATCH_JOB_ID"),
+            window_size=int(os.getenv("CHECKPOINT_WINDOW_CHUNKS") or 1000),
+        )
+
+    def download(self, s3_url):
+        # Each download gets its own directory so documents with the same name can be
+        # prepared in parallel
+        local_path = Path(tempfile.mkdtemp(dir=os.getenv("LOCAL_FILE_DOWNLOAD_DIR"))) / s3_url.split("/")[-1]
+        fs = fsspec.filesystem(
+            "s3",
+            key=os.getenv("MY_AWS_ACCESS_KEY_ID"),
+            secret=os.getenv("MY_AWS_SECRET_ACCESS_KEY")
+        )
+        with StageTimer() as timer:
+            info = fs.info(s3_url)
+            size = info["size"]
+            if size >= int(os.getenv("RANGED_DOWNLOAD_MIN_BYTES") or RANGED_DOWNLOAD_MIN_BYTES):
+                download_ranges(fs, s3_url, local_path, size, int(os.getenv("DOWNLOAD_CONCURRENCY") or os.getenv("MAX_CONNECTIONS") or 8))
+            else:
+                fs.get(s3_url, str(local_path))
+        self.metrics.record(s3_url, "download", Bytes=size, **timer.values)
+        self.data_sources[s3_url] = get_data_source(s3_url, info)
+        return local_path
+
+    def submit_document(self, executor, s3_url, num_processes, local_path):
+        # Submits the partitioning of a downloaded document, one task per page range. A
+        # part of a split document only partitions its own pages.
+        try:
+            with StageTimer() as timer:
+                partition_path, first_page = local_path, 1
+                if self.document_part:
+                    partition_path, first_page = extract_document_part(local_path, *self.document_part)
+                page_ranges = [
+                    (range_first_page + first_page - 1, path)
+                    for range_first_page, path in split_pdf(partition_path, num_processes)
+                ]
+        except Exception:
+            shutil.rmtree(local_path.parent, ignore_errors=True)
+            raise
+        # Splitting counts towards partitioning
+        self.metrics.record(s3_url, "partition", **timer.values)
+        return local_path, page_ranges, [executor.submit(partition_file, path) for _, path in page_ranges]
+
+    def finish_document(self, s3_url, submitted):
+        # Waits for a document's partitioning, then merges and chunks it
+        from unstructured.chunking.dispatch import chunk
+        from unstructured.staging.base import elements_from_dicts, elements_to_dicts
+
+        local_path, page_ranges, futures = submitted.result()
+        data_source = self.data_sources.pop(s3_url)
+        try:
+            range_results = [future.result() for future in futures]
+            elements = merge_page_ranges(local_path.name, page_ranges, [range_elements for range_elements, _ in range_results])
+        finally:
+            shutil.rmtree(local_path.parent, ignore_errors=True)
+        for _, range_values in range_results:
+            self.metrics.record(s3_url, "partition", **range_values)
+        self.metrics.record(s3_url, "partition", Elements=len(elements))
+
+        with StageTimer() as timer:
+            chunks = elements_to_dicts(chunk(
+                elements_from_dicts(elements),
+                chunking_strategy=self.chunker_config.chunking_strategy,
+                **self.chunker_config.to_chunking_kwargs()
+            ))
+            # The parts of a split document number their chunks independently, so the part
+            # goes into their IDs
+            document = get_object_path(s3_url)
+            chunks = assign_chunk_ids(
+                chunks,
+                f"{document}#{self.document_part[0]}/{self.document_part[1]}" if self.document_part else document,
+                self.chunk_id,
+            )
+            for chunk_dict in chunks:
+                chunk_dict["metadata"]["data_source"] = data_source
+        self.metrics.record(s3_url, "chunk", Chunks=len(chunks), **timer.values)
+        self.save_chunks(s3_url, chunks)
+        return chunks
+
+    def save_chunks(self, s3_url, chunks):
+        # orig_elements holds a compressed copy of every element a chunk was built from,
+        # several times the size of the chunk, so it is left out of the checkpoint. A
+        # document resumed from its saved chunks is written without it.
+        if not self.checkpoint.fs:
+            return
+        self.checkpoint.save(s3_url, "chunks", [
+            dict(chunk_dict, metadata={name: value for name, value in chunk_dict["metadata"].items() if name != "orig_elements"})
+            for chunk_dict in chunks
+        ])
+
+    def prepare_documents(self, s3_urls, num_processes):
+        # Yields (s3_url, future of its chunks) in order. Documents are downloaded in the
+        # background and each is handed to a pool of num_processes processes as soon as it
+        # arrives, with large PDFs split across the pool by page range, while the main
+        # process embeds and writes the documents ahead of them.
+        if num_processes <= 1:
+            executor = InlineExecutor(initializer=init_partition_worker)
+        else:
+            # Documents are handed to the pool from the download threads, so its workers
+            # are spawned rather than forked from this multithreaded process, and each
+            # builds its own partitioner. They are all started here, on the main thread,
+            # before any download begins.
+            executor = ProcessPoolExecutor(
+                max_workers=num_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_partition_worker,
+                initargs=(int(os.getenv("PARTITION_THREADS") or 1),),
+            )
+            for _ in range(num_processes):
+                executor.submit(os.getpid)
+        lookahead = num_processes if num_processes > 1 else 0
+
+        with executor, ThreadPoolExecutor(max_workers=lookahead + 1) as download_executor:
+            pending = deque()
+            for s3_url in s3_urls:
+                # A retried job reuses the chunks an earlier attempt saved instead of
+                # downloading and partitioning the document again
+                saved_chunks = self.checkpoint.load(s3_url, "chunks")
+                if saved_chunks is not None:
+                    print(f"Resuming {s3_url} from its saved chunks.")
+                    pending.append((s3_url, functools.partial(list, saved_chunks)))
+                else:
+                    pending.append((s3_url, functools.partial(self.finish_document, s3_url, then(
+                        download_executor.submit(self.download, s3_url),
+                        functools.partial(self.submit_document, executor, s3_url, num_processes),
+                    ))))
+                if len(pending) > lookahead:
+                    s3_url, finish = pending.popleft()
+                    yield s3_url, run_inline(finish)
+            while pending:
+                s3_url, finish = pending.popleft()
+                yield s3_url, run_inline(finish)
+
+    def plan_upload(self, s3_url, chunks, get_stored, reprocess=False, delete_vanished=True):
+        # Only chunks whose ID is not stored yet (every chunk when reprocessing) are embedded
+        # and uploaded, and only those whose chunk disappeared are deleted. The parts of a
+        # split document leave deleting to its finalizer. The plan is saved, and a retried
+        # job continues it rather than planning again, as the chunks the earlier attempt
+        # uploaded would no longer look new.
+        plan = self.checkpoint.load(s3_url, "upload")
+        if plan is None:
+            with StageTimer() as timer:
+                stored_ids = get_stored()
+            self.metrics.record(s3_url, "diff", **timer.values)
+            plan = {
+                "ids": [chunk_dict["element_id"] for chunk_dict in chunks if reprocess or chunk_dict["element_id"] not in stored_ids],
+                "vanished": list(stored_ids - {chunk_dict["element_id"] for chunk_dict in chunks}) if delete_vanished else [],
+                "written": 0,
+            }
+            self.checkpoint.save(s3_url, "upload", plan)
+        elif plan["written"]:
+            print(f"Resuming {s3_url} after {plan['written']} written chunk(s).")
+        print(f"{s3_url.split('/')[-1]}: {len(chunks)} chunk(s), {len(plan['ids'])} new, {len(plan['vanished'])} vanished.")
+        return plan
+
+    def upload_windows(self, s3_url, chunks, plan, embedder):
+        # Embeds the planned chunks not written yet and yields them a window at a time.
+        # Once the caller has written a window, the progress is saved before the next one
+        # is embedded. Writes are keyed by chunk ID, so a window replayed after a crash
+        # replaces what it wrote rather than duplicating it.
+        chunks_by_id = {chunk_dict["element_id"]: chunk_dict for chunk_dict in chunks}
+        window_size = self.checkpoint.window_size or max(1, len(plan["ids"]))
+        for start in range(plan["written"], len(plan["ids"]), window_size):
+            window_chunks = [chunks_by_id[chunk_id] for chunk_id in plan["ids"][start:start + window_size]]
+            tokens = self.embedding_cache.embedded_tokens
+            with StageTimer() as timer:
+                embedded_chunks = embedder.embed_documents(elements=window_chunks)
+            self.metrics.record(
+                s3_url, "embed", Chunks=len(window_chunks), Tokens=self.embedding_cache.embedded_tokens - tokens, **timer.values
+            )
+            yield embedded_chunks
+            plan["written"] = start + len(window_chunks)
+            self.checkpoint.save(s3_url, "upload", plan)
+
+    def run(self, s3_urls, num_processes, write_document):
+        # Ingests the documents one after another, calling write_document(s3_url, chunks)
+        # to store each. A document that fails is logged and the others go on, and a
+        # retried job skips the documents an earlier attempt finished.
+        s3_urls = [s3_url for s3_url in s3_urls if not self.checkpoint.load(s3_url, "done")]
+
+        failed_urls = []
+        for s3_url, prepared in self.prepare_documents(s3_urls, num_processes):
+            print(f"Ingesting {s3_url}")
+            try:
+                chunks = prepared.result()
+                write_document(s3_url, chunks)
+                if self.document_part:
+                    write_part_ids(os.getenv("PARTS_URL"), self.document_part[0], chunks)
+                self.checkpoint.save(s3_url, "done", True)
+            except Exception as e:
+                print(f"Error ingesting {s3_url}: {e}")
+                failed_urls.append(s3_url)
+            self.metrics.emit(s3_url)
+        self.embedding_cache.report()
+        self.metrics.write_summary(failed_urls)
+
+        # Fail the job so Batch reports it, but only after every document had its turn. A
+        # retry keeps the checkpoint and only ingests the documents that failed.
+        if failed_urls:
+            raise SystemExit(f"Failed to ingest {len(failed_urls)} document(s): {failed_urls}")
+        self.checkpoint.clear()
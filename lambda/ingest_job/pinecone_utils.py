@@ -0,0 +1,261 @@
+# lambda/ingest_job/pinecone_utils.py
+#
+# Pinecone uploads shared by the S3 and Dropbox ingest scripts
+
+import json
+import math
+import os
+import queue
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import urllib3
+
+# Pinecone limits the size of upsert requests, the number of IDs per delete and fetch,
+# and the number of values in a metadata filter's $nin
+PINECONE_UPSERT_BATCH_SIZE = 100
+PINECONE_DELETE_BATCH_SIZE = 1000
+PINECONE_FETCH_BATCH_SIZE = 200
+PINECONE_FILTER_MAX_VALUES = 10000
+
+# Data plane API version of the requests HttpUploader sends, unless PINECONE_API_VERSION
+# names another
+PINECONE_API_VERSION = "2024-07"
+
+class UpsertRequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+def is_retryable(error):
+    # Requests the index rejected fail the same way when retried; throttling, server
+    # errors and dropped connections may not
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (urllib3.exceptions.HTTPError, OSError))
+
+def validate_vectors(vectors):
+    # Checks the vectors once before any batch is sent, so a bad vector fails the
+    # document instead of a whole window of requests with a 400 that retries cannot
+    # fix. NumPy arrays are converted to lists, which is what the JSON body takes.
+    dimension = None
+    for position, vector in enumerate(vectors):
+        if not isinstance(vector["id"], str):
+            raise ValueError(f"Vector {position} has a {type(vector['id']).__name__} ID; Pinecone IDs are strings")
+        values = vector["values"]
+        if hasattr(values, "tolist"):
+            values = vector["values"] = values.tolist()
+        if dimension is None:
+            dimension = len(values)
+        elif len(values) != dimension:
+            raise ValueError(f"Vector {vector['id']} has {len(values)} dimension(s), the others {dimension}")
+        if not all(map(math.isfinite, values)):
+            raise ValueError(f"Vector {vector['id']} has a NaN or infinite value")
+    return vectors
+
+class HttpUploader:
+    # Upserts batches through the HTTP index with up to max_in_flight requests
+    # outstanding. Given the index's host, the vector dicts are posted as JSON straight
+    # to its /vectors/upsert endpoint, so the client does not build an OpenAPI model
+    # for every vector; without it they go through the client's index.upsert. As in
+    # GrpcUploader, a batch that fails is retried on its own after a backoff, and the
+    # upload fails once a batch has used up its attempts, after the other batches
+    # finished. upsert returns the number of vectors the index reports upserted and
+    # each batch's latency. Other index operations go through the client's index, and
+    # close, or leaving a with block, stops the request threads.
+
+    def __init__(self, index, host=None, api_key=None, max_in_flight=8, attempts=3, api_version=PINECONE_API_VERSION):
+        self.index = index
+        self.max_in_flight = max_in_flight
+        self.attempts = attempts
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.send = self.upsert_batch
+        if host:
+            self.url = f"{host if '://' in host else 'https://' + host}/vectors/upsert"
+            self.headers = {
+                "Api-Key": api_key,
+                "Content-Type": "application/json",
+                "X-Pinecone-API-Version": api_version,
+            }
+            self.http = urllib3.PoolManager(maxsize=max_in_flight, retries=False, timeout=urllib3.Timeout(connect=10, read=60))
+            self.send = self.post
+
+    def upsert(self, vectors, namespace):
+        validate_vectors(vectors)
+        batches = deque(
+            (vectors[start:start + PINECONE_UPSERT_BATCH_SIZE], 1)
+            for start in range(0, len(vectors), PINECONE_UPSERT_BATCH_SIZE)
+        )
+        in_flight = {}
+        upserted_count = 0
+        batch_latencies = []
+        errors = []
+        while batches or in_flight:
+            while batches and len(in_flight) < self.max_in_flight:
+                batch, attempt = batches.popleft()
+                in_flight[self.executor.submit(self.send, batch, namespace)] = (batch, attempt)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, attempt = in_flight.pop(future)
+                try:
+                    batch_count, batch_latency = future.result()
+                    upserted_count += batch_count
+                    batch_latencies.append(batch_latency)
+                except Exception as e:
+                    if is_retryable(e) and attempt < self.attempts:
+                        print(f"Retrying a batch of {len(batch)} vector(s) after attempt {attempt} failed: {e}")
+                        time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+                        batches.append((batch, attempt + 1))
+                    else:
+                        errors.append(e)
+        if errors:
+            raise RuntimeError(f"{len(errors)} upsert batch(es) failed after {self.attempts} attempt(s): {errors[0]}")
+        return upserted_count, batch_latencies
+
+    def upsert_batch(self, batch, namespace):
+        started_at = time.perf_counter()
+        response = self.index.upsert(vectors=batch, namespace=namespace)
+        return response.upserted_count, time.perf_counter() - started_at
+
+    def post(self, batch, namespace):
+        body = {"vectors": batch}
+        if namespace:
+            body["namespace"] = namespace
+        started_at = time.perf_counter()
+        response = self.http.request("POST", self.url, body=json.dumps(body, allow_nan=False).encode(), headers=self.headers)
+        if response.status >= 400:
+            raise UpsertRequestError(response.status, response.data.decode(errors="replace"))
+        return json.loads(response.data)["upsertedCount"], time.perf_counter() - started_at
+
+    def close(self):
+        self.executor.shutdown()
+        if self.send == self.post:
+            self.http.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class GrpcUploader:
+    # Upserts batches through the gRPC index with up to max_in_flight requests
+    # outstanding, starting the next batch as soon as any of them completes. A batch
+    # that fails is retried on its own after a backoff, and the upload fails once a
+    # batch has used up its attempts, after the other batches finished. Like
+    # HttpUploader, upsert returns the upserted count and each batch's latency.
+
+    def __init__(self, index, max_in_flight=8, attempts=3):
+        self.index = index
+        self.max_in_flight = max_in_flight
+        self.attempts = attempts
+
+    def upsert(self, vectors, namespace):
+        validate_vectors(vectors)
+        batches = deque(
+            (vectors[start:start + PINECONE_UPSERT_BATCH_SIZE], 1)
+            for start in range(0, len(vectors), PINECONE_UPSERT_BATCH_SIZE)
+        )
+        # gRPC calls the done callbacks on its own threads
+        completed = queue.Queue()
+        in_flight = 0
+        upserted_count = 0
+        batch_latencies = []
+        errors = []
+        while batches or in_flight:
+            while batches and in_flight < self.max_in_flight:
+                batch, attempt = batches.popleft()
+                submitted = (batch, attempt, time.perf_counter())
+                future = self.index.upsert(vectors=batch, namespace=namespace, async_req=True)
+                future.add_done_callback(lambda _, submitted=submitted, future=future: completed.put((submitted, future)))
+                in_flight += 1
+
+            (batch, attempt, submitted_at), future = completed.get()
+            in_flight -= 1
+            try:
+                upserted_count += future.result().upserted_count
+                batch_latencies.append(time.perf_counter() - submitted_at)
+            except Exception as e:
+                if attempt < self.attempts:
+                    print(f"Retrying a batch of {len(batch)} vector(s) after attempt {attempt} failed: {e}")
+                    time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+                    batches.append((batch, attempt + 1))
+                else:
+                    errors.append(e)
+        if errors:
+            raise RuntimeError(f"{len(errors)} upsert batch(es) failed after {self.attempts} attempt(s): {errors[0]}")
+        return upserted_count, batch_latencies
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def get_pinecone_uploader(max_connections):
+    # PINECONE_TRANSPORT=grpc upserts through the gRPC client with max_connections
+    # batches in flight. Images without pinecone-client[grpc] keep the HTTP client.
+    if os.getenv("PINECONE_TRANSPORT", "http").lower() == "grpc":
+        try:
+            from pinecone.grpc import PineconeGRPC
+            return GrpcUploader(
+                PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY")).Index(os.getenv("PINECONE_INDEX_NAME")),
+                max_in_flight=max_connections,
+                attempts=int(os.getenv("PINECONE_UPSERT_ATTEMPTS") or 3),
+            )
+        except ImportError as e:
+            print(f"gRPC Pinecone client unavailable ({e}); using the HTTP client.")
+    from pinecone import Pinecone
+
+    # PINECONE_RAW_UPSERT=false upserts through the client's own request models, for
+    # indexes or API versions the raw requests do not suit
+    pinecone_client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    raw_upsert = os.getenv("PINECONE_RAW_UPSERT", "true").lower() != "false"
+    host = pinecone_client.describe_index(os.getenv("PINECONE_INDEX_NAME")).host
+    return HttpUploader(
+        pinecone_client.Index(host=host, pool_threads=max_connections),
+        host if raw_upsert else None,
+        os.getenv("PINECONE_API_KEY"),
+        max_in_flight=max_connections,
+        attempts=int(os.getenv("PINECONE_UPSERT_ATTEMPTS") or 3),
+        api_version=os.getenv("PINECONE_API_VERSION") or PINECONE_API_VERSION,
+    )
+
+def is_serverless_index():
+    # Only serverless indexes can list vector IDs; pod-based indexes can only fetch
+    # known IDs and delete by metadata filter
+    from pinecone import Pinecone
+
+    description = Pinecone(api_key=os.getenv("PINECONE_API_KEY")).describe_index(os.getenv("PINECONE_INDEX_NAME"))
+    return getattr(description.spec, "serverless", None) is not None
+
+def fetch_stored_ids(index, namespace, vector_ids):
+    # Returns those of vector_ids that are stored in the namespace
+    stored_ids = set()
+    for start in range(0, len(vector_ids), PINECONE_FETCH_BATCH_SIZE):
+        response = index.fetch(ids=vector_ids[start:start + PINECONE_FETCH_BATCH_SIZE], namespace=namespace)
+        stored_ids.update(response.vectors)
+    return stored_ids
+
+def delete_vectors_except(index, namespace, metadata_field, values):
+    # Deletes the vectors of the namespace whose metadata_field is not one of values.
+    # Longer lists than a $nin takes are split across several, all of which must hold.
+    values = list(values)
+    if not values:
+        index.delete(delete_all=True, namespace=namespace)
+        return
+    conditions = [
+        {metadata_field: {"$nin": values[start:start + PINECONE_FILTER_MAX_VALUES]}}
+        for start in range(0, len(values), PINECONE_FILTER_MAX_VALUES)
+    ]
+    index.delete(filter=conditions[0] if len(conditions) == 1 else {"$and": conditions}, namespace=namespace)
+
+def delete_vectors(index, namespace, vector_ids):
+    for start in range(0, len(vector_ids), PINECONE_DELETE_BATCH_SIZE):
+        index.delete(ids=vector_ids[start:start + PINECONE_DELETE_BATCH_SIZE], namespace=namespace)
@@ -0,0 +1,91 @@
+# Start S3 and populate Mongodb
+
+import os
+from pymongo import MongoClient, ReplaceOne
+from unstructured_ingest.v2.processes.chunker import ChunkerConfig
+from ingest_utils import (
+    CachedEmbedder, EmbeddingCache, IngestJob, StageTimer, get_document_part, get_embedder,
+    get_processor_config, get_s3_urls, get_vector_compressor, parse_args, read_part_ids,
+)
+
+def get_stored_ids(collection, s3_url):
+    return {
+        document["element_id"]
+        for document in collection.find({"metadata.data_source.url": s3_url}, {"element_id": 1})
+        if "element_id" in document
+    }
+
+def to_mongodb_document(chunk_dict, vector_dtype=None):
+    # With a VECTOR_DTYPE the vector is stored as a BSON binary vector, a packed array
+    # of that dtype, instead of an array of doubles
+    document = dict(chunk_dict, _id=chunk_dict["element_id"])
+    if vector_dtype:
+        from bson.binary import Binary, BinaryVectorDtype
+
+        document["embeddings"] = Binary.from_vector(document["embeddings"], BinaryVectorDtype[vector_dtype.upper()])
+    return document
+
+def write_document(job, s3_url, chunks, embedder, collection, reprocess=False, vector_dtype=None, delete_vanished=True):
+    plan = job.plan_upload(s3_url, chunks, lambda: get_stored_ids(collection, s3_url), reprocess, delete_vanished)
+
+    for embedded_chunks in job.upload_windows(s3_url, chunks, plan, embedder):
+        # Documents are keyed by chunk ID, so writing a chunk again replaces it
+        with StageTimer() as timer:
+            collection.bulk_write([
+                ReplaceOne({"_id": chunk_dict["element_id"]}, to_mongodb_document(chunk_dict, vector_dtype), upsert=True)
+                for chunk_dict in embedded_chunks
+            ])
+        job.metrics.record(
+            s3_url, "upload", Vectors=len(embedded_chunks), BatchLatency=[timer.values["WallTime"]], **timer.values
+        )
+
+    # Delete after inserting so the document is never missing from the collection
+    if plan["vanished"]:
+        with StageTimer() as timer:
+            collection.delete_many({"metadata.data_source.url": s3_url, "element_id": {"$in": plan["vanished"]}})
+        job.metrics.record(s3_url, "delete", Vectors=len(plan["vanished"]), **timer.values)
+
+def finalize_document(s3_url, parts_url, part_count, collection):
+    # Runs once every part of a split document has succeeded, and deletes the documents
+    # of chunks that none of the parts produced
+    filename = s3_url.split("/")[-1]
+    part_ids = read_part_ids(parts_url, part_count)
+    vanished_ids = list(get_stored_ids(collection, s3_url) - part_ids)
+    print(f"{filename}: {part_count} part(s) complete, {len(part_ids)} chunk(s), {len(vanished_ids)} vanished.")
+    if vanished_ids:
+        collection.delete_many({"metadata.data_source.url": s3_url, "element_id": {"$in": vanished_ids}})
+
+if __name__ == "__main__":
+    args = parse_args("MongoDB")
+
+    processor_config = get_processor_config()
+    collection = MongoClient(os.getenv("MONGODB_URI"))[os.getenv("MONGODB_DATABASE")][os.getenv("MONGODB_COLLECTION")]
+
+    # A split document's finalizer only cleans up after the parts, which did the ingesting,
+    # so it returns before the partitioner and the embedding model are loaded
+    document_part = get_document_part()
+    if os.getenv("FINALIZE_DOCUMENT", "false").lower() == "true":
+        finalize_document(get_s3_urls(args)[0], os.getenv("PARTS_URL"), document_part[1], collection)
+        raise SystemExit()
+
+    # The pipeline components are built once and reused for every document
+    chunker_config = ChunkerConfig(chunking_strategy="by_title")
+    embedding_cache = EmbeddingCache(
+        os.getenv("EMBEDDING_PROVIDER"),
+        os.getenv("EMBEDDING_MODEL_NAME"),
+        store_url=os.getenv("EMBEDDING_CACHE_URL"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    )
+    # BSON binary vectors hold float32 or int8 values
+    vector_dtype = os.getenv("VECTOR_DTYPE") or None
+    embedder = get_vector_compressor(CachedEmbedder(get_embedder(), embedding_cache), ["float32", "int8"])
+
+    job = IngestJob("mongodb", chunker_config, embedding_cache, document_part)
+    job.run(
+        get_s3_urls(args),
+        processor_config.num_processes,
+        lambda s3_url, chunks: write_document(
+            job, s3_url, chunks, embedder, collection, processor_config.reprocess, vector_dtype,
+            delete_vanished=document_part is None,
+        ),
+    )
@@ -0,0 +1,115 @@
+# Start S3 and populate Pinecone
+
+import json
+import os
+from unstructured_ingest.v2.processes.chunker import ChunkerConfig
+from ingest_utils import (
+    CachedEmbedder, EmbeddingCache, IngestJob, StageTimer, get_document_part, get_embedder,
+    get_object_path, get_processor_config, get_s3_urls, get_vector_compressor, parse_args, read_part_ids,
+)
+from pinecone_utils import (
+    delete_vectors, delete_vectors_except, fetch_stored_ids, get_pinecone_uploader, is_serverless_index,
+)
+
+# Element metadata that is too large or too nested to store on a Pinecone vector
+PINECONE_METADATA_EXCLUDE = ["coordinates", "data_source", "orig_elements"]
+
+def to_pinecone_vector(chunk_dict):
+    metadata = {
+        "element_id": chunk_dict["element_id"],
+        "text": chunk_dict["text"],
+        "type": chunk_dict["type"],
+    }
+    for key, value in chunk_dict["metadata"].items():
+        if key in PINECONE_METADATA_EXCLUDE or value is None:
+            continue
+        if isinstance(value, dict):
+            value = json.dumps(value)
+        elif isinstance(value, list):
+            value = [str(item) for item in value]
+        metadata[key] = value
+    return {"id": chunk_dict["element_id"], "values": chunk_dict["embeddings"], "metadata": metadata}
+
+def get_stored_ids(index, namespace, chunk_ids, serverless=True):
+    # Serverless indexes list every stored vector of the document. Pod-based indexes
+    # cannot list IDs, so only the current chunks are looked up; vanished chunks are
+    # then deleted by a filter on their element_id instead of by ID.
+    if serverless:
+        return {vector_id for id_page in index.list(namespace=namespace) for vector_id in id_page}
+    return fetch_stored_ids(index, namespace, list(chunk_ids))
+
+def write_document(job, s3_url, chunks, embedder, uploader, serverless=True, reprocess=False, delete_vanished=True):
+    namespace = get_object_path(s3_url)
+    index = uploader.index
+    chunk_ids = [chunk_dict["element_id"] for chunk_dict in chunks]
+    plan = job.plan_upload(
+        s3_url, chunks, lambda: get_stored_ids(index, namespace, chunk_ids, serverless), reprocess, delete_vanished
+    )
+
+    for embedded_chunks in job.upload_windows(s3_url, chunks, plan, embedder):
+        with StageTimer() as timer:
+            vectors = [to_pinecone_vector(chunk_dict) for chunk_dict in embedded_chunks]
+            upserted_count, batch_latencies = uploader.upsert(vectors, namespace)
+        job.metrics.record(s3_url, "upload", Vectors=upserted_count, BatchLatency=batch_latencies, **timer.values)
+        print(f"{namespace}: {upserted_count} vector(s) upserted, {upserted_count / timer.values['WallTime']:.0f} vectors/sec.")
+
+    # Delete after upserting so the document is never missing from the index
+    with StageTimer() as timer:
+        if serverless:
+            delete_vectors(index, namespace, plan["vanished"])
+        elif delete_vanished:
+            delete_vectors_except(index, namespace, "element_id", chunk_ids)
+    job.metrics.record(s3_url, "delete", Vectors=len(plan["vanished"]), **timer.values)
+
+def finalize_document(s3_url, parts_url, part_count, index, serverless=True):
+    # Runs once every part of a split document has succeeded, and deletes the vectors
+    # of chunks that none of the parts produced
+    namespace = get_object_path(s3_url)
+    part_ids = read_part_ids(parts_url, part_count)
+    if not serverless:
+        print(f"{namespace}: {part_count} part(s) complete, {len(part_ids)} chunk(s).")
+        delete_vectors_except(index, namespace, "element_id", part_ids)
+        return
+    vanished_ids = list(get_stored_ids(index, namespace, part_ids) - part_ids)
+    print(f"{namespace}: {part_count} part(s) complete, {len(part_ids)} chunk(s), {len(vanished_ids)} vanished.")
+    delete_vectors(index, namespace, vanished_ids)
+
+if __name__ == "__main__":
+    args = parse_args("Pinecone")
+
+    processor_config = get_processor_config()
+    uploader = get_pinecone_uploader(processor_config.max_connections or 1)
+    serverless = is_serverless_index()
+
+    with uploader:
+        # A split document's finalizer only cleans up after the parts, which did the ingesting,
+        # so it returns before the partitioner and the embedding model are loaded
+        document_part = get_document_part()
+        if os.getenv("FINALIZE_DOCUMENT", "false").lower() == "true":
+            finalize_document(get_s3_urls(args)[0], os.getenv("PARTS_URL"), document_part[1], uploader.index, serverless)
+            raise SystemExit()
+
+        # The pipeline components are built once and reused for every document
+        chunker_config = ChunkerConfig(
+            chunking_strategy="basic",
+            chunk_max_characters=500,
+            chunk_overlap=20
+        )
+        embedding_cache = EmbeddingCache(
+            os.getenv("EMBEDDING_PROVIDER"),
+            os.getenv("EMBEDDING_MODEL_NAME"),
+            store_url=os.getenv("EMBEDDING_CACHE_URL"),
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        )
+        # Pinecone stores float32 values, so vectors can only be truncated to the index's dimension
+        embedder = get_vector_compressor(CachedEmbedder(get_embedder(), embedding_cache), ["float32"])
+
+        job = IngestJob("pinecone", chunker_config, embedding_cache, document_part)
+        job.run(
+            get_s3_urls(args),
+            processor_config.num_processes,
+            lambda s3_url, chunks: write_document(
+                job, s3_url, chunks, embedder, uploader, serverless, processor_config.reprocess,
+                delete_vanished=document_part is None,
+            ),
+        )
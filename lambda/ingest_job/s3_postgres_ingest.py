@@ -0,0 +1,164 @@
+# Start S3 and populate Postgres
+
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+from unstructured_ingest.v2.processes.chunker import ChunkerConfig
+from ingest_utils import (
+    CachedEmbedder, EmbeddingCache, IngestJob, StageTimer, get_document_part, get_embedder,
+    get_processor_config, get_s3_urls, get_vector_compressor, parse_args, read_part_ids,
+)
+
+# pgvector column type for each embedding dtype the table can store
+PGVECTOR_TYPES = {"float32": "vector", "float16": "halfvec"}
+
+# Element metadata copied into columns of the same name. As in the unstructured
+# Postgres stager, the data_source and coordinates fields have columns of their own.
+metadata_includes = [
+    "system", "layout_width", "layout_height", "points", "url", "version", "date_created",
+    "date_modified", "date_processed", "permissions_data", "record_locator", "category_depth",
+    "parent_id", "attached_filename", "filetype", "last_modified", "file_directory",
+    "filename", "languages", "page_number", "links", "page_name", "link_urls",
+    "link_texts", "sent_from", "sent_to", "subject", "section", "header_footer_type",
+    "emphasized_text_contents", "emphasized_text_tags", "text_as_html", "regex_metadata",
+    "detection_class_prob"
+]
+DATA_SOURCE_COLUMNS = {"url", "version", "date_created", "date_modified", "date_processed", "permissions_data", "record_locator"}
+COORDINATES_COLUMNS = {"system", "layout_width", "layout_height", "points"}
+
+# Column types that need the value converted
+JSONB_COLUMNS = {"points", "permissions_data", "record_locator"}
+TEXT_ARRAY_COLUMNS = {"links", "link_urls", "link_texts", "emphasized_text_tags", "regex_metadata"}
+TIMESTAMP_COLUMNS = {"date_created", "date_modified", "date_processed", "last_modified"}
+
+def to_pgvector_literal(vector, vector_dtype):
+    # Enough significant digits for the column's precision and no more, which keeps
+    # the statements small
+    digits = 5 if vector_dtype == "float16" else 9
+    return "[" + ",".join(f"{value:.{digits}g}" for value in vector) + "]"
+
+def to_column_value(metadata, column):
+    if column in DATA_SOURCE_COLUMNS:
+        value = (metadata.get("data_source") or {}).get(column)
+    elif column in COORDINATES_COLUMNS:
+        value = (metadata.get("coordinates") or {}).get(column)
+    else:
+        value = metadata.get(column)
+    if value is None:
+        return None
+    if column in JSONB_COLUMNS:
+        return json.dumps(value)
+    if column in TEXT_ARRAY_COLUMNS:
+        # Links and regex matches are dicts, stored one JSON string per item
+        items = list(value.items()) if isinstance(value, dict) else value
+        return [item if isinstance(item, str) else json.dumps(item) for item in items]
+    if column in TIMESTAMP_COLUMNS:
+        # The S3 source dates are epoch seconds; the partitioner's are ISO strings
+        try:
+            return datetime.fromtimestamp(float(value), timezone.utc)
+        except ValueError:
+            return value
+    # Other lists map onto their columns as they are; nested metadata is stored as JSON
+    return json.dumps(value) if isinstance(value, dict) else value
+
+def to_postgres_row(chunk_dict, columns, vector_dtype="float32"):
+    metadata = chunk_dict["metadata"]
+    row = [
+        chunk_dict["element_id"], chunk_dict["element_id"], chunk_dict["text"],
+        to_pgvector_literal(chunk_dict["embeddings"], vector_dtype), chunk_dict["type"],
+    ]
+    row.extend(to_column_value(metadata, column) for column in columns)
+    return row
+
+def get_stored_ids(cursor, table_name, s3_url):
+    # The url column holds the document's full S3 URL, so objects with the same name
+    # under different prefixes keep separate rows
+    cursor.execute(f"SELECT id FROM {table_name} WHERE url = %s", (s3_url,))
+    return {str(row[0]) for row in cursor.fetchall()}
+
+def write_document(job, s3_url, chunks, embedder, connection, reprocess=False, vector_dtype="float32", delete_vanished=True):
+    table_name = os.getenv("POSTGRES_TABLE_NAME")
+    with connection, connection.cursor() as cursor:
+        plan = job.plan_upload(s3_url, chunks, lambda: get_stored_ids(cursor, table_name, s3_url), reprocess, delete_vanished)
+
+    # Each window commits on its own, so a retried job keeps the windows written before
+    columns = ["id", "element_id", "text", "embeddings", "type"] + metadata_includes
+    for embedded_chunks in job.upload_windows(s3_url, chunks, plan, embedder):
+        with StageTimer() as timer, connection, connection.cursor() as cursor:
+            # Rows are keyed by chunk ID, so writing a chunk again replaces it
+            execute_values(
+                cursor,
+                f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in columns[1:])}",
+                [to_postgres_row(chunk_dict, metadata_includes, vector_dtype) for chunk_dict in embedded_chunks],
+                template=f"(%s, %s, %s, %s::{PGVECTOR_TYPES[vector_dtype]}, %s" + ", %s" * len(metadata_includes) + ")"
+            )
+        job.metrics.record(
+            s3_url, "upload", Vectors=len(embedded_chunks), BatchLatency=[timer.values["WallTime"]], **timer.values
+        )
+
+    # Delete after inserting so the document is never missing from the table
+    if plan["vanished"]:
+        with StageTimer() as timer, connection, connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table_name} WHERE id = ANY(%s::uuid[])", (plan["vanished"],))
+        job.metrics.record(s3_url, "delete", Vectors=len(plan["vanished"]), **timer.values)
+
+def finalize_document(s3_url, parts_url, part_count, connection):
+    # Runs once every part of a split document has succeeded, and deletes the rows of
+    # chunks that none of the parts produced
+    filename = s3_url.split("/")[-1]
+    table_name = os.getenv("POSTGRES_TABLE_NAME")
+    part_ids = read_part_ids(parts_url, part_count)
+    with connection, connection.cursor() as cursor:
+        vanished_ids = list(get_stored_ids(cursor, table_name, s3_url) - part_ids)
+        print(f"{filename}: {part_count} part(s) complete, {len(part_ids)} chunk(s), {len(vanished_ids)} vanished.")
+        if vanished_ids:
+            cursor.execute(f"DELETE FROM {table_name} WHERE id = ANY(%s::uuid[])", (vanished_ids,))
+
+if __name__ == "__main__":
+    args = parse_args("Postgres")
+
+    processor_config = get_processor_config()
+    connection = psycopg2.connect(
+        dbname=os.getenv("POSTGRES_DB_NAME"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT"),
+    )
+
+    # A split document's finalizer only cleans up after the parts, which did the ingesting,
+    # so it returns before the partitioner and the embedding model are loaded
+    document_part = get_document_part()
+    if os.getenv("FINALIZE_DOCUMENT", "false").lower() == "true":
+        finalize_document(get_s3_urls(args)[0], os.getenv("PARTS_URL"), document_part[1], connection)
+        raise SystemExit()
+
+    # The pipeline components are built once and reused for every document
+    chunker_config = ChunkerConfig(chunking_strategy="by_title")
+    embedding_cache = EmbeddingCache(
+        os.getenv("EMBEDDING_PROVIDER"),
+        os.getenv("EMBEDDING_MODEL_NAME"),
+        store_url=os.getenv("EMBEDDING_CACHE_URL"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    )
+    # float16 vectors go into a halfvec column
+    vector_dtype = os.getenv("VECTOR_DTYPE") or "float32"
+    embedder = get_vector_compressor(CachedEmbedder(get_embedder(), embedding_cache), list(PGVECTOR_TYPES))
+
+    job = IngestJob("postgres", chunker_config, embedding_cache, document_part,
+                    chunk_id=lambda digest: str(uuid.UUID(digest[:32])))
+    try:
+        job.run(
+            get_s3_urls(args),
+            processor_config.num_processes,
+            lambda s3_url, chunks: write_document(
+                job, s3_url, chunks, embedder, connection, processor_config.reprocess, vector_dtype,
+                delete_vanished=document_part is None,
+            ),
+        )
+    finally:
+        connection.close()
@@ -3,6 +3,10 @@ import json
 import os
 import urllib.parse
 from mongodb_utils import delete_from_mongodb
+from ledger_utils import get_ledger
+
+# Ledger of the last ingested version of each object (None disables it)
+ledger = get_ledger()
 
 def lambda_handler(event, context):
     uri = os.environ['MONGODB_URI']
@@ -13,13 +17,15 @@ def lambda_handler(event, context):
         s3_bucket = record['s3']['bucket']['name']
         s3_key = record['s3']['object']['key']
 
-        filename = os.path.basename(s3_key)
+        document_key = urllib.parse.unquote(s3_key).replace('+', ' ').replace('%20', ' ')
 
         try:
-            decoded_filename = urllib.parse.unquote(filename)
-            decoded_filename_with_spaces = decoded_filename.replace('+', ' ').replace('%20', ' ')
-            delete_from_mongodb(decoded_filename_with_spaces, uri, database_name, collection_name)
-            print(f"Deleted File: {decoded_filename_with_spaces} from Bucket: {s3_bucket}")
+            delete_from_mongodb(f"s3://{s3_bucket}/{document_key}", uri, database_name, collection_name)
+            print(f"Deleted File: {document_key} from Bucket: {s3_bucket}")
+
+            # Forget the object so that uploading it again is ingested from scratch
+            if ledger:
+                ledger.delete(s3_bucket, document_key)
         except Exception as e:
             print(f"Error deleting from MongoDB: {e}")
 
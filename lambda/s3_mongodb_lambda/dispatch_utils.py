@@ -0,0 +1,83 @@
+# lambda/s3_mongodb_lambda/dispatch_utils.py
+
+import json
+import time
+import uuid
+from collections import deque
+
+class MicroBatcher:
+    # Accumulates objects and hands them to on_flush in groups. A group is flushed once
+    # it holds max_objects objects or max_bytes bytes, or once its oldest object has
+    # waited max_wait_seconds. An object larger than max_bytes is flushed on its own.
+
+    def __init__(self, on_flush, max_objects, max_bytes, max_wait_seconds, clock=time.monotonic):
+        self.on_flush = on_flush
+        self.max_objects = max_objects
+        self.max_bytes = max_bytes
+        self.max_wait_seconds = max_wait_seconds
+        self.clock = clock
+        self.items = []
+        self.size = 0
+        self.started_at = None
+
+    def add(self, item, size=0):
+        # Close the current group first if this object would push it past the byte limit
+        if self.items and self.size + size > self.max_bytes:
+            self.flush()
+
+        if not self.items:
+            self.started_at = self.clock()
+        self.items.append(item)
+        self.size += size
+
+        if len(self.items) >= self.max_objects or self.size >= self.max_bytes:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.items and self.clock() - self.started_at >= self.max_wait_seconds:
+            self.flush()
+
+    def flush(self):
+        if not self.items:
+            return
+        items = self.items
+        self.items = []
+        self.size = 0
+        self.started_at = None
+        self.on_flush(items)
+
+class LocalQueue:
+    # In-memory stand-in for the ingest queue. receive_event delivers messages in the
+    # event shape of the Lambda SQS integration and honours its batch size and
+    # batching window, so the dispatcher can be driven locally without AWS.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.messages = deque()
+
+    def send_message(self, body):
+        self.messages.append((self.clock(), {
+            'messageId': str(uuid.uuid4()),
+            'eventSource': 'aws:sqs',
+            'body': body if isinstance(body, str) else json.dumps(body),
+        }))
+
+    def send_s3_notification(self, bucket_name, document_key, size=0, etag=''):
+        self.send_message({'Records': [{
+            'eventSource': 'aws:s3',
+            's3': {
+                'bucket': {'name': bucket_name},
+                'object': {'key': document_key, 'size': size, 'eTag': etag},
+            },
+        }]})
+
+    def receive_event(self, batch_size, max_batching_window_seconds):
+        # Returns None until batch_size messages are waiting or the oldest message
+        # has waited for the whole batching window
+        if not self.messages:
+            return None
+        if len(self.messages) < batch_size and self.clock() - self.messages[0][0] < max_batching_window_seconds:
+            return None
+        return {'Records': [self.messages.popleft()[1] for _ in range(min(batch_size, len(self.messages)))]}
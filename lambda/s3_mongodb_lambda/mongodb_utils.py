@@ -7,7 +7,7 @@ import time
 
 load_dotenv()
 
-def delete_from_mongodb(filename, uri, database_name, collection_name):
+def delete_from_mongodb(s3_url, uri, database_name, collection_name):
     try:
         # Connect to MongoDB
         client = MongoClient(uri)
@@ -16,14 +16,14 @@ def delete_from_mongodb(filename, uri, database_name, collection_name):
 
         start_time = time.time()
 
-        # Delete documents with the specified filename in their metadata
-        result = collection.delete_many({"metadata.filename": filename})
+        # Delete the chunks the ingest job wrote for the object
+        result = collection.delete_many({"metadata.data_source.url": s3_url})
 
         end_time = time.time()
         elapsed_time = end_time - start_time
 
         # Output the result
-        print(f"Deleted {result.deleted_count} document(s) with filename '{filename}'.")
+        print(f"Deleted {result.deleted_count} document(s) of '{s3_url}'.")
         print(f"Time taken: {elapsed_time:.2f} seconds.")
         
     except Exception as e:
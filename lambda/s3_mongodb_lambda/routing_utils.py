@@ -0,0 +1,69 @@
+# lambda/s3_mongodb_lambda/routing_utils.py
+
+import math
+import os
+
+# File types the ingest container can partition, grouped by how much work a byte of
+# them takes. Layout files (PDFs and images) may need OCR and layout models.
+FILE_CLASS_EXTENSIONS = {
+    'text': {
+        '.txt', '.text', '.md', '.markdown', '.rst', '.org', '.csv', '.tsv', '.json',
+        '.xml', '.html', '.htm', '.eml', '.msg', '.rtf',
+    },
+    'office': {'.doc', '.docx', '.odt', '.ppt', '.pptx', '.xls', '.xlsx', '.epub'},
+    'layout': {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.heic'},
+}
+
+# Content-Type prefixes used to classify objects without a recognised extension
+CONTENT_TYPE_CLASSES = [
+    ('text/', 'text'),
+    ('message/rfc822', 'text'),
+    ('application/json', 'text'),
+    ('application/xml', 'text'),
+    ('application/rtf', 'text'),
+    ('application/msword', 'office'),
+    ('application/vnd.ms-', 'office'),
+    ('application/vnd.openxmlformats-officedocument', 'office'),
+    ('application/vnd.oasis.opendocument', 'office'),
+    ('application/epub+zip', 'office'),
+    ('application/pdf', 'layout'),
+    ('image/', 'layout'),
+]
+
+# Largest object of each file class, in bytes, that runs in a small and in a medium
+# container. Anything bigger goes to the large tier.
+TIER_SIZE_LIMITS = {
+    'text': (10 * 1024 * 1024, 200 * 1024 * 1024),
+    'office': (2 * 1024 * 1024, 50 * 1024 * 1024),
+    'layout': (512 * 1024, 20 * 1024 * 1024),
+}
+
+def classify_file(document_key, content_type=None):
+    # Returns the file class of an object, or None if the container cannot partition it
+    extension = os.path.splitext(document_key)[1].lower()
+    for file_class, extensions in FILE_CLASS_EXTENSIONS.items():
+        if extension in extensions:
+            return file_class
+    if content_type:
+        for prefix, file_class in CONTENT_TYPE_CLASSES:
+            if content_type.lower().startswith(prefix):
+                return file_class
+    return None
+
+def get_job_tier(file_class, size):
+    small_limit, medium_limit = TIER_SIZE_LIMITS[file_class]
+    if size <= small_limit:
+        return 'small'
+    if size <= medium_limit:
+        return 'medium'
+    return 'large'
+
+# PDFs larger than SPLIT_PART_BYTES are ingested in parts of about that size, each a
+# page range in its own container
+SPLIT_PART_BYTES = 100 * 1024 * 1024
+MAX_DOCUMENT_PARTS = 100
+
+def get_part_count(document_key, size, part_bytes=SPLIT_PART_BYTES):
+    if os.path.splitext(document_key)[1].lower() != '.pdf' or size <= part_bytes:
+        return 1
+    return min(MAX_DOCUMENT_PARTS, math.ceil(size / part_bytes))
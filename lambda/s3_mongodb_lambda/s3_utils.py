@@ -0,0 +1,17 @@
+# lambda/s3_mongodb_lambda/s3_utils.py
+
+def list_pages(s3_client, bucket_name, prefix, delimiter=None, continuation_token=None, max_keys=1000):
+    # Follow continuation tokens so a listing is not capped at 1,000 keys. The
+    # token for the next page is on each response, so callers can checkpoint it.
+    list_kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': max_keys}
+    if delimiter:
+        list_kwargs['Delimiter'] = delimiter
+    if continuation_token:
+        list_kwargs['ContinuationToken'] = continuation_token
+
+    while True:
+        response = s3_client.list_objects_v2(**list_kwargs)
+        yield response
+        if not response.get('IsTruncated'):
+            return
+        list_kwargs['ContinuationToken'] = response['NextContinuationToken']
@@ -1,19 +1,49 @@
 import json
+import math
 import os
 import boto3
 import botocore
 import uuid
 import urllib.parse
-from pinecone_utils import delete_from_pinecone
+from ledger_utils import compute_config_hash, get_ledger, new_ledger_entry
+from backfill_utils import run_backfill
+from dispatch_utils import MicroBatcher
+from routing_utils import SPLIT_PART_BYTES, classify_file, get_job_tier, get_part_count
 
-# Initialize the Batch client and S3 client
+# Initialize the Batch client, S3 client and Lambda client
 batch_client = boto3.client('batch')
 s3_client = boto3.client('s3')
+lambda_client = boto3.client('lambda')
+
+# AWS Batch array jobs must have between 2 and 10,000 children
+MAX_ARRAY_SIZE = 10000
+
+# AWS Batch accepts at most 100 job IDs per describe_jobs call
+DESCRIBE_JOBS_LIMIT = 100
+
+# Attempts Batch makes at an ingest job, and at each part of a split document, before
+# failing it. A retried attempt resumes from the job's checkpoint.
+INGEST_JOB_ATTEMPTS = 2
+DOCUMENT_PART_ATTEMPTS = 3
+
+# Stop starting new backfill pages once less time than this is left in the invocation
+BACKFILL_SAFETY_MARGIN_MS = 10000
+
+# Ledger of the last ingested version of each object (None disables it)
+ledger = get_ledger()
+
+# Objects must be ingested again whenever the pipeline or its destination changes
+config_hash = compute_config_hash(
+    # Hash of the ingest code bundle the jobs run
+    os.environ.get('INGEST_CODE_VERSION', ''),
+    os.environ['EMBEDDING_PROVIDER'],
+    os.environ['EMBEDDING_MODEL_NAME'],
+    # Compressed vectors are stored in a different format, so changing it rewrites them
+    os.environ.get('VECTOR_DIMENSIONS', ''),
+    os.environ.get('VECTOR_DTYPE', ''),
+    os.environ['PINECONE_INDEX_NAME'],
+)
 
-# Read the app.py script from the Lambda's local file system
-with open('s3_pinecone_ingest.py', 'r') as script_file:
-    app_script = script_file.read()
-    
 def lambda_handler(event, context):
     # Check if this is a delete event (ie. CDK delete)
     if event.get('RequestType') == 'Delete':
@@ -25,67 +55,198 @@ def lambda_handler(event, context):
 
     # Check if it's an S3 event or a custom resource event
     if 'Records' in event and event['Records']:
-        # Handle S3 event
-        print("S3 event received. Determining if object is new or needs to be updated.")
-        bucket_name = event['Records'][0]['s3']['bucket']['name']
-        document_key = event['Records'][0]['s3']['object']['key']
-        
-        decoded_document_key = urllib.parse.unquote(document_key)
-        decoded_document_with_spaces = decoded_document_key.replace('+', ' ').replace('%20', ' ')
-        s3_url = f"s3://{bucket_name}/{decoded_document_with_spaces}"
+        # S3 notifications normally arrive through the ingest queue, already windowed
+        # by the SQS event source, but direct S3 invocations are still accepted
+        s3_records = get_s3_records(event['Records'])
+        print(f"Event received with {len(s3_records)} S3 record(s). Determining which objects are new or need to be updated.")
+        job_ids = dispatch_s3_records(s3_records)
 
-        if does_object_exist(bucket_name, decoded_document_with_spaces):
-            print(f"Object {decoded_document_with_spaces} already exists. Running delete logic.")
-            # Retrieve the API key and index name from environment variables
-            api_key = os.environ['PINECONE_API_KEY']
-            index_name = os.environ['PINECONE_INDEX_NAME']
-            try:
-                delete_from_pinecone(os.path.basename(decoded_document_with_spaces), api_key, index_name)
-            except Exception as e:
-                print(f"Error deleting from Pinecone: {e}")
+        if not job_ids:
+            return {
+                'statusCode': 200,
+                'body': json.dumps("No new or changed objects - no Batch job started.")
+            }
 
-        return add_files(s3_url)
+        # Response with job information
+        return {
+            'statusCode': 200,
+            'body': json.dumps(f"Started {len(job_ids)} Batch Job(s): {', '.join(job_ids)}")
+        }
+
+    elif 'BackfillStateKey' in event:
+        # Continue a backfill that ran out of time in a previous invocation
+        print(f"Continuing backfill {event['BackfillStateKey']}.")
+        return continue_backfill(event['BackfillStateKey'], context)
 
     else:
         # Handle custom resource event (initial processing)
-        print("Custom resource event received. Listing objects in S3 bucket.")
-        bucket_name = os.environ['S3_BUCKET_NAME']
-        prefix = os.environ.get('S3_NOTIFICATION_PREFIX', '')
-        
-        # List existing objects in the bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        
-        if 'Contents' in response:
-            print(f"The objects I'm going to iterate through are: {response['Contents']}")
-            for item in response['Contents']:
-                document_key = item['Key']
-                s3_url = f"s3://{bucket_name}/{document_key}"
-
-                # Skip the object if its size is 0 (indicating it's a folder)
-                if item['Size'] == 0:
-                    print(f"Skipping folder: {document_key}")
-                    continue
-                
-                add_files(s3_url)
+        print("Custom resource event received. Starting backfill of existing objects.")
+        # CloudFormation reuses the RequestId on retries, so a retried event resumes the same backfill
+        state_key = f"backfill/{event.get('RequestId', uuid.uuid4())}.json"
+        return continue_backfill(state_key, context)
+
+def get_s3_records(records):
+    s3_records = []
+    for record in records:
+        if record.get('eventSource') == 'aws:sqs':
+            # Each queue message is one S3 notification; the test message S3 sends
+            # when the notification is configured has no records
+            s3_records.extend(json.loads(record['body']).get('Records', []))
         else:
-            print("No objects found in the bucket.")
+            s3_records.append(record)
+    return s3_records
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps("Processed existing items.")
-        }
+def dispatch_s3_records(records):
+    # The latest record wins when an object was uploaded more than once in the window
+    objects = {}
+    for record in records:
+        bucket_name = record['s3']['bucket']['name']
+        decoded_document_key = urllib.parse.unquote(record['s3']['object']['key'])
+        decoded_document_with_spaces = decoded_document_key.replace('+', ' ').replace('%20', ' ')
+        objects[(bucket_name, decoded_document_with_spaces)] = record['s3']['object']
 
-def does_object_exist(bucket_name, document_key):
-    try:
-        s3_client.head_object(Bucket=bucket_name, Key=document_key)
-        return True
-    except botocore.exceptions.ClientError as e:
-        if e.response['Error']['Code'] == '404':
-            return False
-        else:
-            raise
+    # Unchanged objects are skipped entirely. Changed objects need no delete here,
+    # since the ingest job diffs the new chunks against the stored ones.
+    if ledger:
+        changed_objects = set()
+        for bucket_name in {bucket_name for bucket_name, _ in objects}:
+            object_etags = {
+                document_key: s3_object.get('eTag', '')
+                for (object_bucket_name, document_key), s3_object in objects.items()
+                if object_bucket_name == bucket_name
+            }
+            changed_objects.update((bucket_name, document_key) for document_key in find_changed_objects(bucket_name, object_etags))
+        for bucket_name, document_key in list(objects):
+            if (bucket_name, document_key) not in changed_objects:
+                print(f"Object {document_key} is unchanged since it was last ingested. Skipping.")
+                del objects[(bucket_name, document_key)]
+
+    # Group the objects into jobs by container tier, then by count and total size
+    job_ids = []
+    batchers = {}
+    for (bucket_name, document_key), s3_object in objects.items():
+        tier = route_object(bucket_name, document_key, s3_object.get('size', 0))
+        if tier is None:
+            continue
+        if tier not in batchers:
+            batchers[tier] = MicroBatcher(
+                lambda items, tier=tier: job_ids.append(add_files(
+                    [s3_url for s3_url, _ in items], [entry for _, entry in items], tier
+                )),
+                max_objects=int(os.environ.get('DISPATCH_MAX_OBJECTS', '100')),
+                max_bytes=int(os.environ.get('DISPATCH_MAX_BYTES', str(512 * 1024 * 1024))),
+                max_wait_seconds=int(os.environ.get('DISPATCH_MAX_WAIT_SECONDS', '60')),
+            )
+        ledger_entry = new_ledger_entry(
+            bucket_name,
+            document_key,
+            s3_object.get('eTag', ''),
+            s3_object.get('versionId'),
+            config_hash,
+        )
+        # Huge PDFs are split across containers instead of joining a job
+        part_count = get_document_parts(document_key, s3_object.get('size', 0))
+        if part_count > 1:
+            job_ids.append(add_document_parts(f"s3://{bucket_name}/{document_key}", part_count, ledger_entry, tier))
+            continue
+        batchers[tier].add((f"s3://{bucket_name}/{document_key}", ledger_entry), s3_object.get('size', 0))
+    for batcher in batchers.values():
+        batcher.flush()
+    return job_ids
+
+def continue_backfill(state_key, context):
+    bucket_name = os.environ['S3_BUCKET_NAME']
+    prefix = os.environ.get('S3_NOTIFICATION_PREFIX', '')
+    # Every listing page becomes one manifest, and S3 returns at most 1,000 keys per page
+    page_size = min(int(os.environ.get('BACKFILL_MANIFEST_SIZE', '1000')), 1000)
+
+    done = run_backfill(
+        s3_client,
+        os.environ['MANIFEST_BUCKET_NAME'],
+        state_key,
+        bucket_name,
+        prefix,
+        backfill_objects,
+        context.get_remaining_time_in_millis,
+        BACKFILL_SAFETY_MARGIN_MS,
+        page_size=page_size,
+    )
+
+    if not done:
+        # Hand the rest of the listing to a fresh invocation before this one times out
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'BackfillStateKey': state_key}),
+        )
+        print(f"Backfill {state_key} will continue in a new invocation.")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps("Processed existing items." if done else "Backfill continuing in a new invocation.")
+    }
 
-def add_files(s3_url):  
+def route_object(bucket_name, document_key, size, head_unknown=True):
+    # Returns the job tier for an object, or None if it cannot be ingested. Objects
+    # without a recognised extension are classified by their Content-Type, unless
+    # head_unknown is False, in which case they go to the medium tier and the job's
+    # partitioner detects their type from their content.
+    file_class = classify_file(document_key)
+    if file_class is None and not head_unknown:
+        return 'medium'
+    if file_class is None:
+        try:
+            content_type = s3_client.head_object(Bucket=bucket_name, Key=document_key).get('ContentType')
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != '404':
+                raise
+            content_type = None
+        file_class = classify_file(document_key, content_type)
+
+    if file_class is None:
+        print(f"Object {document_key} is not a supported file type. Skipping.")
+        return None
+    return get_job_tier(file_class, size)
+
+def get_failed_job_ids(job_ids):
+    failed_job_ids = set()
+    job_ids = list({job_id for job_id in job_ids if job_id})
+    for start in range(0, len(job_ids), DESCRIBE_JOBS_LIMIT):
+        response = batch_client.describe_jobs(jobs=job_ids[start:start + DESCRIBE_JOBS_LIMIT])
+        # Batch forgets jobs some time after they finish; those are treated as succeeded
+        failed_job_ids.update(job['jobId'] for job in response['jobs'] if job['status'] == 'FAILED')
+    return failed_job_ids
+
+def find_changed_objects(bucket_name, object_etags):
+    # Returns {document_key: ledger entry or None} for the objects that need to be
+    # ingested. An object is skipped when the ledger holds the same ETag under the
+    # same configuration and the job that ingested it did not fail.
+    entries = ledger.get_many(bucket_name, list(object_etags))
+    current_entries = {
+        document_key: entry for document_key, entry in entries.items()
+        if entry['etag'] == object_etags[document_key].strip('"') and entry['config_hash'] == config_hash
+    }
+    failed_job_ids = get_failed_job_ids(entry['job_id'] for entry in current_entries.values())
+    return {
+        document_key: entries.get(document_key)
+        for document_key in object_etags
+        if document_key not in current_entries or current_entries[document_key]['job_id'] in failed_job_ids
+    }
+
+def get_processor_environment(tier):
+    # Settings left empty in the CLI are derived from the tier's container: one
+    # partitioning process per vCPU while each still gets 2 GB of memory, and four
+    # destination connections per process
+    resources = json.loads(os.environ.get('JOB_TIER_RESOURCES', '{}')).get(tier, {'vcpu': 2, 'memory': 4096})
+    num_processes = os.environ.get('INGEST_NUM_PROCESSES') or str(max(1, min(int(resources['vcpu']), int(resources['memory']) // 2048)))
+    max_connections = os.environ.get('INGEST_MAX_CONNECTIONS') or str(4 * int(num_processes))
+    return [
+        {'name': 'NUM_PROCESSES', 'value': num_processes},
+        {'name': 'MAX_CONNECTIONS', 'value': max_connections},
+        {'name': 'REPROCESS', 'value': os.environ.get('INGEST_REPROCESS', 'false')},
+    ]
+
+def submit_ingest_job(job_environment, array_size=1, tier='medium', attempts=INGEST_JOB_ATTEMPTS, depends_on=None):
     # Environment variables 
     aws_access_key = os.environ['MY_AWS_ACCESS_KEY_ID']
     aws_secret_key = os.environ['MY_AWS_SECRET_ACCESS_KEY']
@@ -99,14 +260,23 @@ def add_files(s3_url):
     # Generate a valid job name
     job_name = f"BatchJob_{uuid.uuid4()}"
 
+    # Array jobs need at least two children, so a single slice runs as a plain job
+    job_options = {'arrayProperties': {'size': array_size}} if array_size > 1 else {}
+    # Batch retries each array child on its own, and runs a dependent job only once every
+    # child of the job it depends on has succeeded
+    if attempts > 1:
+        job_options['retryStrategy'] = {'attempts': attempts}
+    if depends_on:
+        job_options['dependsOn'] = [{'jobId': depends_on}]
+
     # Start Batch job
     response = batch_client.submit_job(
         jobName=job_name,
-        jobQueue=os.environ['JOB_QUEUE'],  # Job queue from environment variables
-        jobDefinition=os.environ['JOB_DEFINITION'],  # Job definition from environment variables
+        # Each tier has its own job queue and definition; the defaults are the medium tier
+        jobQueue=os.environ.get(f'JOB_QUEUE_{tier.upper()}', os.environ['JOB_QUEUE']),
+        jobDefinition=os.environ.get(f'JOB_DEFINITION_{tier.upper()}', os.environ['JOB_DEFINITION']),
         containerOverrides={
-            'environment': [
-                {'name': 'AWS_S3_URL', 'value': s3_url},
+            'environment': job_environment + get_processor_environment(tier) + [
                 {'name': 'AWS_ACCESS_KEY_ID', 'value': aws_access_key},
                 {'name': 'AWS_SECRET_ACCESS_KEY', 'value': aws_secret_key},
                 {'name': 'EMBEDDING_PROVIDER', 'value': embedding_provider},
@@ -114,14 +284,121 @@ def add_files(s3_url):
                 {'name': 'EMBEDDING_PROVIDER_API_KEY', 'value': embedding_provider_api_key},
                 {'name': 'PINECONE_API_KEY', 'value': pinecone_api_key},
                 {'name': 'PINECONE_INDEX_NAME', 'value': pinecone_index_name},
+                {'name': 'PINECONE_TRANSPORT', 'value': os.environ.get('PINECONE_TRANSPORT', '')},
+                {'name': 'PINECONE_RAW_UPSERT', 'value': os.environ.get('PINECONE_RAW_UPSERT', 'true')},
+                {'name': 'PINECONE_API_VERSION', 'value': os.environ.get('PINECONE_API_VERSION', '')},
                 {'name': 'LOCAL_FILE_DOWNLOAD_DIR', 'value': local_file_download_dir},
-                {'name': 'APP_SCRIPT', 'value': app_script},
+                {'name': 'EMBEDDING_CACHE_URL', 'value': os.environ.get('EMBEDDING_CACHE_URL', '')},
+                {'name': 'EMBEDDING_REQUESTS_PER_MINUTE', 'value': os.environ.get('EMBEDDING_REQUESTS_PER_MINUTE', '')},
+                {'name': 'EMBEDDING_TOKENS_PER_MINUTE', 'value': os.environ.get('EMBEDDING_TOKENS_PER_MINUTE', '')},
+                {'name': 'EMBEDDING_MAX_IN_FLIGHT', 'value': os.environ.get('EMBEDDING_MAX_IN_FLIGHT', '')},
+                {'name': 'EMBEDDING_BACKEND', 'value': os.environ.get('EMBEDDING_BACKEND', '')},
+                {'name': 'VECTOR_DIMENSIONS', 'value': os.environ.get('VECTOR_DIMENSIONS', '')},
+                {'name': 'VECTOR_DTYPE', 'value': os.environ.get('VECTOR_DTYPE', '')},
+                # Each job writes its metrics summary and its checkpoint under these prefixes
+                {'name': 'METRICS_URL', 'value': f"s3://{os.environ['MANIFEST_BUCKET_NAME']}/metrics"},
+                {'name': 'CHECKPOINT_URL', 'value': f"s3://{os.environ['MANIFEST_BUCKET_NAME']}/job-checkpoints"},
             ],
         },
+        **job_options,
     )
+    return response['jobId']
 
-    # Response with job information
-    return {
-        'statusCode': 200,
-        'body': json.dumps(f"Started Batch Job: {response['jobId']}")
-    }
\ No newline at end of file
+def write_manifest(s3_urls):
+    # Jobs receive their object URLs as a manifest in S3, since container overrides
+    # are limited to a few kilobytes
+    manifest_bucket = os.environ['MANIFEST_BUCKET_NAME']
+    manifest_key = f"manifests/{uuid.uuid4()}.json"
+    s3_client.put_object(
+        Bucket=manifest_bucket,
+        Key=manifest_key,
+        Body=json.dumps(s3_urls),
+        ContentType='application/json',
+    )
+    return f"s3://{manifest_bucket}/{manifest_key}"
+
+def add_files(s3_urls, ledger_entries=(), tier='medium'):
+    job_id = submit_ingest_job([
+        {'name': 'MANIFEST_URL', 'value': write_manifest(s3_urls)},
+    ], tier=tier)
+
+    if ledger and ledger_entries:
+        ledger.put_many([dict(entry, job_id=job_id) for entry in ledger_entries])
+
+    return job_id
+
+def get_document_parts(document_key, size):
+    return get_part_count(document_key, size, int(os.environ.get('SPLIT_PART_BYTES', str(SPLIT_PART_BYTES))))
+
+def add_document_parts(s3_url, part_count, ledger_entry=None, tier='large'):
+    # Ingests a huge PDF as an array job with one child per page range, each writing its
+    # own chunks, and a finalizer that runs once all of them succeeded to delete chunks
+    # no part produced. The ledger records the finalizer, which fails when any part
+    # fails for good, so the document is only complete when every part is.
+    parts_url = f"s3://{os.environ['MANIFEST_BUCKET_NAME']}/parts/{uuid.uuid4()}"
+    part_environment = [
+        {'name': 'AWS_S3_URL', 'value': s3_url},
+        {'name': 'DOCUMENT_PARTS', 'value': str(part_count)},
+        {'name': 'PARTS_URL', 'value': parts_url},
+    ]
+    parts_job_id = submit_ingest_job(part_environment, array_size=part_count, tier=tier, attempts=DOCUMENT_PART_ATTEMPTS)
+    job_id = submit_ingest_job(
+        part_environment + [{'name': 'FINALIZE_DOCUMENT', 'value': 'true'}],
+        tier='small',
+        depends_on=parts_job_id,
+    )
+    print(f"Started {part_count} part(s) of {s3_url} as Batch Job {parts_job_id}, finalized by {job_id}.")
+
+    if ledger and ledger_entry:
+        ledger.put_many([dict(ledger_entry, job_id=job_id)])
+
+    return job_id
+
+def backfill_objects(bucket_name, objects):
+    # Backfill the listed objects, skipping those the ledger shows are unchanged
+    object_etags = {item['Key']: item['ETag'] for item in objects}
+    object_sizes = {item['Key']: item['Size'] for item in objects}
+    changed_objects = find_changed_objects(bucket_name, object_etags) if ledger else dict.fromkeys(object_etags)
+    print(f"{len(objects) - len(changed_objects)} of {len(objects)} listed object(s) are unchanged.")
+
+    # One manifest and array job per container tier. Objects are routed from the
+    # listing alone, since a HEAD request per extensionless key could take a page of
+    # them past the invocation's time budget before the page is checkpointed.
+    tier_objects = {}
+    for document_key in changed_objects:
+        tier = route_object(bucket_name, document_key, object_sizes[document_key], head_unknown=False)
+        if tier is None:
+            continue
+        ledger_entry = new_ledger_entry(bucket_name, document_key, object_etags[document_key], None, config_hash)
+        part_count = get_document_parts(document_key, object_sizes[document_key])
+        if part_count > 1:
+            add_document_parts(f"s3://{bucket_name}/{document_key}", part_count, ledger_entry, tier)
+            continue
+        s3_urls, ledger_entries = tier_objects.setdefault(tier, ([], []))
+        s3_urls.append(f"s3://{bucket_name}/{document_key}")
+        ledger_entries.append(ledger_entry)
+
+    for tier, (s3_urls, ledger_entries) in tier_objects.items():
+        backfill_files(s3_urls, ledger_entries, tier)
+
+def backfill_files(s3_urls, ledger_entries=(), tier='medium'):
+    # Write the object URLs to a manifest and submit one array job over it. Each
+    # child ingests a contiguous slice of the manifest in a single container.
+    slice_size = int(os.environ.get('BACKFILL_SLICE_SIZE', '25'))
+    slice_size = max(slice_size, math.ceil(len(s3_urls) / MAX_ARRAY_SIZE))
+    array_size = math.ceil(len(s3_urls) / slice_size)
+
+    job_id = submit_ingest_job([
+        {'name': 'MANIFEST_URL', 'value': write_manifest(s3_urls)},
+        {'name': 'MANIFEST_SLICE_SIZE', 'value': str(slice_size)},
+    ], array_size=array_size, tier=tier)
+
+    print(f"Started {tier} backfill Batch Job {job_id} over {len(s3_urls)} object(s) in {array_size} slice(s).")
+
+    # Record each object against the array child that ingests it
+    if ledger and ledger_entries:
+        ledger.put_many([
+            dict(entry, job_id=f"{job_id}:{index // slice_size}" if array_size > 1 else job_id)
+            for index, entry in enumerate(ledger_entries)
+        ])
+    return job_id
\ No newline at end of file
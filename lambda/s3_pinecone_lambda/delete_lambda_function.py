@@ -3,6 +3,10 @@ import json
 import os
 import urllib.parse
 from pinecone_utils import delete_from_pinecone
+from ledger_utils import get_ledger
+
+# Ledger of the last ingested version of each object (None disables it)
+ledger = get_ledger()
 
 def lambda_handler(event, context):
     # Retrieve the API key and index name from environment variables
@@ -13,13 +17,16 @@ def lambda_handler(event, context):
         s3_bucket = record['s3']['bucket']['name']
         s3_key = record['s3']['object']['key']
 
-        filename = os.path.basename(s3_key)
-        
+        document_key = urllib.parse.unquote(s3_key).replace('+', ' ').replace('%20', ' ')
+
         try:
-            decoded_filename = urllib.parse.unquote(filename)
-            decoded_filename_with_spaces = decoded_filename.replace('+', ' ').replace('%20', ' ')
-            delete_from_pinecone(decoded_filename_with_spaces, api_key, index_name)
-            print(f"Deleted File: {decoded_filename_with_spaces} from Bucket: {s3_bucket}")
+            # The ingest job keeps each object's vectors in a namespace named bucket/key
+            delete_from_pinecone(f"{s3_bucket}/{document_key}", api_key, index_name)
+            print(f"Deleted File: {document_key} from Bucket: {s3_bucket}")
+
+            # Forget the object so that uploading it again is ingested from scratch
+            if ledger:
+                ledger.delete(s3_bucket, document_key)
         except Exception as e:
             print(f"Error deleting from Pinecone: {e}")
 
@@ -3,7 +3,7 @@
 import time
 from pinecone import Pinecone
 
-def delete_from_pinecone(filename, api_key, index_name):
+def delete_from_pinecone(namespace, api_key, index_name):
     # Initialize Pinecone and connect to the index
     pc = Pinecone(api_key=api_key)
     index = pc.Index(index_name)
@@ -12,9 +12,9 @@ def delete_from_pinecone(filename, api_key, index_name):
     start_time = time.time()
 
     # Delete all vectors in the specified namespace
-    index.delete(delete_all=True, namespace=filename)
+    index.delete(delete_all=True, namespace=namespace)
 
-    print(f"Deleted all vectors in the namespace '{filename}'.")
+    print(f"Deleted all vectors in the namespace '{namespace}'.")
 
     # End timing and calculate duration
     end_time = time.time()
@@ -0,0 +1,102 @@
+# lambda/s3_postgres_lambda/backfill_utils.py
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from s3_utils import list_pages
+
+# Number of prefix shards listed at the same time
+LISTING_MAX_WORKERS = 8
+
+def new_shard(delimiter=None):
+    return {'delimiter': delimiter, 'token': None, 'done': False}
+
+def new_backfill_state(bucket_name, prefix):
+    # The root prefix is listed with a delimiter, so it only yields the objects
+    # stored directly under it. Each child prefix it reports becomes a shard
+    # that is listed in full, concurrently with the others.
+    return {
+        'bucket_name': bucket_name,
+        'prefix': prefix,
+        'shards': {prefix: new_shard(delimiter='/')},
+        'submitted_count': 0,
+        'done': False,
+    }
+
+def load_backfill_state(s3_client, state_bucket, state_key):
+    try:
+        response = s3_client.get_object(Bucket=state_bucket, Key=state_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(response['Body'].read())
+
+def save_backfill_state(s3_client, state_bucket, state_key, state):
+    s3_client.put_object(
+        Bucket=state_bucket,
+        Key=state_key,
+        Body=json.dumps(state),
+        ContentType='application/json',
+    )
+
+def run_backfill(s3_client, state_bucket, state_key, bucket_name, prefix, submit_objects,
+                 get_remaining_time_in_millis, safety_margin_ms, page_size=1000):
+    # Hand every object under the prefix to submit_objects(bucket_name, objects),
+    # one listing page at a time. Progress (continuation token per shard and the
+    # submitted count) is checkpointed to S3 after every page, and no new page is
+    # started once less than safety_margin_ms remains. Returns True once the whole prefix is done;
+    # calling it again with the same state_key resumes where it left off, and a
+    # finished backfill is a no-op. A page whose submission was not checkpointed
+    # before a crash is submitted again on restart, which re-ingests those objects.
+    state = load_backfill_state(s3_client, state_bucket, state_key)
+    if state is None:
+        state = new_backfill_state(bucket_name, prefix)
+        save_backfill_state(s3_client, state_bucket, state_key, state)
+    elif state['done']:
+        print(f"Backfill {state_key} already finished after {state['submitted_count']} object(s).")
+        return True
+
+    state_lock = threading.Lock()
+
+    def has_time_left():
+        return get_remaining_time_in_millis() > safety_margin_ms
+
+    def list_shard(shard_prefix):
+        shard = state['shards'][shard_prefix]
+        pages = list_pages(s3_client, state['bucket_name'], shard_prefix,
+                           delimiter=shard['delimiter'], continuation_token=shard['token'],
+                           max_keys=page_size)
+        for page in pages:
+            # Skip the object if its size is 0 (indicating it's a folder)
+            objects = [item for item in page.get('Contents', []) if item['Size'] > 0]
+            if objects:
+                submit_objects(state['bucket_name'], objects)
+
+            with state_lock:
+                for common_prefix in page.get('CommonPrefixes', []):
+                    state['shards'].setdefault(common_prefix['Prefix'], new_shard())
+                shard['token'] = page.get('NextContinuationToken')
+                shard['done'] = not page.get('IsTruncated')
+                state['submitted_count'] += len(objects)
+                save_backfill_state(s3_client, state_bucket, state_key, state)
+
+            if not has_time_left():
+                return
+
+    # Shards discovered while listing are picked up in the next round
+    while has_time_left():
+        pending_shards = [shard_prefix for shard_prefix, shard in state['shards'].items() if not shard['done']]
+        if not pending_shards:
+            break
+        with ThreadPoolExecutor(max_workers=LISTING_MAX_WORKERS) as executor:
+            list(executor.map(list_shard, pending_shards))
+
+    with state_lock:
+        state['done'] = all(shard['done'] for shard in state['shards'].values())
+        save_backfill_state(s3_client, state_bucket, state_key, state)
+
+    print(f"Backfill {state_key}: {state['submitted_count']} object(s) submitted, "
+          f"{sum(not shard['done'] for shard in state['shards'].values())} shard(s) remaining.")
+    return state['done']
@@ -0,0 +1,158 @@
+# lambda/s3_postgres_lambda/ledger_utils.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import boto3
+
+# DynamoDB limits on the number of items in one batched read or write
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+
+def compute_config_hash(*settings):
+    # Anything that changes what ends up in the destination should be passed in here
+    return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+def new_ledger_entry(bucket_name, document_key, etag, version_id, config_hash, job_id=None):
+    return {
+        'bucket_name': bucket_name,
+        'document_key': document_key,
+        # S3 quotes ETags in listings but not in event notifications
+        'etag': etag.strip('"'),
+        'version_id': version_id,
+        'config_hash': config_hash,
+        'job_id': job_id,
+    }
+
+class DynamoDBLedger:
+    # Records which version of each object was last ingested, keyed by bucket/key
+
+    def __init__(self, table_name, dynamodb_client=None):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_client or boto3.client('dynamodb')
+
+    def get(self, bucket_name, document_key):
+        return self.get_many(bucket_name, [document_key]).get(document_key)
+
+    def get_many(self, bucket_name, document_keys):
+        entries = {}
+        document_keys = list(dict.fromkeys(document_keys))
+        for start in range(0, len(document_keys), BATCH_GET_LIMIT):
+            request_items = {
+                self.table_name: {
+                    'Keys': [
+                        {'ObjectId': {'S': f"{bucket_name}/{document_key}"}}
+                        for document_key in document_keys[start:start + BATCH_GET_LIMIT]
+                    ]
+                }
+            }
+            while request_items:
+                response = self.dynamodb.batch_get_item(RequestItems=request_items)
+                for item in response['Responses'].get(self.table_name, []):
+                    entry = self._from_item(item)
+                    entries[entry['document_key']] = entry
+                request_items = response.get('UnprocessedKeys')
+        return entries
+
+    def put_many(self, entries):
+        for start in range(0, len(entries), BATCH_WRITE_LIMIT):
+            request_items = {
+                self.table_name: [
+                    {'PutRequest': {'Item': self._to_item(entry)}}
+                    for entry in entries[start:start + BATCH_WRITE_LIMIT]
+                ]
+            }
+            while request_items:
+                response = self.dynamodb.batch_write_item(RequestItems=request_items)
+                request_items = response.get('UnprocessedItems')
+
+    def delete(self, bucket_name, document_key):
+        self.dynamodb.delete_item(
+            TableName=self.table_name,
+            Key={'ObjectId': {'S': f"{bucket_name}/{document_key}"}}
+        )
+
+    def _to_item(self, entry):
+        item = {
+            'ObjectId': {'S': f"{entry['bucket_name']}/{entry['document_key']}"},
+            'BucketName': {'S': entry['bucket_name']},
+            'DocumentKey': {'S': entry['document_key']},
+            'ETag': {'S': entry['etag']},
+            'ConfigHash': {'S': entry['config_hash']},
+            'IngestedAt': {'N': str(int(time.time()))},
+        }
+        if entry['version_id']:
+            item['VersionId'] = {'S': entry['version_id']}
+        if entry['job_id']:
+            item['JobId'] = {'S': entry['job_id']}
+        return item
+
+    def _from_item(self, item):
+        return new_ledger_entry(
+            item['BucketName']['S'],
+            item['DocumentKey']['S'],
+            item['ETag']['S'],
+            item.get('VersionId', {}).get('S'),
+            item['ConfigHash']['S'],
+            item.get('JobId', {}).get('S'),
+        )
+
+class SQLiteLedger:
+    # Local stand-in for DynamoDBLedger, used when running the handlers outside AWS
+
+    def __init__(self, database_path):
+        # Backfills submit objects from several listing threads, so the connection is
+        # shared across threads and every use of it is serialized by the lock
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            "bucket_name TEXT, document_key TEXT, etag TEXT, version_id TEXT, "
+            "config_hash TEXT, job_id TEXT, ingested_at INTEGER, "
+            "PRIMARY KEY (bucket_name, document_key))"
+        )
+
+    def get(self, bucket_name, document_key):
+        return self.get_many(bucket_name, [document_key]).get(document_key)
+
+    def get_many(self, bucket_name, document_keys):
+        entries = {}
+        with self.lock:
+            for document_key in document_keys:
+                row = self.connection.execute(
+                    "SELECT bucket_name, document_key, etag, version_id, config_hash, job_id "
+                    "FROM ledger WHERE bucket_name = ? AND document_key = ?",
+                    (bucket_name, document_key),
+                ).fetchone()
+                if row:
+                    entries[document_key] = new_ledger_entry(*row)
+        return entries
+
+    def put_many(self, entries):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (entry['bucket_name'], entry['document_key'], entry['etag'], entry['version_id'],
+                     entry['config_hash'], entry['job_id'], int(time.time()))
+                    for entry in entries
+                ],
+            )
+
+    def delete(self, bucket_name, document_key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM ledger WHERE bucket_name = ? AND document_key = ?",
+                (bucket_name, document_key),
+            )
+
+def get_ledger():
+    # DynamoDB in a deployed stack, SQLite when LEDGER_SQLITE_PATH points at a local file
+    if os.environ.get('LEDGER_TABLE_NAME'):
+        return DynamoDBLedger(os.environ['LEDGER_TABLE_NAME'])
+    if os.environ.get('LEDGER_SQLITE_PATH'):
+        return SQLiteLedger(os.environ['LEDGER_SQLITE_PATH'])
+    return None
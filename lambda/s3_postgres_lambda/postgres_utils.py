@@ -3,7 +3,7 @@
 import psycopg2
 import time
 
-def delete_from_postgres(db_name, user, password, host, port, table_name, filename):
+def delete_from_postgres(db_name, user, password, host, port, table_name, s3_url):
     start_time = time.time()
     connection = None
     try:
@@ -17,10 +17,10 @@ def delete_from_postgres(db_name, user, password, host, port, table_name, filena
         )
         cursor = connection.cursor()
         
-        delete_query = f"DELETE FROM {table_name} WHERE filename = %s"
-        print(f"Executing query: {delete_query} with filename: {filename}")
+        delete_query = f"DELETE FROM {table_name} WHERE url = %s"
+        print(f"Executing query: {delete_query} with url: {s3_url}")
         
-        cursor.execute(delete_query, (filename,))
+        cursor.execute(delete_query, (s3_url,))
         
         connection.commit()
         
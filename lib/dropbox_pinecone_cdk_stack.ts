@@ -11,17 +11,33 @@ import * as custom_resources from "aws-cdk-lib/custom-resources";
 import * as iam from "aws-cdk-lib/aws-iam";
 import * as dotenv from "dotenv";
 import * as logs from "aws-cdk-lib/aws-logs";
+import * as s3 from "aws-cdk-lib/aws-s3";
+import * as s3_assets from "aws-cdk-lib/aws-s3-assets";
+import * as fs from "fs";
 
 dotenv.config();
 
 const COMPUTE_ENV_MAX_VCPU = 16;
 const CONTAINER_VCPU = "2";
 const CONTAINER_MEMORY = "4096";
+const EMBEDDING_CACHE_EXPIRATION_DAYS = 30;
 
 export class Dropbox_Pinecone_CDK_Stack extends cdk.Stack {
   constructor(scope: Construct, id: string, props?: cdk.StackProps) {
     super(scope, id, props);
 
+    // Embedding vectors shared by all ingest jobs, keyed by provider, model and chunk
+    // text, and the ONNX exports of the embedding models under onnx-models/. Entries
+    // expire after a fixed age, which bounds the cache and drops the vectors and
+    // exports of models that are no longer used.
+    const embeddingCacheBucket = new s3.Bucket(this, "EmbeddingCacheBucket", {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [
+        { expiration: cdk.Duration.days(EMBEDDING_CACHE_EXPIRATION_DAYS) },
+      ],
+    });
+
     // Create the VPC
     const vpc = new ec2.Vpc(this, "MyVpc", {
       maxAzs: 3,
@@ -97,6 +113,23 @@ export class Dropbox_Pinecone_CDK_Stack extends cdk.Stack {
       ],
     });
 
+    // Role assumed by the Batch job containers
+    const batchJobRole = new iam.Role(this, "BatchJobRole", {
+      assumedBy: new iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
+    });
+
+    // Allow ingest jobs to read and fill the embedding cache
+    embeddingCacheBucket.grantReadWrite(batchJobRole);
+
+    // The ingest code ships as a zipped asset that the job downloads. The job image
+    // runs APP_SCRIPT, which is set to a small bootstrap that fetches the bundle, so the
+    // code never travels in the container overrides.
+    const ingestJobCode = new s3_assets.Asset(this, "IngestJobCode", {
+      path: "lambda/ingest_job",
+      exclude: ["__pycache__", "*.pyc"],
+    });
+    ingestJobCode.grantRead(batchJobRole);
+
     // Batch Job Definition with ARM64 architecture
     const jobDefinition = new batch.CfnJobDefinition(this, "MyBatchJobDef", {
       type: "container",
@@ -106,10 +139,17 @@ export class Dropbox_Pinecone_CDK_Stack extends cdk.Stack {
           { type: "VCPU", value: CONTAINER_VCPU },
           { type: "MEMORY", value: CONTAINER_MEMORY },
         ],
-        jobRoleArn: new iam.Role(this, "BatchJobRole", {
-          assumedBy: new iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
-        }).roleArn,
+        jobRoleArn: batchJobRole.roleArn,
         executionRoleArn: batchExecutionRole.roleArn,
+        environment: [
+          { name: "APP_SCRIPT", value: fs.readFileSync("lambda/ingest_job/bootstrap.py", "utf8") },
+          { name: "INGEST_CODE_URL", value: ingestJobCode.s3ObjectUrl },
+          { name: "INGEST_SCRIPT", value: "dropbox_pinecone_ingest.py" },
+          // The int8 ONNX export of the embedding model is made by the first job that needs
+          // it and cached next to the embeddings, so later jobs download it instead
+          { name: "ONNX_MODEL_DIR", value: "/tmp/onnx-models" },
+          { name: "ONNX_MODEL_CACHE_URL", value: embeddingCacheBucket.s3UrlForObject("onnx-models") },
+        ],
         runtimePlatform: {
           cpuArchitecture: "ARM64",
           operatingSystemFamily: "LINUX",
@@ -161,7 +201,18 @@ export class Dropbox_Pinecone_CDK_Stack extends cdk.Stack {
         PINECONE_API_KEY: process.env.PINECONE_API_KEY!,
         EMBEDDING_MODEL_NAME: process.env.EMBEDDING_MODEL_NAME!,
         PINECONE_INDEX_NAME: process.env.PINECONE_INDEX_NAME!,
+        PINECONE_TRANSPORT: process.env.PINECONE_TRANSPORT || 'http',
+        PINECONE_RAW_UPSERT: process.env.PINECONE_RAW_UPSERT || 'true',
+        PINECONE_API_VERSION: process.env.PINECONE_API_VERSION || '',
         DYNAMODB_TABLE_NAME: tokenTable.tableName,
+        EMBEDDING_CACHE_URL: embeddingCacheBucket.s3UrlForObject(),
+        EMBEDDING_BACKEND: process.env.EMBEDDING_BACKEND || '',
+        INGEST_NUM_PROCESSES: process.env.INGEST_NUM_PROCESSES || '',
+        INGEST_MAX_CONNECTIONS: process.env.INGEST_MAX_CONNECTIONS || '',
+        INGEST_WORK_DIR: process.env.INGEST_WORK_DIR || '',
+        INGEST_REPROCESS: process.env.INGEST_REPROCESS || 'false',
+        INGEST_CHECKPOINT_STAGES: process.env.INGEST_CHECKPOINT_STAGES || 'false',
+        INGEST_METRICS_URL: process.env.INGEST_METRICS_URL || '',
       },
       timeout: cdk.Duration.seconds(30),
     });
@@ -1,21 +1,42 @@
 import * as cdk from "aws-cdk-lib";
 import { Stack, StackProps } from "aws-cdk-lib";
 import * as s3 from "aws-cdk-lib/aws-s3";
+import * as s3_assets from "aws-cdk-lib/aws-s3-assets";
 import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as s3_notifications from "aws-cdk-lib/aws-s3-notifications";
+import * as sqs from "aws-cdk-lib/aws-sqs";
+import * as lambda_event_sources from "aws-cdk-lib/aws-lambda-event-sources";
 import * as batch from "aws-cdk-lib/aws-batch";
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 import * as ec2 from "aws-cdk-lib/aws-ec2";
 import * as iam from "aws-cdk-lib/aws-iam";
 import * as logs from "aws-cdk-lib/aws-logs";
 import * as custom_resources from "aws-cdk-lib/custom-resources";
 import * as dotenv from "dotenv";
 import { Construct } from "constructs";
+import * as fs from "fs";
 
 dotenv.config();
 
 const COMPUTE_ENV_MAX_VCPU = 16;
+// Container sizes of the small, medium and large job tiers. The add Lambda routes
+// each object to a tier by its file type and size.
+const SMALL_CONTAINER_VCPU = "1";
+const SMALL_CONTAINER_MEMORY = "2048";
 const CONTAINER_VCPU = "2";
 const CONTAINER_MEMORY = "4096";
+const LARGE_CONTAINER_VCPU = "4";
+const LARGE_CONTAINER_MEMORY = "16384";
+const BACKFILL_SLICE_SIZE = "25";
+const BACKFILL_MANIFEST_SIZE = "1000";
+const EMBEDDING_CACHE_EXPIRATION_DAYS = 30;
+const JOB_CHECKPOINT_EXPIRATION_DAYS = 7;
+const DISPATCH_MAX_OBJECTS = 100;
+const DISPATCH_MAX_BYTES = 512 * 1024 * 1024;
+const DISPATCH_MAX_WAIT_SECONDS = 60;
+
+// PDFs larger than this are ingested in parts of about this size, one container each
+const SPLIT_PART_BYTES = 100 * 1024 * 1024;
 
 export class S3_Postgres_CDK_Stack extends Stack {
   constructor(scope: Construct, id: string, props?: StackProps) {
@@ -28,6 +49,36 @@ export class S3_Postgres_CDK_Stack extends Stack {
       process.env.S3_BUCKET_NAME!
     );
 
+    // Bucket holding backfill checkpoints and the key manifests read by backfill array jobs,
+    // as well as the checkpoints of ingest jobs. A job removes its checkpoint once it
+    // succeeds; those of jobs that failed for good expire.
+    const manifestBucket = new s3.Bucket(this, "ManifestBucket", {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [
+        { prefix: "job-checkpoints/", expiration: cdk.Duration.days(JOB_CHECKPOINT_EXPIRATION_DAYS) },
+      ],
+    });
+
+    // Embedding vectors shared by all ingest jobs, keyed by provider, model and chunk
+    // text, and the ONNX exports of the embedding models under onnx-models/. Entries
+    // expire after a fixed age, which bounds the cache and drops the vectors and
+    // exports of models that are no longer used.
+    const embeddingCacheBucket = new s3.Bucket(this, "EmbeddingCacheBucket", {
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      autoDeleteObjects: true,
+      lifecycleRules: [
+        { expiration: cdk.Duration.days(EMBEDDING_CACHE_EXPIRATION_DAYS) },
+      ],
+    });
+
+    // Ledger of the last ingested ETag and configuration of each object
+    const ledgerTable = new dynamodb.Table(this, "LedgerTable", {
+      partitionKey: { name: "ObjectId", type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+
     // Create the VPC
     const vpc = new ec2.Vpc(this, "MyVpc", {
       maxAzs: 3,
@@ -92,37 +143,85 @@ export class S3_Postgres_CDK_Stack extends Stack {
       }
     );
 
-    // Create a Batch Job Queue
-    const jobQueue = new batch.CfnJobQueue(this, "MyBatchJobQueue", {
-      priority: 1,
-      computeEnvironmentOrder: [
-        {
-          order: 1,
-          computeEnvironment: computeEnvironment.ref,
-        },
-      ],
+    // Create a Batch Job Queue per tier. Smaller tiers get a higher priority so a
+    // burst of large documents does not hold up quick ones.
+    const createJobQueue = (id: string, priority: number) =>
+      new batch.CfnJobQueue(this, id, {
+        priority,
+        computeEnvironmentOrder: [
+          {
+            order: 1,
+            computeEnvironment: computeEnvironment.ref,
+          },
+        ],
+      });
+    const smallJobQueue = createJobQueue("SmallBatchJobQueue", 3);
+    const jobQueue = createJobQueue("MyBatchJobQueue", 2);
+    const largeJobQueue = createJobQueue("LargeBatchJobQueue", 1);
+
+    // Role assumed by the Batch job containers
+    const batchJobRole = new iam.Role(this, "BatchJobRole", {
+      assumedBy: new iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
     });
 
-    // Batch Job Definition with ARM64 architecture
-    const jobDefinition = new batch.CfnJobDefinition(this, "MyBatchJobDef", {
-      type: "container",
-      containerProperties: {
-        image: "public.ecr.aws/y7z1l4m8/unstructured_ingest_psql_edit2:latest",
-        resourceRequirements: [
-          { type: "VCPU", value: CONTAINER_VCPU },
-          { type: "MEMORY", value: CONTAINER_MEMORY },
-        ],
-        jobRoleArn: new iam.Role(this, "BatchJobRole", {
-          assumedBy: new iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
-        }).roleArn,
-        executionRoleArn: batchExecutionRole.roleArn,
-        runtimePlatform: {
-          cpuArchitecture: "ARM64",
-          operatingSystemFamily: "LINUX",
-        },
-      },
-      platformCapabilities: ["FARGATE"],
+    // Jobs read their manifests and write the chunk IDs of split document parts
+    manifestBucket.grantReadWrite(batchJobRole);
+
+    // Allow ingest jobs to read and fill the embedding cache
+    embeddingCacheBucket.grantReadWrite(batchJobRole);
+
+    // The ingest code ships as a zipped asset that each job downloads. The job image
+    // runs APP_SCRIPT, which is set to a small bootstrap that fetches the bundle, so the
+    // code never travels in the container overrides.
+    const ingestJobCode = new s3_assets.Asset(this, "IngestJobCode", {
+      path: "lambda/ingest_job",
+      exclude: ["__pycache__", "*.pyc"],
     });
+    ingestJobCode.grantRead(batchJobRole);
+
+    // Batch Job Definitions with ARM64 architecture, one per tier
+    const createJobDefinition = (id: string, vcpu: string, memory: string) =>
+      new batch.CfnJobDefinition(this, id, {
+        type: "container",
+        containerProperties: {
+          image: "public.ecr.aws/y7z1l4m8/unstructured_ingest_psql_edit2:latest",
+          resourceRequirements: [
+            { type: "VCPU", value: vcpu },
+            { type: "MEMORY", value: memory },
+          ],
+          jobRoleArn: batchJobRole.roleArn,
+          executionRoleArn: batchExecutionRole.roleArn,
+          environment: [
+            { name: "APP_SCRIPT", value: fs.readFileSync("lambda/ingest_job/bootstrap.py", "utf8") },
+            { name: "INGEST_CODE_URL", value: ingestJobCode.s3ObjectUrl },
+            { name: "INGEST_SCRIPT", value: "s3_postgres_ingest.py" },
+            // The int8 ONNX export of the embedding model is made by the first job that needs
+            // it and cached next to the embeddings, so later jobs download it instead
+            { name: "ONNX_MODEL_DIR", value: "/tmp/onnx-models" },
+            { name: "ONNX_MODEL_CACHE_URL", value: embeddingCacheBucket.s3UrlForObject("onnx-models") },
+          ],
+          runtimePlatform: {
+            cpuArchitecture: "ARM64",
+            operatingSystemFamily: "LINUX",
+          },
+        },
+        platformCapabilities: ["FARGATE"],
+      });
+    const smallJobDefinition = createJobDefinition(
+      "SmallBatchJobDef",
+      SMALL_CONTAINER_VCPU,
+      SMALL_CONTAINER_MEMORY
+    );
+    const jobDefinition = createJobDefinition(
+      "MyBatchJobDef",
+      CONTAINER_VCPU,
+      CONTAINER_MEMORY
+    );
+    const largeJobDefinition = createJobDefinition(
+      "LargeBatchJobDef",
+      LARGE_CONTAINER_VCPU,
+      LARGE_CONTAINER_MEMORY
+    );
 
     // Create a role for the Lambda functions
     const lambdaExecutionRole = new iam.Role(this, "LambdaExecutionRole", {
@@ -143,11 +242,21 @@ export class S3_Postgres_CDK_Stack extends Stack {
       environment: {
         JOB_QUEUE: jobQueue.ref,
         JOB_DEFINITION: jobDefinition.ref,
+        JOB_QUEUE_SMALL: smallJobQueue.ref,
+        JOB_DEFINITION_SMALL: smallJobDefinition.ref,
+        JOB_QUEUE_LARGE: largeJobQueue.ref,
+        JOB_DEFINITION_LARGE: largeJobDefinition.ref,
         MY_AWS_ACCESS_KEY_ID: process.env.MY_AWS_ACCESS_KEY_ID!,
         MY_AWS_SECRET_ACCESS_KEY: process.env.MY_AWS_SECRET_ACCESS_KEY!,
         EMBEDDING_PROVIDER: process.env.EMBEDDING_PROVIDER!,
         EMBEDDING_MODEL_NAME: process.env.EMBEDDING_MODEL_NAME!,
         EMBEDDING_PROVIDER_API_KEY: process.env.EMBEDDING_PROVIDER_API_KEY || '',
+        EMBEDDING_REQUESTS_PER_MINUTE: process.env.EMBEDDING_REQUESTS_PER_MINUTE || '',
+        EMBEDDING_TOKENS_PER_MINUTE: process.env.EMBEDDING_TOKENS_PER_MINUTE || '',
+        EMBEDDING_MAX_IN_FLIGHT: process.env.EMBEDDING_MAX_IN_FLIGHT || '',
+        EMBEDDING_BACKEND: process.env.EMBEDDING_BACKEND || '',
+        VECTOR_DIMENSIONS: process.env.VECTOR_DIMENSIONS || '',
+        VECTOR_DTYPE: process.env.VECTOR_DTYPE || '',
         POSTGRES_DB_NAME: process.env.POSTGRES_DB_NAME!,
         POSTGRES_USER: process.env.POSTGRES_USER!,
         POSTGRES_PASSWORD: process.env.POSTGRES_PASSWORD!,
@@ -156,27 +265,92 @@ export class S3_Postgres_CDK_Stack extends Stack {
         POSTGRES_TABLE_NAME: process.env.POSTGRES_TABLE_NAME!,
         S3_BUCKET_NAME: process.env.S3_BUCKET_NAME!,
         S3_NOTIFICATION_PREFIX: process.env.S3_NOTIFICATION_PREFIX || '',
+        MANIFEST_BUCKET_NAME: manifestBucket.bucketName,
+        // Changes whenever the ingest code does, so edited code re-ingests every object
+        INGEST_CODE_VERSION: ingestJobCode.assetHash,
+        BACKFILL_SLICE_SIZE: BACKFILL_SLICE_SIZE,
+        BACKFILL_MANIFEST_SIZE: BACKFILL_MANIFEST_SIZE,
+        LEDGER_TABLE_NAME: ledgerTable.tableName,
+        EMBEDDING_CACHE_URL: embeddingCacheBucket.s3UrlForObject(),
+        DISPATCH_MAX_OBJECTS: String(DISPATCH_MAX_OBJECTS),
+        DISPATCH_MAX_BYTES: String(DISPATCH_MAX_BYTES),
+        DISPATCH_MAX_WAIT_SECONDS: String(DISPATCH_MAX_WAIT_SECONDS),
+        SPLIT_PART_BYTES: String(SPLIT_PART_BYTES),
+        JOB_TIER_RESOURCES: JSON.stringify({
+          small: { vcpu: Number(SMALL_CONTAINER_VCPU), memory: Number(SMALL_CONTAINER_MEMORY) },
+          medium: { vcpu: Number(CONTAINER_VCPU), memory: Number(CONTAINER_MEMORY) },
+          large: { vcpu: Number(LARGE_CONTAINER_VCPU), memory: Number(LARGE_CONTAINER_MEMORY) },
+        }),
+        INGEST_NUM_PROCESSES: process.env.INGEST_NUM_PROCESSES || '',
+        INGEST_MAX_CONNECTIONS: process.env.INGEST_MAX_CONNECTIONS || '',
+        INGEST_REPROCESS: process.env.INGEST_REPROCESS || 'false',
       },
-      timeout: cdk.Duration.seconds(30),
+      // A backfill invocation lists and submits up to eight pages of 1000 keys
+      // before checkpointing and re-invoking itself
+      timeout: cdk.Duration.minutes(5),
     });
 
     // Grant permissions for the add Lambda to submit jobs to AWS Batch
     addLambda.addToRolePolicy(
       new iam.PolicyStatement({
         actions: ["batch:SubmitJob"],
-        resources: [jobQueue.ref, jobDefinition.ref],
+        resources: [
+          smallJobQueue.ref,
+          jobQueue.ref,
+          largeJobQueue.ref,
+          smallJobDefinition.ref,
+          jobDefinition.ref,
+          largeJobDefinition.ref,
+        ],
       })
     );
 
     // Grant necessary permissions to access S3
     bucket.grantRead(addLambda);
 
-    // Add permissions for S3 to invoke addLambda
-    addLambda.addPermission("S3InvokeAddLambda", {
-      principal: new iam.ServicePrincipal("s3.amazonaws.com"),
-      action: "lambda:InvokeFunction",
-      sourceArn: bucket.bucketArn,
+    // Allow the add Lambda to write backfill manifests and checkpoints
+    manifestBucket.grantReadWrite(addLambda);
+
+    // Allow the add Lambda to read and record ledger entries, and to check
+    // whether the job that ingested an unchanged object failed
+    ledgerTable.grantReadWriteData(addLambda);
+    addLambda.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: ["batch:DescribeJobs"],
+        resources: ["*"],
+      })
+    );
+
+    // Allow the add Lambda to re-invoke itself to continue a long backfill. The
+    // statement lives in its own policy because the function's default policy is a
+    // dependency of the function, so it cannot reference the function's ARN.
+    const selfInvokePolicy = new iam.Policy(this, "AddLambdaSelfInvokePolicy", {
+      statements: [
+        new iam.PolicyStatement({
+          actions: ["lambda:InvokeFunction"],
+          resources: [addLambda.functionArn],
+        }),
+      ],
     });
+    selfInvokePolicy.attachToRole(addLambda.role!);
+
+    // Queue buffering object-created notifications. The add Lambda receives them once
+    // DISPATCH_MAX_OBJECTS have accumulated or DISPATCH_MAX_WAIT_SECONDS have passed,
+    // and submits each batch as jobs of at most DISPATCH_MAX_BYTES.
+    const ingestDeadLetterQueue = new sqs.Queue(this, "IngestDeadLetterQueue", {
+      retentionPeriod: cdk.Duration.days(14),
+    });
+    const ingestQueue = new sqs.Queue(this, "IngestQueue", {
+      // Six times the add Lambda timeout, as recommended for SQS event sources
+      visibilityTimeout: cdk.Duration.minutes(30),
+      deadLetterQueue: { queue: ingestDeadLetterQueue, maxReceiveCount: 5 },
+    });
+    addLambda.addEventSource(
+      new lambda_event_sources.SqsEventSource(ingestQueue, {
+        batchSize: DISPATCH_MAX_OBJECTS,
+        maxBatchingWindow: cdk.Duration.seconds(DISPATCH_MAX_WAIT_SECONDS),
+      })
+    );
 
     // Define the Lambda function for handling S3 object deletion
     const deleteLambda = new lambda.Function(this, "DeleteLambdaFunction", {
@@ -190,6 +364,7 @@ export class S3_Postgres_CDK_Stack extends Stack {
         POSTGRES_HOST: process.env.POSTGRES_HOST!,
         POSTGRES_PORT: process.env.POSTGRES_PORT!,
         POSTGRES_TABLE_NAME: process.env.POSTGRES_TABLE_NAME!,
+        LEDGER_TABLE_NAME: ledgerTable.tableName,
       },
       timeout: cdk.Duration.seconds(30),
     });
@@ -204,6 +379,9 @@ export class S3_Postgres_CDK_Stack extends Stack {
     // Grant necessary permissions to access S3 for the delete Lambda
     bucket.grantRead(deleteLambda);
 
+    // Allow the delete Lambda to remove ledger entries
+    ledgerTable.grantReadWriteData(deleteLambda);
+
     // Add permissions for S3 to invoke deleteLambda
     deleteLambda.addPermission("S3InvokeDeleteLambda", {
       principal: new iam.ServicePrincipal("s3.amazonaws.com"),
@@ -220,7 +398,7 @@ export class S3_Postgres_CDK_Stack extends Stack {
       // Add event notifications with the prefix
       bucket.addEventNotification(
         s3.EventType.OBJECT_CREATED,
-        new s3_notifications.LambdaDestination(addLambda),
+        new s3_notifications.SqsDestination(ingestQueue),
         notificationOptions
       );
 
@@ -233,7 +411,7 @@ export class S3_Postgres_CDK_Stack extends Stack {
       // Add event notifications without any additional options
       bucket.addEventNotification(
         s3.EventType.OBJECT_CREATED,
-        new s3_notifications.LambdaDestination(addLambda)
+        new s3_notifications.SqsDestination(ingestQueue)
       );
 
       bucket.addEventNotification(
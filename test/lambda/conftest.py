@@ -0,0 +1,121 @@
+# test/lambda/conftest.py
+#
+# The Lambda handlers and the ingest job import their helpers as top-level modules,
+# as they do once deployed, so their directories go on sys.path
+
+import importlib
+import io
+import json
+import sys
+from pathlib import Path
+import pytest
+from botocore.exceptions import ClientError
+
+LAMBDA_DIR = Path(__file__).resolve().parents[2] / "lambda"
+sys.path.insert(0, str(LAMBDA_DIR / "ingest_job"))
+sys.path.insert(0, str(LAMBDA_DIR / "s3_pinecone_lambda"))
+
+class FakeS3Client:
+    # In-memory S3 with the calls the add Lambda and backfill make. list_objects_v2
+    # honours Prefix, Delimiter, MaxKeys and ContinuationToken like the real API.
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.content_types = {}
+        self.list_calls = 0
+        self.head_calls = 0
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode() if isinstance(Body, str) else Body
+        if ContentType:
+            self.content_types[(Bucket, Key)] = ContentType
+
+    def head_object(self, Bucket, Key):
+        self.head_calls += 1
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        response = {'ContentLength': len(self.objects[(Bucket, Key)])}
+        if (Bucket, Key) in self.content_types:
+            response['ContentType'] = self.content_types[(Bucket, Key)]
+        return response
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def read_json(self, Bucket, Key):
+        return json.loads(self.objects[(Bucket, Key)])
+
+    def list_objects_v2(self, Bucket, Prefix, MaxKeys=1000, Delimiter=None, ContinuationToken=None):
+        self.list_calls += 1
+        entries = []
+        for bucket_name, key in sorted(self.objects):
+            if bucket_name != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common_prefix = Prefix + rest[:rest.index(Delimiter) + 1]
+                if ('prefix', common_prefix) not in entries:
+                    entries.append(('prefix', common_prefix))
+            else:
+                entries.append(('key', key))
+
+        start = int(ContinuationToken or 0)
+        page = entries[start:start + MaxKeys]
+        response = {
+            'Contents': [
+                {'Key': key, 'Size': len(self.objects[(Bucket, key)]), 'ETag': f'"etag-{key}"'}
+                for kind, key in page if kind == 'key'
+            ],
+            'CommonPrefixes': [{'Prefix': prefix} for kind, prefix in page if kind == 'prefix'],
+            'IsTruncated': start + MaxKeys < len(entries),
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3Client()
+
+class FakeBatchClient:
+    def __init__(self):
+        self.submitted = []
+        self.failed_job_ids = set()
+
+    def submit_job(self, **kwargs):
+        self.submitted.append(kwargs)
+        return {'jobId': f"job-{len(self.submitted)}"}
+
+    def describe_jobs(self, jobs):
+        return {'jobs': [
+            {'jobId': job_id, 'status': 'FAILED' if job_id in self.failed_job_ids else 'SUCCEEDED'}
+            for job_id in jobs
+        ]}
+
+@pytest.fixture
+def add_lambda(monkeypatch, tmp_path, fake_s3):
+    # Imports the add Lambda against a local SQLite ledger and fake AWS clients
+    environment = {
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'LEDGER_SQLITE_PATH': str(tmp_path / "ledger.db"),
+        'EMBEDDING_PROVIDER': 'huggingface',
+        'EMBEDDING_MODEL_NAME': 'model',
+        'EMBEDDING_PROVIDER_API_KEY': 'key',
+        'PINECONE_API_KEY': 'key',
+        'PINECONE_INDEX_NAME': 'index',
+        'MY_AWS_ACCESS_KEY_ID': 'id',
+        'MY_AWS_SECRET_ACCESS_KEY': 'secret',
+        'JOB_QUEUE': 'queue',
+        'JOB_DEFINITION': 'definition',
+        'MANIFEST_BUCKET_NAME': 'manifests',
+    }
+    for name, value in environment.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv('LEDGER_TABLE_NAME', raising=False)
+    monkeypatch.delitem(sys.modules, 'add_lambda_function', raising=False)
+    module = importlib.import_module('add_lambda_function')
+    monkeypatch.setattr(module, 'batch_client', FakeBatchClient())
+    monkeypatch.setattr(module, 's3_client', fake_s3)
+    return module
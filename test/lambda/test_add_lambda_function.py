@@ -0,0 +1,62 @@
+# test/lambda/test_add_lambda_function.py
+
+import importlib
+
+def s3_record(document_key, etag, size=100):
+    return {'s3': {'bucket': {'name': 'bucket'}, 'object': {'key': document_key, 'size': size, 'eTag': etag}}}
+
+def test_dispatch_skips_objects_the_ledger_has_ingested(add_lambda):
+    assert len(add_lambda.dispatch_s3_records([s3_record('a.txt', 'e1'), s3_record('b.txt', 'e1')])) == 1
+    # The same versions again are skipped, a changed ETag is ingested again
+    assert add_lambda.dispatch_s3_records([s3_record('a.txt', 'e1'), s3_record('b.txt', 'e1')]) == []
+    assert len(add_lambda.dispatch_s3_records([s3_record('a.txt', 'e1'), s3_record('b.txt', 'e2')])) == 1
+
+    manifest_url = add_lambda.batch_client.submitted[-1]['containerOverrides']['environment'][0]['value']
+    bucket_name, manifest_key = manifest_url[len("s3://"):].split("/", 1)
+    assert add_lambda.s3_client.read_json(bucket_name, manifest_key) == ["s3://bucket/b.txt"]
+
+def test_dispatch_retries_objects_whose_job_failed(add_lambda):
+    add_lambda.dispatch_s3_records([s3_record('a.txt', 'e1')])
+    add_lambda.batch_client.failed_job_ids.add('job-1')
+    assert add_lambda.dispatch_s3_records([s3_record('a.txt', 'e1')]) == ['job-2']
+
+def test_dispatch_batches_objects_by_tier(add_lambda, monkeypatch):
+    monkeypatch.setenv('DISPATCH_MAX_OBJECTS', '2')
+    monkeypatch.setenv('JOB_QUEUE_SMALL', 'small-queue')
+    monkeypatch.setenv('JOB_QUEUE_MEDIUM', 'medium-queue')
+    records = [s3_record(f"{index}.txt", 'e1') for index in range(5)] + [s3_record('big.txt', 'e1', size=100 * 1024 * 1024)]
+    job_ids = add_lambda.dispatch_s3_records(records)
+    queues = [job['jobQueue'] for job in add_lambda.batch_client.submitted]
+    assert len(job_ids) == 4
+    assert sorted(queues) == ['medium-queue', 'small-queue', 'small-queue', 'small-queue']
+    # Only the manifest URL goes to the job, however many objects it holds
+    for job in add_lambda.batch_client.submitted:
+        assert 'AWS_S3_URLS' not in {variable['name'] for variable in job['containerOverrides']['environment']}
+
+def test_vector_format_changes_the_config_hash(add_lambda, monkeypatch):
+    config_hash = add_lambda.config_hash
+    monkeypatch.setenv('VECTOR_DTYPE', 'int8')
+    monkeypatch.setenv('VECTOR_DIMENSIONS', '256')
+    assert importlib.reload(add_lambda).config_hash != config_hash
+
+def test_route_object_heads_only_unknown_extensions(add_lambda):
+    s3 = add_lambda.s3_client
+    s3.put_object(Bucket='bucket', Key='exports/data', Body=b'x', ContentType='application/pdf')
+    s3.put_object(Bucket='bucket', Key='exports/blob', Body=b'x', ContentType='application/octet-stream')
+    assert add_lambda.route_object('bucket', 'notes.txt', 100) == 'small'
+    assert s3.head_calls == 0
+    assert add_lambda.route_object('bucket', 'exports/data', 1024 * 1024) == 'medium'
+    assert s3.head_calls == 1
+    # Without the head request the job detects the type, so the object gets the medium tier
+    assert add_lambda.route_object('bucket', 'exports/blob', 100, head_unknown=False) == 'medium'
+    assert s3.head_calls == 1
+
+def test_route_object_rejects_unsupported_binaries(add_lambda):
+    s3 = add_lambda.s3_client
+    s3.put_object(Bucket='bucket', Key='exports/blob', Body=b'x', ContentType='application/octet-stream')
+    assert add_lambda.route_object('bucket', 'tools/setup.exe', 100) is None
+    assert add_lambda.route_object('bucket', 'exports/blob', 100) is None
+    # An object deleted before it was routed has no Content-Type either
+    assert add_lambda.route_object('bucket', 'exports/deleted', 100) is None
+    assert add_lambda.dispatch_s3_records([s3_record('tools/setup.exe', 'e1')]) == []
+    assert add_lambda.batch_client.submitted == []
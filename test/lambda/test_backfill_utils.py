@@ -0,0 +1,87 @@
+# test/lambda/test_backfill_utils.py
+
+import threading
+from backfill_utils import run_backfill
+from conftest import FakeS3Client
+
+def make_bucket(keys):
+    return FakeS3Client({('bucket', key): b"content" for key in keys})
+
+class Budget:
+    # Remaining invocation time that runs out after a number of listing calls
+    def __init__(self, s3_client, list_calls):
+        self.s3_client = s3_client
+        self.list_calls = list_calls
+
+    def __call__(self):
+        return 60000 if self.s3_client.list_calls < self.list_calls else 0
+
+def backfill(s3_client, submitted, get_remaining_time_in_millis=lambda: 60000, page_size=2):
+    lock = threading.Lock()
+
+    def submit_objects(bucket_name, objects):
+        with lock:
+            submitted.extend(item['Key'] for item in objects)
+
+    return run_backfill(
+        s3_client, 'state', 'backfill/test.json', 'bucket', '', submit_objects,
+        get_remaining_time_in_millis, safety_margin_ms=1000, page_size=page_size,
+    )
+
+def test_backfill_submits_every_object_once():
+    keys = ["root.txt"] + [f"{shard}/{index}.txt" for shard in "abc" for index in range(5)]
+    s3_client = make_bucket(keys)
+    submitted = []
+    assert backfill(s3_client, submitted)
+    assert sorted(submitted) == sorted(keys)
+    assert s3_client.read_json('state', 'backfill/test.json')['submitted_count'] == len(keys)
+
+def test_backfill_skips_folder_markers():
+    s3_client = make_bucket(["docs/a.txt"])
+    s3_client.objects[('bucket', 'docs/empty/')] = b""
+    submitted = []
+    assert backfill(s3_client, submitted)
+    assert submitted == ["docs/a.txt"]
+
+def test_backfill_resumes_from_checkpoint():
+    keys = [f"{shard}/{index}.txt" for shard in "ab" for index in range(6)]
+    s3_client = make_bucket(keys)
+    submitted = []
+
+    # Each invocation runs out of time after a couple of pages and checkpoints
+    invocations = 0
+    while not backfill(s3_client, submitted, Budget(s3_client, s3_client.list_calls + 2)):
+        invocations += 1
+        assert invocations < 20
+    assert invocations > 1
+    assert sorted(submitted) == sorted(keys)
+
+    # A finished backfill is a no-op
+    assert backfill(s3_client, submitted)
+    assert sorted(submitted) == sorted(keys)
+
+def test_add_lambda_backfill_writes_manifest_per_tier(add_lambda, fake_s3):
+    for index in range(3):
+        fake_s3.put_object('bucket', f"docs/{index}.txt", b"text")
+    fake_s3.put_object('bucket', "docs/scan.pdf", b"x" * (1024 * 1024))
+    # Keys without a known extension are routed without a HEAD request
+    fake_s3.put_object('bucket', "docs/README", b"text")
+    submitted = []
+    add_lambda.run_backfill(
+        fake_s3, 'manifests', 'backfill/test.json', 'bucket', '',
+        lambda bucket_name, objects: (submitted.extend(objects), add_lambda.backfill_objects(bucket_name, objects)),
+        lambda: 60000, 1000,
+    )
+    assert len(submitted) == 5
+    environments = [
+        {variable['name']: variable['value'] for variable in job['containerOverrides']['environment']}
+        for job in add_lambda.batch_client.submitted
+    ]
+    manifests = sorted(
+        sorted(fake_s3.read_json(*environment['MANIFEST_URL'][len("s3://"):].split("/", 1)))
+        for environment in environments
+    )
+    assert manifests == [
+        ["s3://bucket/docs/0.txt", "s3://bucket/docs/1.txt", "s3://bucket/docs/2.txt"],
+        ["s3://bucket/docs/README", "s3://bucket/docs/scan.pdf"],
+    ]
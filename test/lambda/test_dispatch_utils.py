@@ -0,0 +1,63 @@
+# test/lambda/test_dispatch_utils.py
+
+import json
+from dispatch_utils import LocalQueue, MicroBatcher
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_micro_batcher_flushes_at_max_objects():
+    flushed = []
+    batcher = MicroBatcher(flushed.append, max_objects=3, max_bytes=1000, max_wait_seconds=60)
+    for item in range(7):
+        batcher.add(item, size=1)
+    assert flushed == [[0, 1, 2], [3, 4, 5]]
+    batcher.flush()
+    assert flushed[-1] == [6]
+
+def test_micro_batcher_closes_group_before_exceeding_max_bytes():
+    flushed = []
+    batcher = MicroBatcher(flushed.append, max_objects=10, max_bytes=100, max_wait_seconds=60)
+    batcher.add("a", size=60)
+    batcher.add("b", size=60)
+    # An object larger than max_bytes is flushed on its own
+    batcher.add("huge", size=500)
+    assert flushed == [["a"], ["b"], ["huge"]]
+
+def test_micro_batcher_flushes_after_max_wait():
+    flushed = []
+    clock = FakeClock()
+    batcher = MicroBatcher(flushed.append, max_objects=10, max_bytes=1000, max_wait_seconds=5, clock=clock)
+    batcher.add("a")
+    clock.now = 4
+    batcher.flush_if_due()
+    assert flushed == []
+    clock.now = 5
+    batcher.flush_if_due()
+    assert flushed == [["a"]]
+
+def test_local_queue_honours_batch_size_and_window():
+    clock = FakeClock()
+    queue = LocalQueue(clock=clock)
+    queue.send_s3_notification("bucket", "a.pdf", size=10, etag="e1")
+    queue.send_s3_notification("bucket", "b.pdf", size=20, etag="e2")
+    assert queue.receive_event(batch_size=3, max_batching_window_seconds=10) is None
+
+    clock.now = 10
+    event = queue.receive_event(batch_size=3, max_batching_window_seconds=10)
+    keys = [json.loads(record['body'])['Records'][0]['s3']['object']['key'] for record in event['Records']]
+    assert keys == ["a.pdf", "b.pdf"]
+    assert all(record['eventSource'] == 'aws:sqs' for record in event['Records'])
+    assert queue.receive_event(batch_size=3, max_batching_window_seconds=10) is None
+
+def test_local_queue_delivers_full_batches_immediately():
+    queue = LocalQueue(clock=FakeClock())
+    for index in range(5):
+        queue.send_message({'Records': [], 'index': index})
+    assert len(queue.receive_event(batch_size=2, max_batching_window_seconds=60)['Records']) == 2
+    assert len(queue.receive_event(batch_size=2, max_batching_window_seconds=60)['Records']) == 2
+    assert queue.receive_event(batch_size=2, max_batching_window_seconds=60) is None
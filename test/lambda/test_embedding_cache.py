@@ -0,0 +1,72 @@
+# test/lambda/test_embedding_cache.py
+
+import fsspec
+import pytest
+from ingest_utils import CachedEmbedder, EmbeddingCache
+
+class FakeEmbedder:
+    # Embeds a text as its length and records every batch it was sent
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, elements):
+        self.batches.append([element["text"] for element in elements])
+        for element in elements:
+            element["embeddings"] = [float(len(element["text"])), 0.5]
+        return elements
+
+@pytest.fixture
+def store_url(request):
+    # The memory filesystem is shared by the whole process, so each test gets a prefix
+    url = f"memory://embedding-cache/{request.node.name}"
+    yield url
+    fs = fsspec.filesystem("memory")
+    if fs.exists(url):
+        fs.rm(url, recursive=True)
+
+def make_chunks(*texts):
+    return [{"text": text} for text in texts]
+
+def test_lru_evicts_the_least_recently_used_vector():
+    cache = EmbeddingCache("huggingface", "model", max_entries=2)
+    cache.put_many({"a": [1.0], "b": [2.0]})
+    # Reading a makes b the least recently used
+    assert cache.get_many(["a"]) == {"a": [1.0]}
+    cache.put_many({"c": [3.0]})
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.get_many(["a", "b", "c"]) == {"a": [1.0], "c": [3.0]}
+
+def test_store_round_trip(store_url):
+    vectors = {"a": [0.1, -2.5, 3.0], "b": [1e-9, 0.0, 7.25]}
+    EmbeddingCache("huggingface", "model", store_url).put_many(vectors)
+    # A later job starts with an empty memory and reads the vectors from the store
+    cache = EmbeddingCache("huggingface", "model", store_url)
+    assert cache.get_many(["a", "b", "missing"]) == vectors
+    assert list(cache.memory) == ["a", "b"]
+
+def test_keys_depend_on_the_provider_and_model():
+    key = EmbeddingCache("huggingface", "model").key("text")
+    assert key == EmbeddingCache("huggingface", "model").key("text")
+    assert key != EmbeddingCache("huggingface", "other-model").key("text")
+    assert key != EmbeddingCache("openai", "model").key("text")
+
+def test_only_misses_reach_the_embedder(store_url):
+    embedder = FakeEmbedder()
+    cached_embedder = CachedEmbedder(embedder, EmbeddingCache("huggingface", "model", store_url))
+    chunks = cached_embedder.embed_documents(make_chunks("one", "three", "one"))
+    # A text repeated across chunks is embedded once
+    assert embedder.batches == [["one", "three"]]
+    assert [chunk_dict["embeddings"] for chunk_dict in chunks] == [[3.0, 0.5], [5.0, 0.5], [3.0, 0.5]]
+
+    chunks = cached_embedder.embed_documents(make_chunks("three", "seven", "one"))
+    assert embedder.batches[1:] == [["seven"]]
+    assert [chunk_dict["embeddings"] for chunk_dict in chunks] == [[5.0, 0.5], [5.0, 0.5], [3.0, 0.5]]
+    # Chunks count as misses even when their text is embedded once for them all
+    assert (cached_embedder.cache.hits, cached_embedder.cache.misses) == (2, 4)
+
+    # Another job shares the vectors through the store
+    embedder = FakeEmbedder()
+    cached_embedder = CachedEmbedder(embedder, EmbeddingCache("huggingface", "model", store_url))
+    cached_embedder.embed_documents(make_chunks("one", "seven", "eleven"))
+    assert embedder.batches == [["eleven"]]
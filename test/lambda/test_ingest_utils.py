@@ -0,0 +1,171 @@
+# test/lambda/test_ingest_utils.py
+
+import argparse
+import json
+from array import array
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from ingest_utils import (
+    BucketedEmbedder, IngestJob, JobCheckpoint, assign_chunk_ids, get_data_source, get_object_path, get_s3_urls, merge_page_ranges,
+    padding_efficiency, plan_batches, read_manifest,
+)
+
+def test_plan_batches_groups_similar_lengths():
+    lengths = [500, 10, 480, 12, 11, 490]
+    batches = plan_batches(lengths, max_batch_tokens=2000, max_batch_size=3)
+    assert batches == [[1, 4, 3], [2, 5, 0]]
+    assert padding_efficiency(lengths, batches) > 0.9
+
+def test_plan_batches_respects_token_and_size_limits():
+    lengths = [100] * 7 + [1000]
+    batches = plan_batches(lengths, max_batch_tokens=300, max_batch_size=4)
+    assert sorted(index for batch in batches for index in batch) == list(range(8))
+    for batch in batches:
+        assert len(batch) <= 4
+        # A single text longer than the budget still gets a batch of its own
+        assert len(batch) == 1 or len(batch) * max(lengths[index] for index in batch) <= 300
+
+def test_plan_batches_of_nothing():
+    assert plan_batches([], max_batch_tokens=100, max_batch_size=4) == []
+    assert padding_efficiency([], []) == 1.0
+
+def test_read_manifest_formats(tmp_path):
+    json_manifest = tmp_path / "manifest.json"
+    json_manifest.write_text(json.dumps(["s3://bucket/a.pdf", "s3://bucket/b.pdf"]))
+    assert read_manifest(str(json_manifest)) == ["s3://bucket/a.pdf", "s3://bucket/b.pdf"]
+
+    csv_manifest = tmp_path / "manifest.csv"
+    csv_manifest.write_text("bucket,docs/my+file.pdf\n\ns3://other/c.txt\n")
+    assert read_manifest(str(csv_manifest)) == ["s3://bucket/docs/my file.pdf", "s3://other/c.txt"]
+
+def test_get_s3_urls_reads_the_array_child_slice(tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([f"s3://bucket/{index}.txt" for index in range(5)]))
+    monkeypatch.setenv("MANIFEST_URL", str(manifest))
+    monkeypatch.setenv("MANIFEST_SLICE_SIZE", "2")
+    monkeypatch.setenv("AWS_BATCH_JOB_ARRAY_INDEX", "2")
+    assert get_s3_urls(argparse.Namespace(s3_urls=[], manifest=[])) == ["s3://bucket/4.txt"]
+    # URLs on the command line take precedence
+    assert get_s3_urls(argparse.Namespace(s3_urls=["s3://bucket/x.txt"], manifest=[])) == ["s3://bucket/x.txt"]
+
+def test_job_checkpoint_survives_a_retried_attempt(tmp_path):
+    checkpoint = JobCheckpoint(str(tmp_path), "job:1")
+    checkpoint.save("s3://bucket/a.pdf", "done", True)
+
+    retried = JobCheckpoint(str(tmp_path), "job:1")
+    assert retried.load("s3://bucket/a.pdf", "done") is True
+    assert retried.load("s3://bucket/b.pdf", "done") is None
+    retried.clear()
+    assert JobCheckpoint(str(tmp_path), "job:1").load("s3://bucket/a.pdf", "done") is None
+
+def test_job_checkpoint_is_disabled_outside_batch(tmp_path):
+    checkpoint = JobCheckpoint(str(tmp_path), None)
+    checkpoint.save("s3://bucket/a.pdf", "done", True)
+    assert checkpoint.load("s3://bucket/a.pdf", "done") is None
+    assert checkpoint.window_size is None
+
+def test_saved_chunks_leave_out_the_original_elements(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_URL", str(tmp_path))
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "job:1")
+    chunks = [{"element_id": "c1", "text": "Intro", "metadata": {"page_number": 1, "orig_elements": "eJyLjgUAARUAuQ=="}}]
+    IngestJob("pinecone", None, None).save_chunks("s3://bucket/a.pdf", chunks)
+    # The chunks in memory keep them for the destination
+    assert chunks[0]["metadata"]["orig_elements"] == "eJyLjgUAARUAuQ=="
+    saved_chunks = JobCheckpoint(str(tmp_path), "job:1").load("s3://bucket/a.pdf", "chunks")
+    assert saved_chunks == [{"element_id": "c1", "text": "Intro", "metadata": {"page_number": 1}}]
+
+def test_chunk_ids_change_with_the_vector_format(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "huggingface")
+    monkeypatch.setenv("EMBEDDING_MODEL_NAME", "model")
+
+    def chunk_ids():
+        chunks = [{"text": "same"}, {"text": "other"}, {"text": "same"}]
+        return [chunk_dict["element_id"] for chunk_dict in assign_chunk_ids(chunks, "bucket/a.pdf")]
+
+    full_ids = chunk_ids()
+    assert len(set(full_ids)) == 3 and chunk_ids() == full_ids
+    monkeypatch.setenv("VECTOR_DTYPE", "int8")
+    assert set(chunk_ids()).isdisjoint(full_ids)
+    monkeypatch.setenv("VECTOR_DTYPE", "")
+    monkeypatch.setenv("VECTOR_DIMENSIONS", "256")
+    assert set(chunk_ids()).isdisjoint(full_ids)
+
+def test_objects_with_the_same_name_get_different_chunk_ids(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "huggingface")
+    monkeypatch.setenv("EMBEDDING_MODEL_NAME", "model")
+    documents = [get_object_path(f"s3://bucket/{prefix}/report.pdf") for prefix in ("2023", "2024")]
+    chunk_ids = [assign_chunk_ids([{"text": "same"}], document)[0]["element_id"] for document in documents]
+    assert documents == ["bucket/2023/report.pdf", "bucket/2024/report.pdf"]
+    assert chunk_ids[0] != chunk_ids[1]
+
+def test_data_source_comes_from_the_object():
+    last_modified = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    data_source = get_data_source("s3://bucket/docs/a.pdf", {"ETag": '"abc"', "LastModified": last_modified, "size": 3})
+    assert data_source["url"] == "s3://bucket/docs/a.pdf"
+    assert data_source["version"] == "abc"
+    assert float(data_source["date_modified"]) == last_modified.timestamp()
+
+class FakeSentenceTransformer:
+    # One token per word; a text's vector is its word count
+    max_seq_length = 512
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, texts, truncation, max_length):
+        return {"input_ids": [text.split()[:max_length] for text in texts]}
+
+    def encode(self, texts, batch_size, normalize_embeddings):
+        self.batches.append(texts)
+        return array("f", [len(text.split()) for text in texts])
+
+def test_bucketed_embedder_batches_by_token_length(capsys):
+    client = FakeSentenceTransformer()
+    loads = []
+    config = SimpleNamespace(get_client=lambda: loads.append(client) or client, encode_kwargs={"normalize_embeddings": False})
+    embedder = BucketedEmbedder(SimpleNamespace(config=config), max_batch_tokens=40, max_batch_size=4)
+    elements = [{"text": " ".join(["word"] * length)} for length in (20, 1, 19, 2, 1, 18)]
+    for _ in range(2):
+        embedder.embed_documents([dict(element) for element in elements])
+    embedded = embedder.embed_documents(elements)
+
+    assert [element["embeddings"] for element in embedded] == [20, 1, 19, 2, 1, 18]
+    # The model is loaded once, and long texts are not batched with short ones
+    assert len(loads) == 1
+    assert [len(batch) for batch in client.batches[:3]] == [3, 2, 1]
+    assert "Padding efficiency" in capsys.readouterr().out
+
+def make_element(element_id, text, page_number, parent_id=None):
+    metadata = {"page_number": page_number}
+    if parent_id:
+        metadata["parent_id"] = parent_id
+    return {"element_id": element_id, "text": text, "metadata": metadata}
+
+def test_merge_page_ranges_renumbers_pages_and_ids():
+    # Both ranges were partitioned on their own, so they reuse the same element IDs
+    page_ranges = [(1, "part1/report.pdf"), (11, "part2/report.pdf")]
+    range_elements = [
+        [make_element("a", "Intro", 1), make_element("b", "First body", 2, parent_id="a")],
+        [make_element("a", "Results", 1), make_element("b", "Second body", 3, parent_id="a")],
+    ]
+    elements = merge_page_ranges("report.pdf", page_ranges, range_elements)
+    assert [element["text"] for element in elements] == ["Intro", "First body", "Results", "Second body"]
+    assert [element["metadata"]["page_number"] for element in elements] == [1, 2, 11, 13]
+
+    element_ids = [element["element_id"] for element in elements]
+    assert len(set(element_ids)) == 4 and "a" not in element_ids and "b" not in element_ids
+    # Parent IDs point at the parent in the same range
+    assert elements[1]["metadata"]["parent_id"] == elements[0]["element_id"]
+    assert elements[3]["metadata"]["parent_id"] == elements[2]["element_id"]
+
+    # The IDs are derived from the document, so a rerun produces the same ones
+    rerun = merge_page_ranges("report.pdf", page_ranges, [
+        [make_element("a", "Intro", 1), make_element("b", "First body", 2, parent_id="a")],
+        [make_element("a", "Results", 1), make_element("b", "Second body", 3, parent_id="a")],
+    ])
+    assert [element["element_id"] for element in rerun] == element_ids
+
+def test_merge_page_ranges_keeps_an_unsplit_document():
+    elements = [make_element("a", "Intro", 1)]
+    assert merge_page_ranges("report.pdf", [(1, "report.pdf")], [elements]) is elements
+    assert elements[0]["element_id"] == "a"
@@ -0,0 +1,24 @@
+# test/lambda/test_lambda_helpers.py
+#
+# Each Lambda asset is its own directory, so the add and delete Lambdas of every
+# destination carry a copy of the shared helpers. The other tests import the Pinecone
+# copies; the copies must stay identical apart from their path header for those tests
+# to cover the MongoDB and Postgres Lambdas too.
+
+import pytest
+from conftest import LAMBDA_DIR
+
+HELPER_MODULES = ["backfill_utils", "dispatch_utils", "ledger_utils", "routing_utils", "s3_utils"]
+LAMBDA_DIRS = ["s3_mongodb_lambda", "s3_postgres_lambda"]
+
+def read_helper(lambda_dir, module):
+    header, source = (LAMBDA_DIR / lambda_dir / f"{module}.py").read_text().split("\n", 1)
+    assert header == f"# lambda/{lambda_dir}/{module}.py"
+    return source
+
+@pytest.mark.parametrize("lambda_dir", LAMBDA_DIRS)
+@pytest.mark.parametrize("module", HELPER_MODULES)
+def test_helper_copies_match_the_tested_ones(module, lambda_dir):
+    assert read_helper(lambda_dir, module) == read_helper("s3_pinecone_lambda", module), (
+        f"lambda/{lambda_dir}/{module}.py differs from lambda/s3_pinecone_lambda/{module}.py; copy the change to every Lambda"
+    )
@@ -0,0 +1,31 @@
+# test/lambda/test_ledger_utils.py
+
+from concurrent.futures import ThreadPoolExecutor
+from ledger_utils import SQLiteLedger, compute_config_hash, new_ledger_entry
+
+def test_sqlite_ledger_round_trip(tmp_path):
+    ledger = SQLiteLedger(str(tmp_path / "ledger.db"))
+    entry = new_ledger_entry('bucket', 'a.pdf', '"etag"', None, 'hash', 'job-1')
+    ledger.put_many([entry])
+    assert ledger.get('bucket', 'a.pdf') == dict(entry, etag='etag')
+    assert ledger.get_many('bucket', ['a.pdf', 'missing.pdf']).keys() == {'a.pdf'}
+    ledger.delete('bucket', 'a.pdf')
+    assert ledger.get('bucket', 'a.pdf') is None
+
+def test_sqlite_ledger_is_shared_across_threads(tmp_path):
+    ledger = SQLiteLedger(str(tmp_path / "ledger.db"))
+
+    def put_and_get(thread_index):
+        entries = [
+            new_ledger_entry('bucket', f"{thread_index}/{index}.txt", 'etag', None, 'hash')
+            for index in range(50)
+        ]
+        ledger.put_many(entries)
+        return len(ledger.get_many('bucket', [entry['document_key'] for entry in entries]))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(put_and_get, range(8))) == [50] * 8
+
+def test_config_hash_changes_with_settings():
+    assert compute_config_hash('a', 'b') == compute_config_hash('a', 'b')
+    assert compute_config_hash('a', 'b') != compute_config_hash('a', 'c')
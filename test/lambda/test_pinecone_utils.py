@@ -0,0 +1,173 @@
+# test/lambda/test_pinecone_utils.py
+#
+# The Pinecone Lambda has a pinecone_utils of its own ahead on sys.path, so the ingest
+# job's module is loaded from its file
+
+import importlib.util
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+from conftest import LAMBDA_DIR
+
+spec = importlib.util.spec_from_file_location("ingest_pinecone_utils", LAMBDA_DIR / "ingest_job" / "pinecone_utils.py")
+pinecone_utils = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pinecone_utils)
+
+def make_vectors(count, dimension=4):
+    return [{"id": f"v{index}", "values": [0.5] * dimension, "metadata": {"n": index}} for index in range(count)]
+
+class UpsertHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append((dict(self.headers), body))
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+        response = json.dumps({"upsertedCount": len(body["vectors"])} if status == 200 else {"error": "no"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def upsert_server():
+    # Records the upsert requests and answers them with the statuses queued on it
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UpsertHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pinecone_utils.time, "sleep", lambda seconds: None)
+
+class FakeIndex:
+    def __init__(self):
+        self.upserted = []
+
+    def upsert(self, vectors, namespace=None):
+        self.upserted.append((namespace, vectors))
+        return SimpleNamespace(upserted_count=len(vectors))
+
+class FakeGrpcIndex:
+    # Answers async upserts from a pool larger than any uploader's window, failing the
+    # first calls with the errors queued on it and every batch holding failing_id, and
+    # records the most upserts outstanding at once
+
+    def __init__(self, errors=(), failing_id=None):
+        self.executor = ThreadPoolExecutor(max_workers=16)
+        self.lock = threading.Lock()
+        self.errors = list(errors)
+        self.failing_id = failing_id
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    def upsert(self, vectors, namespace=None, async_req=False):
+        assert async_req
+        with self.lock:
+            self.calls.append((namespace, vectors))
+            error = self.errors.pop(0) if self.errors else None
+            if any(vector["id"] == self.failing_id for vector in vectors):
+                error = ConnectionError("down")
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return self.executor.submit(self.respond, vectors, error)
+
+    def respond(self, vectors, error):
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        if error:
+            raise error
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def close(self):
+        self.closed = True
+        self.executor.shutdown()
+
+def test_http_uploader_posts_raw_batches(upsert_server):
+    host = f"http://127.0.0.1:{upsert_server.server_port}"
+    vectors = make_vectors(250)
+    vectors[0]["values"] = array("f", [0.25] * 4)
+    with pinecone_utils.HttpUploader(None, host, "key", max_in_flight=2, api_version="2025-01") as uploader:
+        upserted_count, batch_latencies = uploader.upsert(vectors, "docs")
+    assert upserted_count == 250 and len(batch_latencies) == 3
+    # The request threads are stopped once the uploader is closed
+    with pytest.raises(RuntimeError):
+        uploader.upsert(vectors, "docs")
+
+    bodies = [body for _, body in upsert_server.requests]
+    assert sorted(len(body["vectors"]) for body in bodies) == [50, 100, 100]
+    assert {body["namespace"] for body in bodies} == {"docs"}
+    headers = upsert_server.requests[0][0]
+    assert headers["Api-Key"] == "key" and headers["X-Pinecone-API-Version"] == "2025-01"
+    # Arrays are sent as JSON lists
+    assert [0.25] * 4 in [vector["values"] for body in bodies for vector in body["vectors"]]
+
+def test_http_uploader_retries_only_retryable_statuses(upsert_server):
+    host = f"http://127.0.0.1:{upsert_server.server_port}"
+    uploader = pinecone_utils.HttpUploader(None, host, "key", max_in_flight=1, attempts=3)
+    upsert_server.statuses = [429, 503]
+    assert uploader.upsert(make_vectors(10), "docs")[0] == 10
+    assert len(upsert_server.requests) == 3
+
+    upsert_server.requests.clear()
+    upsert_server.statuses = [400]
+    with pytest.raises(RuntimeError, match="HTTP 400"):
+        uploader.upsert(make_vectors(10), "docs")
+    assert len(upsert_server.requests) == 1
+
+def test_http_uploader_without_host_uses_the_client_index():
+    index = FakeIndex()
+    uploader = pinecone_utils.HttpUploader(index, max_in_flight=2)
+    assert uploader.upsert(make_vectors(150), "docs")[0] == 150
+    assert sorted(len(vectors) for _, vectors in index.upserted) == [50, 100]
+
+@pytest.mark.parametrize("vector, message", [
+    ({"id": 7, "values": [0.5] * 4}, "IDs are strings"),
+    ({"id": "short", "values": [0.5] * 3}, "3 dimension"),
+    ({"id": "nan", "values": [0.5, float("nan"), 0.5, 0.5]}, "NaN or infinite"),
+    ({"id": "inf", "values": [0.5, 0.5, float("inf"), 0.5]}, "NaN or infinite"),
+])
+def test_invalid_vectors_fail_before_any_request(vector, message):
+    index = FakeIndex()
+    uploader = pinecone_utils.HttpUploader(index)
+    with pytest.raises(ValueError, match=message):
+        uploader.upsert(make_vectors(150) + [vector], "docs")
+    assert index.upserted == []
+
+def test_grpc_uploader_bounds_the_batches_in_flight():
+    index = FakeGrpcIndex()
+    with pinecone_utils.GrpcUploader(index, max_in_flight=3) as uploader:
+        upserted_count, batch_latencies = uploader.upsert(make_vectors(1050), "docs")
+    assert upserted_count == 1050 and len(batch_latencies) == 11
+    assert len(index.calls) == 11 and {namespace for namespace, _ in index.calls} == {"docs"}
+    assert 1 < index.max_in_flight <= 3
+    assert index.closed
+
+def test_grpc_uploader_retries_failed_batches():
+    index = FakeGrpcIndex(errors=[ConnectionError("reset"), ConnectionError("reset again")])
+    uploader = pinecone_utils.GrpcUploader(index, max_in_flight=2, attempts=3)
+    assert uploader.upsert(make_vectors(250), "docs")[0] == 250
+    assert len(index.calls) == 5
+
+    # A batch that fails every attempt fails the upload once the others are done
+    index = FakeGrpcIndex(failing_id="v120")
+    uploader = pinecone_utils.GrpcUploader(index, max_in_flight=2, attempts=3)
+    with pytest.raises(RuntimeError, match="1 upsert batch"):
+        uploader.upsert(make_vectors(250), "docs")
+    assert len(index.calls) == 5
@@ -0,0 +1,129 @@
+# test/lambda/test_remote_embedder.py
+#
+# RemoteEmbedder against a local OpenAI-style /embeddings endpoint, pointed at through
+# EMBEDDING_API_BASE_URL as a deployment would
+
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from ingest_utils import TokenBucketLimiter, get_embedder
+
+class EmbeddingsHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["input"]
+        with server.lock:
+            server.requests.append((time.monotonic(), texts))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            rate_limited = server.rate_limited > 0
+            server.rate_limited -= rate_limited
+        try:
+            if rate_limited:
+                self.respond(429, {"error": "rate limited"}, {"Retry-After": str(server.retry_after)})
+                return
+            # Requests finish out of order, and the items of each come back reversed
+            time.sleep(random.uniform(0, server.max_delay))
+            data = [{"index": index, "embedding": [float(text[1:])]} for index, text in enumerate(texts)]
+            self.respond(200, {"data": data[::-1]})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def respond(self, status, body, headers=()):
+        response = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in dict(headers).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def embeddings_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EmbeddingsHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.rate_limited = 0
+    server.retry_after = 0.3
+    server.max_delay = 0.02
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "openai")
+    monkeypatch.setenv("EMBEDDING_MODEL_NAME", "text-embedding-3-small")
+    monkeypatch.setenv("EMBEDDING_PROVIDER_API_KEY", "key")
+    monkeypatch.setenv("EMBEDDING_API_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def make_chunks(count):
+    return [{"text": f"t{index}"} for index in range(count)]
+
+def test_rate_limited_request_waits_for_retry_after(embeddings_server):
+    embeddings_server.rate_limited = 1
+    embedder = get_embedder()
+    chunks = embedder.embed_documents(make_chunks(3))
+    assert [chunk_dict["embeddings"] for chunk_dict in chunks] == [[0.0], [1.0], [2.0]]
+    assert embedder.rate_limited_count == 1 and embedder.request_count == 2
+    (limited_at, _), (retried_at, _) = embeddings_server.requests
+    assert retried_at - limited_at >= 0.3
+
+def test_vectors_keep_the_chunk_order_under_concurrency(embeddings_server, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_BATCH_SIZE", "3")
+    monkeypatch.setenv("EMBEDDING_MAX_IN_FLIGHT", "4")
+    embeddings_server.max_delay = 0.05
+    chunks = get_embedder().embed_documents(make_chunks(60))
+    assert [chunk_dict["embeddings"] for chunk_dict in chunks] == [[float(index)] for index in range(60)]
+    assert len(embeddings_server.requests) == 20
+    assert 1 < embeddings_server.max_in_flight <= 4
+
+def test_requests_per_minute_limit(embeddings_server, monkeypatch):
+    # 120 requests a minute is a burst of 20, then two a second
+    monkeypatch.setenv("EMBEDDING_BATCH_SIZE", "1")
+    monkeypatch.setenv("EMBEDDING_REQUESTS_PER_MINUTE", "120")
+    embeddings_server.max_delay = 0
+    started_at = time.monotonic()
+    get_embedder().embed_documents(make_chunks(22))
+    assert time.monotonic() - started_at >= 0.9
+    arrivals = sorted(arrived_at for arrived_at, _ in embeddings_server.requests)
+    assert arrivals[19] - started_at < 0.5
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_token_bucket_limits_requests_and_tokens():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(requests_per_minute=60, tokens_per_minute=600, clock=clock)
+    # Ten seconds of budget are available at once: 10 requests and 100 tokens
+    for _ in range(10):
+        assert limiter.wait_time(8) == 0
+        asyncio.run(limiter.acquire(8))
+    # The next request waits for the request bucket, a larger one for the token bucket
+    assert limiter.wait_time(8) == pytest.approx(1)
+    clock.now += 1
+    assert limiter.wait_time(8) == 0
+    assert limiter.wait_time(60) == pytest.approx(3)
+
+def test_token_bucket_backs_off_after_a_429():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(requests_per_minute=600, tokens_per_minute=600000, clock=clock)
+    limiter.on_rate_limited(2)
+    assert limiter.wait_time(1) == pytest.approx(2)
+    assert limiter.request_rate == pytest.approx(7.5)
+    for _ in range(25):
+        limiter.on_success()
+    assert limiter.request_rate == pytest.approx(10)
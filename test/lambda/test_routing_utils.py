@@ -0,0 +1,46 @@
+# test/lambda/test_routing_utils.py
+
+import pytest
+from routing_utils import SPLIT_PART_BYTES, TIER_SIZE_LIMITS, classify_file, get_job_tier, get_part_count
+
+@pytest.mark.parametrize("document_key, content_type, file_class", [
+    ("notes/readme.MD", None, 'text'),
+    ("mail/message.eml", None, 'text'),
+    ("reports/q3.docx", None, 'office'),
+    ("scans/page.TIFF", None, 'layout'),
+    # The extension wins over the Content-Type
+    ("reports/q3.pdf", 'text/plain', 'layout'),
+    # Objects without a known extension are classified by their Content-Type
+    ("exports/data", 'application/json; charset=utf-8', 'text'),
+    ("exports/slides", 'application/vnd.openxmlformats-officedocument.presentationml.presentation', 'office'),
+    ("exports/scan", 'IMAGE/PNG', 'layout'),
+    # Binaries the container cannot partition
+    ("tools/setup.exe", None, None),
+    ("tools/setup.exe", 'application/octet-stream', None),
+    ("archives/backup.zip", 'application/zip', None),
+    ("exports/data", None, None),
+])
+def test_classify_file(document_key, content_type, file_class):
+    assert classify_file(document_key, content_type) == file_class
+
+@pytest.mark.parametrize("file_class", sorted(TIER_SIZE_LIMITS))
+def test_job_tier_thresholds(file_class):
+    small_limit, medium_limit = TIER_SIZE_LIMITS[file_class]
+    assert get_job_tier(file_class, 0) == 'small'
+    assert get_job_tier(file_class, small_limit) == 'small'
+    assert get_job_tier(file_class, small_limit + 1) == 'medium'
+    assert get_job_tier(file_class, medium_limit) == 'medium'
+    assert get_job_tier(file_class, medium_limit + 1) == 'large'
+
+def test_a_byte_of_layout_costs_more_than_a_byte_of_text():
+    assert get_job_tier('text', 5 * 1024 * 1024) == 'small'
+    assert get_job_tier('office', 5 * 1024 * 1024) == 'medium'
+    assert get_job_tier('layout', 5 * 1024 * 1024) == 'medium'
+    assert get_job_tier('layout', 100 * 1024 * 1024) == 'large'
+
+def test_only_large_pdfs_are_split():
+    assert get_part_count("a.pdf", SPLIT_PART_BYTES) == 1
+    assert get_part_count("a.PDF", SPLIT_PART_BYTES + 1) == 2
+    assert get_part_count("a.pdf", 350 * 1024 * 1024) == 4
+    assert get_part_count("a.pdf", 1000 * SPLIT_PART_BYTES) == 100
+    assert get_part_count("a.docx", 10 * SPLIT_PART_BYTES) == 1